@@ -0,0 +1,104 @@
+"""
+Caché LRU en memoria con expiración opcional
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+def text_key(*parts: str) -> str:
+    """Clave compacta (hash SHA-256) para uno o varios textos"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class LRUCache(Generic[V]):
+    """
+    Caché LRU acotada por número de entradas, con TTL opcional y
+    contadores de aciertos y fallos.
+    """
+    
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Inicializa la caché
+        
+        Args:
+            max_size: Máximo de entradas (0 deshabilita la caché)
+            ttl: Segundos de validez de cada entrada (0 = sin expiración)
+            clock: Reloj monotónico (inyectable para tests)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def get(self, key: Hashable) -> Optional[V]:
+        """Retorna el valor cacheado (o None) y actualiza los contadores"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        value, expires_at = entry
+        if expires_at and self._clock() > expires_at:
+            del self._data[key]
+            self.misses += 1
+            return None
+        
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def put(self, key: Hashable, value: V) -> None:
+        """Guarda un valor, desalojando el menos usado si se supera el máximo"""
+        if self.max_size <= 0:
+            return
+        expires_at = self._clock() + self.ttl if self.ttl else 0
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+    
+    def pop(self, key: Hashable) -> Optional[V]:
+        """Elimina una entrada y retorna su valor"""
+        entry = self._data.pop(key, None)
+        return entry[0] if entry else None
+    
+    def clear(self) -> None:
+        """Vacía la caché"""
+        self._data.clear()
+    
+    @property
+    def hit_rate(self) -> float:
+        """Proporción de aciertos sobre el total de consultas"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Métricas de la caché"""
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hit_rate, 4),
+        }
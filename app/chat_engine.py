@@ -1,42 +1,56 @@
 """
 Motor de chat usando LangChain con Azure AI Foundry
 """
+import asyncio
 import logging
-from typing import List, Dict, Optional, Any
-from langchain_openai import AzureChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
+import threading
+from contextlib import aclosing
+import openai
+from typing import AsyncIterator, Awaitable, List, Dict, Optional, Any, Tuple
 from langchain.prompts import (
     ChatPromptTemplate,
     MessagesPlaceholder,
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate,
 )
-from langchain_community.callbacks.manager import get_openai_callback
 
 from app.config import AzureAIFoundryConfig, AppConfig
 from app.foundry_client import AzureAIFoundryClient
+from app.llm_pool import get_llm_pool
+from app.memory import create_memory
+from app.response_cache import CacheLookup, create_response_cache
+from app.retrieval import create_retriever, format_context
+from app.router import create_router
+from app.scheduler import SchedulerBusyError
+from app.session import ChatSession
+from app.tokens import count_message_tokens, count_tokens
+from app.tracing import get_tracer
+from app.usage import get_usage_tracker, read_usage
 
 logger = logging.getLogger(__name__)
 
+ERROR_RESPONSE = (
+    "Lo siento, ocurrió un error al procesar tu mensaje. "
+    "Por favor, intenta de nuevo o contacta al administrador si el problema persiste."
+)
 
-class AIFoundryChatEngine:
+BUSY_RESPONSE = (
+    "En este momento estoy atendiendo muchas solicitudes. "
+    "Por favor, intenta de nuevo en unos segundos."
+)
+
+
+class SharedChatResources:
     """
-    Motor de chat que utiliza Azure AI Foundry para conversaciones inteligentes
+    Recursos del motor de chat compartidos por todas las conversaciones:
+    validación de configuración, cliente de AI Foundry, LLM, prompt y cadena.
+    Se construyen una sola vez por proceso.
     """
     
-    def __init__(self, session_id: Optional[str] = None):
-        """
-        Inicializa el motor de chat con Azure AI Foundry
-        
-        Args:
-            session_id: ID de sesión para mantener conversaciones separadas
-        """
+    def __init__(self):
+        """Construye los recursos compartidos"""
         AzureAIFoundryConfig.validate()
         
-        self.session_id = session_id or "default"
-        logger.info(f"Inicializando AIFoundryChatEngine para sesión: {self.session_id}")
-        
         # Inicializar cliente de AI Foundry
         try:
             self.foundry_client = AzureAIFoundryClient()
@@ -45,28 +59,8 @@ class AIFoundryChatEngine:
             logger.warning(f"No se pudo conectar con AI Foundry Client: {e}")
             self.foundry_client = None
         
-        # Configurar Azure OpenAI a través de AI Foundry
-        self.llm = AzureChatOpenAI(
-            azure_endpoint=AzureAIFoundryConfig.OPENAI_ENDPOINT,
-            api_key=AzureAIFoundryConfig.OPENAI_API_KEY,
-            azure_deployment=AzureAIFoundryConfig.OPENAI_DEPLOYMENT,
-            api_version=AzureAIFoundryConfig.OPENAI_API_VERSION,
-            temperature=AzureAIFoundryConfig.TEMPERATURE,
-            max_tokens=AzureAIFoundryConfig.MAX_TOKENS,
-            timeout=AzureAIFoundryConfig.TIMEOUT,
-            model_kwargs={
-                "top_p": 0.95,
-                "frequency_penalty": 0,
-                "presence_penalty": 0
-            }
-        )
-        
-        # Memoria de conversación
-        self.memory = ConversationBufferMemory(
-            return_messages=True,
-            memory_key="history",
-            input_key="input"
-        )
+        # Cliente Azure OpenAI compartido por todas las conversaciones
+        self.llm = get_llm_pool().get()
         
         # Crear prompt template mejorado para AI Foundry
         system_template = f"""{AppConfig.SYSTEM_PROMPT}
@@ -81,63 +75,357 @@ Directrices:
 2. Mantén un tono profesional pero amigable
 3. Si no estás seguro de algo, indícalo claramente
 4. Usa formato markdown cuando sea apropiado para mejor legibilidad"""
-        
-        prompt = ChatPromptTemplate.from_messages([
+
+        self.prompt = ChatPromptTemplate.from_messages([
             SystemMessagePromptTemplate.from_template(system_template),
+            # Fragmentos recuperados del índice de búsqueda (solo con ENABLE_AI_SEARCH)
+            MessagesPlaceholder(variable_name="context", optional=True),
             MessagesPlaceholder(variable_name="history"),
             HumanMessagePromptTemplate.from_template("{input}")
         ])
         
-        # Crear cadena de conversación
-        self.conversation = ConversationChain(
-            llm=self.llm,
-            memory=self.memory,
-            prompt=prompt,
-            verbose=False
-        )
+        # Cadena de conversación sin estado: el historial se pasa en cada llamada
+        self.chain = self.prompt | self.llm
+        
+        # Reparto de llamadas entre deployments, con control de admisión y reintentos
+        self.router = create_router(self.prompt)
+        
+        # Política de memoria (historial completo o ventana + resumen)
+        self.memory = create_memory(self.router)
+        
+        # Caché de respuestas para preguntas repetidas (None si está deshabilitada)
+        self.response_cache = create_response_cache(get_llm_pool())
+        
+        # Recuperación de contexto sobre Azure AI Search (None si está deshabilitada)
+        self.retriever = create_retriever()
+        
+        logger.info("✅ Recursos compartidos del chat engine inicializados")
+
+
+_shared: Optional[SharedChatResources] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_resources() -> SharedChatResources:
+    """Retorna (construyendo la primera vez) los recursos compartidos del proceso"""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = SharedChatResources()
+    return _shared
+
+
+class AIFoundryChatEngine:
+    """
+    Motor de chat que utiliza Azure AI Foundry para conversaciones inteligentes.
+    
+    Es una vista ligera sobre una ChatSession: crearlo no tiene costo y todas
+    las instancias comparten el mismo LLM, prompt y cadena.
+    """
+    
+    __slots__ = ("session",)
+    
+    def __init__(self, session_id: Optional[str] = None, session: Optional[ChatSession] = None):
+        """
+        Inicializa el motor de chat para una sesión
+        
+        Args:
+            session_id: ID de sesión para mantener conversaciones separadas
+            session: Sesión existente (si se omite se crea una nueva)
+        """
+        self.session = session or ChatSession(session_id or "default")
+    
+    @staticmethod
+    def prepare() -> None:
+        """Construye por adelantado los recursos compartidos"""
+        get_shared_resources()
+    
+    @property
+    def session_id(self) -> str:
+        """ID de la sesión"""
+        return self.session.session_id
+    
+    @property
+    def total_tokens_used(self) -> int:
+        """Tokens consumidos por la sesión"""
+        return self.session.total_tokens_used
+    
+    @property
+    def total_calls(self) -> int:
+        """Llamadas al modelo de la sesión"""
+        return self.session.total_calls
+    
+    async def _lookup_cached(
+        self, shared: SharedChatResources, message: str, context: List[Tuple[str, str]]
+    ) -> Optional[CacheLookup]:
+        """
+        Consulta la caché de respuestas si aplica al estado actual de la sesión
+        
+        El contexto recuperado forma parte de la clave: una respuesta basada en
+        otros documentos no se reutiliza.
+        """
+        cache = shared.response_cache
+        if cache is None or not cache.applies_to(self.session):
+            return None
+        return await cache.lookup(message, self.session.history, context)
+    
+    @staticmethod
+    def _start_retrieval(shared: SharedChatResources, message: str) -> Optional["asyncio.Future"]:
+        """
+        Inicia la búsqueda de contexto al comienzo del turno
+        
+        Corre mientras se modera la entrada; se espera antes de consultar la
+        caché de respuestas, cuya clave incluye el contexto recuperado.
+        """
+        if shared.retriever is None:
+            return None
+        return asyncio.ensure_future(shared.retriever.retrieve(message))
+    
+    @staticmethod
+    async def _await_context(retrieval: Optional["asyncio.Future"]) -> List[Tuple[str, str]]:
+        """Mensajes de contexto de la búsqueda iniciada (vacío si no hay)"""
+        if retrieval is None:
+            return []
+        with get_tracer().span("retrieval.wait") as span:
+            documents = await retrieval
+            span.set_attribute("retrieval.documents", len(documents))
+        return format_context(documents)
+    
+    @staticmethod
+    def _estimate_prompt_tokens(
+        history_tokens: int, message: str, context: Optional[List[Any]] = None
+    ) -> int:
+        """Tokens estimados del prompt (contexto, historial y mensaje)"""
+        return count_message_tokens(context or []) + history_tokens + count_tokens(message)
+    
+    def _record_usage(
+        self,
+        usage: Optional[Tuple[int, int]],
+        deployment: Optional[str],
+        user_id: Optional[str],
+        prompt_tokens: int,
+        response: str
+    ) -> int:
+        """
+        Suma el uso de una llamada a la sesión y a los contadores del proceso
         
-        # Estadísticas
-        self.total_tokens_used = 0
-        self.total_calls = 0
+        Si la respuesta no informa el uso (p. ej. en streaming) se estima
+        con el prompt y el texto generado.
         
-        logger.info(f"✅ AIFoundryChatEngine inicializado para sesión: {self.session_id}")
+        Returns:
+            Tokens totales de la llamada
+        """
+        estimated = usage is None
+        if estimated:
+            usage = (prompt_tokens, count_tokens(response))
+        get_usage_tracker().record(
+            self.session_id,
+            user_id,
+            deployment or AzureAIFoundryConfig.OPENAI_DEPLOYMENT,
+            *usage,
+            estimated=estimated
+        )
+        tokens = usage[0] + usage[1]
+        self.session.total_tokens_used += tokens
+        self.session.total_calls += 1
+        return tokens
     
-    async def send_message_async(self, message: str) -> str:
+    def _commit_turn(self, shared: SharedChatResources, message: str, response: str) -> None:
+        """Guarda un intercambio resuelto desde la caché (sin llamada al modelo)"""
+        self.session.add_turn(message, response)
+        logger.info("[%s] Respuesta servida desde la caché", self.session_id)
+        shared.memory.after_turn(self.session)
+    
+    async def send_message_async(
+        self,
+        message: str,
+        commit_gate: Optional[Awaitable[bool]] = None,
+        user_id: Optional[str] = None
+    ) -> str:
         """
         Envía un mensaje de forma asíncrona con tracking de tokens
         
         Args:
             message: Mensaje del usuario
-            
+            commit_gate: Condición opcional (p. ej. la moderación de entrada que
+                corre en paralelo) que debe resolverse True antes de guardar el
+                intercambio en el historial; si resuelve False la respuesta se
+                descarta y se retorna una cadena vacía
+            user_id: Usuario que envió el mensaje (para la contabilidad de uso)
+        
         Returns:
             Respuesta del asistente
         """
+        session = self.session
         try:
-            logger.info(f"[{self.session_id}] Procesando mensaje: {message[:50]}...")
+            logger.info(
+                "[%s] Procesando mensaje: %.50s...", session.session_id, message,
+                extra={"conversation_id": session.session_id}
+            )
+            shared = get_shared_resources()
+            tracer = get_tracer()
+            retrieval = self._start_retrieval(shared, message)
+            context = await self._await_context(retrieval)
             
-            # Usar callback para trackear tokens
-            with get_openai_callback() as cb:
-                response = await self.conversation.apredict(input=message)
-                
-                # Actualizar estadísticas
-                self.total_tokens_used += cb.total_tokens
-                self.total_calls += 1
-                
-                logger.info(
-                    f"[{self.session_id}] Respuesta generada. "
-                    f"Tokens: {cb.total_tokens} "
-                    f"(Prompt: {cb.prompt_tokens}, Completion: {cb.completion_tokens})"
+            with tracer.span("cache.lookup"):
+                lookup = await self._lookup_cached(shared, message, context)
+            if lookup is not None and lookup.response is not None:
+                if commit_gate is not None and not await commit_gate:
+                    return ""
+                self._commit_turn(shared, message, lookup.response)
+                return lookup.response
+            
+            history = shared.memory.build_history(session)
+            tokens_saved = shared.memory.tokens_saved(session)
+            
+            prompt_tokens = self._estimate_prompt_tokens(
+                shared.memory.history_tokens(session), message, context
+            )
+            with tracer.span("llm.invoke", **{"llm.prompt_tokens_estimate": prompt_tokens}) as span:
+                result = await shared.router.ainvoke(
+                    session.session_id,
+                    {"context": context, "history": history, "input": message},
+                    prompt_tokens
                 )
+                response = result.content
+                
+                # El uso viene en la respuesta; se cuenta aunque la moderación la descarte
+                usage = read_usage(result)
+                deployment = result.response_metadata.get("deployment")
+                tokens = self._record_usage(usage, deployment, user_id, prompt_tokens, response)
+                shared.memory.add_tokens_saved(session, tokens_saved)
+                span.set_attribute("llm.deployment", deployment or "")
+                span.set_attribute("llm.tokens", tokens)
             
-            return response
+            if commit_gate is not None:
+                # Tiempo que la respuesta espera a la moderación de entrada
+                with tracer.span("moderation.wait"):
+                    allowed = await commit_gate
+                if not allowed:
+                    logger.info("[%s] Respuesta descartada por la moderación", session.session_id)
+                    return ""
+            
+            # Actualizar historial
+            session.add_turn(message, response)
             
+            logger.info(
+                "[%s] Respuesta generada. Tokens: %s (Prompt: %s, Completion: %s)",
+                session.session_id, tokens, *(usage or ("-", "-")),
+                extra={"conversation_id": session.session_id, "tokens": tokens}
+            )
+            
+            if lookup is not None and response:
+                shared.response_cache.store(lookup, response)
+            shared.memory.after_turn(session)
+            return response
+        
+        except (SchedulerBusyError, openai.RateLimitError) as e:
+            logger.warning(f"[{session.session_id}] Llamada rechazada: {e}")
+            return BUSY_RESPONSE
+        
         except Exception as e:
             error_msg = f"Error al procesar mensaje: {str(e)}"
-            logger.error(f"[{self.session_id}] {error_msg}")
-            return (
-                "Lo siento, ocurrió un error al procesar tu mensaje. "
-                "Por favor, intenta de nuevo o contacta al administrador si el problema persiste."
+            logger.error(f"[{session.session_id}] {error_msg}")
+            return ERROR_RESPONSE
+    
+    async def stream_message_async(
+        self,
+        message: str,
+        user_id: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Envía un mensaje y produce la respuesta en fragmentos a medida que
+        el modelo la genera. El intercambio se agrega al historial solo
+        cuando la respuesta termina.
+        
+        Args:
+            message: Mensaje del usuario
+            user_id: Usuario que envió el mensaje (para la contabilidad de uso)
+            
+        Yields:
+            Fragmentos de texto de la respuesta
+        """
+        session = self.session
+        parts: List[str] = []
+        try:
+            logger.info(
+                "[%s] Procesando mensaje (streaming): %.50s...", session.session_id, message,
+                extra={"conversation_id": session.session_id}
+            )
+            shared = get_shared_resources()
+            tracer = get_tracer()
+            retrieval = self._start_retrieval(shared, message)
+            context = await self._await_context(retrieval)
+            
+            with tracer.span("cache.lookup"):
+                lookup = await self._lookup_cached(shared, message, context)
+            if lookup is not None and lookup.response is not None:
+                parts.append(lookup.response)
+                yield lookup.response
+                self._commit_turn(shared, message, lookup.response)
+                return
+            
+            history = shared.memory.build_history(session)
+            tokens_saved = shared.memory.tokens_saved(session)
+            
+            prompt_tokens = self._estimate_prompt_tokens(
+                shared.memory.history_tokens(session), message, context
+            )
+            deployment = None
+            usage = None
+            # El generador puede reanudarse desde otra tarea: la etapa se termina a mano
+            span = tracer.start_span("llm.stream", **{"llm.prompt_tokens_estimate": prompt_tokens})
+            try:
+                async with aclosing(shared.router.astream(
+                    session.session_id,
+                    {"context": context, "history": history, "input": message},
+                    prompt_tokens
+                )) as chunks:
+                    async for chunk in chunks:
+                        if deployment is None:
+                            # Primer fragmento
+                            deployment = chunk.response_metadata.get("deployment", "")
+                            span.set_attribute("llm.deployment", deployment)
+                            span.set_attribute(
+                                "llm.time_to_first_token_ms", round(span.duration * 1000, 1)
+                            )
+                        if chunk.usage_metadata:
+                            # Solo el último fragmento trae el uso, si el servicio lo informa
+                            usage = read_usage(chunk)
+                        if chunk.content:
+                            parts.append(chunk.content)
+                            yield chunk.content
+                
+                response = "".join(parts)
+                tokens = self._record_usage(usage, deployment, user_id, prompt_tokens, response)
+                shared.memory.add_tokens_saved(session, tokens_saved)
+                span.set_attribute("llm.tokens", tokens)
+            except Exception as e:
+                span.record_error(e)
+                raise
+            finally:
+                span.end()
+            session.add_turn(message, response)
+            
+            logger.info(
+                "[%s] Respuesta (streaming) generada. Tokens: %s", session.session_id, tokens,
+                extra={"conversation_id": session.session_id, "tokens": tokens}
             )
+            
+            if lookup is not None and response:
+                shared.response_cache.store(lookup, response)
+            shared.memory.after_turn(session)
+        
+        except (SchedulerBusyError, openai.RateLimitError) as e:
+            logger.warning(f"[{session.session_id}] Llamada rechazada (streaming): {e}")
+            if not parts:
+                yield BUSY_RESPONSE
+        
+        except Exception as e:
+            logger.error(f"[{session.session_id}] Error al procesar mensaje (streaming): {str(e)}")
+            if not parts:
+                yield ERROR_RESPONSE
     
     def send_message(self, message: str) -> str:
         """
@@ -145,42 +433,50 @@ Directrices:
         
         Args:
             message: Mensaje del usuario
-            
+        
         Returns:
             Respuesta del asistente
         """
+        session = self.session
         try:
-            logger.info(f"[{self.session_id}] Procesando mensaje (sync)...")
+            logger.info(f"[{session.session_id}] Procesando mensaje (sync)...")
+            shared = get_shared_resources()
+            history = shared.memory.build_history(session)
+            tokens_saved = shared.memory.tokens_saved(session)
             
-            with get_openai_callback() as cb:
-                response = self.conversation.predict(input=message)
-                self.total_tokens_used += cb.total_tokens
-                self.total_calls += 1
+            result = shared.chain.invoke({"history": history, "input": message})
+            response = result.content
+            prompt_tokens = self._estimate_prompt_tokens(
+                shared.memory.history_tokens(session), message
+            )
+            self._record_usage(read_usage(result), None, None, prompt_tokens, response)
+            shared.memory.add_tokens_saved(session, tokens_saved)
+            session.add_turn(message, response)
             
+            shared.memory.after_turn(session)
             return response
         except Exception as e:
-            logger.error(f"[{self.session_id}] Error: {str(e)}")
+            logger.error(f"[{session.session_id}] Error: {str(e)}")
             return "Lo siento, ocurrió un error al procesar tu mensaje."
     
     def clear_history(self) -> None:
         """Limpia el historial de conversación"""
         logger.info(f"[{self.session_id}] Limpiando historial")
-        self.memory.clear()
+        self.session.clear()
     
     def get_history(self) -> List[Dict[str, str]]:
         """Obtiene el historial de conversación"""
-        messages = self.memory.chat_memory.messages
         return [
             {
-                "role": msg.type,
-                "content": msg.content
+                "role": role,
+                "content": content
             }
-            for msg in messages
+            for role, content in self.session.history
         ]
     
     def get_message_count(self) -> int:
         """Cuenta mensajes en el historial"""
-        return len(self.memory.chat_memory.messages)
+        return self.session.message_count
     
     def get_statistics(self) -> Dict[str, Any]:
         """
@@ -189,15 +485,20 @@ Directrices:
         Returns:
             Diccionario con estadísticas
         """
+        shared = get_shared_resources()
+        cache = shared.response_cache
         return {
             "session_id": self.session_id,
             "message_count": self.get_message_count(),
             "total_tokens_used": self.total_tokens_used,
             "total_calls": self.total_calls,
             "average_tokens_per_call": (
-                self.total_tokens_used // self.total_calls 
+                self.total_tokens_used // self.total_calls
                 if self.total_calls > 0 else 0
             ),
             "model": AzureAIFoundryConfig.OPENAI_DEPLOYMENT,
-            "project": AzureAIFoundryConfig.PROJECT_NAME
+            "project": AzureAIFoundryConfig.PROJECT_NAME,
+            "response_cache_hit_rate": cache.hit_rate if cache is not None else None,
+            "usage": get_usage_tracker().get_conversation(self.session_id),
+            **shared.memory.get_statistics(self.session)
         }
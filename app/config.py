@@ -2,17 +2,13 @@
 Configuración centralizada para Azure AI Foundry + Teams Bot
 """
 import os
+import json
 import logging
-from typing import Optional
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
-logging.basicConfig(
-    level=os.getenv("LOG_LEVEL", "INFO"),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
 logger = logging.getLogger(__name__)
 
 
@@ -34,20 +30,75 @@ class AzureAIFoundryConfig:
     OPENAI_DEPLOYMENT: str = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "")
     OPENAI_API_VERSION: str = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
     
+    # Deployments adicionales para repartir carga (lista JSON, ver .env.example)
+    OPENAI_BACKENDS: str = os.getenv("AZURE_OPENAI_BACKENDS", "")
+    ROUTER_FAILURE_THRESHOLD: int = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "5"))
+    ROUTER_COOLDOWN: float = float(os.getenv("ROUTER_COOLDOWN_SECONDS", "30"))
+    
     # Model Parameters
     TEMPERATURE: float = float(os.getenv("APP_TEMPERATURE", "0.7"))
     MAX_TOKENS: int = int(os.getenv("APP_MAX_TOKENS", "2000"))
     TIMEOUT: int = int(os.getenv("REQUEST_TIMEOUT", "30"))
     
+    # Pool de conexiones HTTP compartido por todas las conversaciones
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    LLM_KEEPALIVE_EXPIRY: float = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+    
+    # Control de admisión de llamadas al modelo (por deployment)
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+    LLM_TOKENS_PER_MINUTE: int = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+    LLM_MAX_QUEUE: int = int(os.getenv("LLM_MAX_QUEUE", "200"))
+    LLM_QUEUE_TIMEOUT: float = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "20"))
+    
+    # Reintentos ante 429/5xx (dentro del presupuesto de REQUEST_TIMEOUT)
+    LLM_RETRY_MAX_ATTEMPTS: int = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "4"))
+    LLM_RETRY_BASE_DELAY: float = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+    LLM_RETRY_MAX_DELAY: float = float(os.getenv("LLM_RETRY_MAX_DELAY_SECONDS", "8"))
+    
+    # Credencial de Azure AD compartida: margen antes de expirar en que se renuevan los tokens
+    CREDENTIAL_REFRESH_MARGIN: float = float(
+        os.getenv("AZURE_CREDENTIAL_REFRESH_MARGIN_SECONDS", "600")
+    )
+    
     # Content Safety
     ENABLE_CONTENT_SAFETY: bool = os.getenv("ENABLE_CONTENT_SAFETY", "true").lower() == "true"
     CONTENT_SAFETY_THRESHOLD: str = os.getenv("CONTENT_SAFETY_THRESHOLD", "medium")
+    CONTENT_SAFETY_ENDPOINT: str = os.getenv("CONTENT_SAFETY_ENDPOINT", "")
+    CONTENT_SAFETY_KEY: str = os.getenv("CONTENT_SAFETY_KEY", "")
+    CONTENT_SAFETY_BATCH_WINDOW: float = (
+        float(os.getenv("CONTENT_SAFETY_BATCH_WINDOW_MS", "5")) / 1000
+    )
+    CONTENT_SAFETY_MAX_CONCURRENCY: int = int(os.getenv("CONTENT_SAFETY_MAX_CONCURRENCY", "8"))
+    CONTENT_SAFETY_CACHE_SIZE: int = int(os.getenv("CONTENT_SAFETY_CACHE_SIZE", "2048"))
+    CONTENT_SAFETY_CACHE_TTL: float = float(os.getenv("CONTENT_SAFETY_CACHE_TTL_SECONDS", "3600"))
+    CONTENT_SAFETY_PREFILTER: bool = os.getenv("CONTENT_SAFETY_PREFILTER", "true").lower() == "true"
+    CONTENT_SAFETY_BLOCKLIST: str = os.getenv("CONTENT_SAFETY_BLOCKLIST", "")
+    CONTENT_SAFETY_BLOCKLIST_FILE: str = os.getenv("CONTENT_SAFETY_BLOCKLIST_FILE", "")
+    CONTENT_SAFETY_ALLOWLIST: str = os.getenv("CONTENT_SAFETY_ALLOWLIST", "")
     
     # AI Search (RAG)
     ENABLE_AI_SEARCH: bool = os.getenv("ENABLE_AI_SEARCH", "false").lower() == "true"
     AI_SEARCH_ENDPOINT: str = os.getenv("AI_SEARCH_ENDPOINT", "")
     AI_SEARCH_KEY: str = os.getenv("AI_SEARCH_KEY", "")
     AI_SEARCH_INDEX: str = os.getenv("AI_SEARCH_INDEX_NAME", "")
+    # "azure" (Azure AI Search) o "memory" (índice local cargado de AI_SEARCH_LOCAL_INDEX_FILE)
+    AI_SEARCH_BACKEND: str = os.getenv("AI_SEARCH_BACKEND", "azure").lower()
+    AI_SEARCH_LOCAL_INDEX_FILE: str = os.getenv("AI_SEARCH_LOCAL_INDEX_FILE", "")
+    AI_SEARCH_API_VERSION: str = os.getenv("AI_SEARCH_API_VERSION", "2023-11-01")
+    AI_SEARCH_SEMANTIC_CONFIG: str = os.getenv("AI_SEARCH_SEMANTIC_CONFIG", "")
+    # Campos del índice con el texto, el título y el origen de cada documento
+    AI_SEARCH_CONTENT_FIELD: str = os.getenv("AI_SEARCH_CONTENT_FIELD", "content")
+    AI_SEARCH_TITLE_FIELD: str = os.getenv("AI_SEARCH_TITLE_FIELD", "title")
+    AI_SEARCH_SOURCE_FIELD: str = os.getenv("AI_SEARCH_SOURCE_FIELD", "source")
+    # Documentos por consulta y tokens máximos de contexto que se agregan al prompt
+    AI_SEARCH_TOP_K: int = int(os.getenv("AI_SEARCH_TOP_K", "5"))
+    AI_SEARCH_TOKEN_BUDGET: int = int(os.getenv("AI_SEARCH_TOKEN_BUDGET", "1500"))
+    AI_SEARCH_MIN_SCORE: float = float(os.getenv("AI_SEARCH_MIN_SCORE", "0"))
+    AI_SEARCH_TIMEOUT: float = float(os.getenv("AI_SEARCH_TIMEOUT_SECONDS", "5"))
+    # Caché de resultados por consulta
+    AI_SEARCH_CACHE_SIZE: int = int(os.getenv("AI_SEARCH_CACHE_SIZE", "1024"))
+    AI_SEARCH_CACHE_TTL: float = float(os.getenv("AI_SEARCH_CACHE_TTL_SECONDS", "300"))
     
     @classmethod
     def validate(cls) -> bool:
@@ -74,12 +125,52 @@ class AzureAIFoundryConfig:
             raise ValueError(error_msg)
         
         if cls.ENABLE_AI_SEARCH:
-            if not cls.AI_SEARCH_ENDPOINT or not cls.AI_SEARCH_KEY:
-                raise ValueError("AI Search habilitado pero faltan credenciales")
+            if cls.AI_SEARCH_BACKEND == "memory":
+                if not cls.AI_SEARCH_LOCAL_INDEX_FILE:
+                    raise ValueError(
+                        "AI Search local habilitado pero falta AI_SEARCH_LOCAL_INDEX_FILE"
+                    )
+            elif not cls.AI_SEARCH_ENDPOINT or not cls.AI_SEARCH_INDEX:
+                # Sin AI_SEARCH_KEY se usa la credencial compartida de Azure AD
+                raise ValueError(
+                    "AI Search habilitado pero faltan AI_SEARCH_ENDPOINT o AI_SEARCH_INDEX_NAME"
+                )
         
         logger.info("✅ Configuración de Azure AI Foundry validada")
         return True
     
+    @classmethod
+    def get_backends(cls) -> List[dict]:
+        """
+        Deployments de Azure OpenAI disponibles: el principal y los adicionales
+        de AZURE_OPENAI_BACKENDS
+        
+        Returns:
+            Lista de diccionarios con name, endpoint, deployment y, opcionalmente,
+            api_key, api_version, weight y tokens_per_minute
+        """
+        backends = [{
+            "name": "primary",
+            "endpoint": cls.OPENAI_ENDPOINT,
+            "deployment": cls.OPENAI_DEPLOYMENT,
+            "weight": 1,
+        }]
+        if not cls.OPENAI_BACKENDS:
+            return backends
+        
+        try:
+            extra = json.loads(cls.OPENAI_BACKENDS)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"AZURE_OPENAI_BACKENDS no es JSON válido: {e}")
+        
+        for index, backend in enumerate(extra, start=1):
+            if not backend.get("endpoint") or not backend.get("deployment"):
+                raise ValueError(
+                    f"AZURE_OPENAI_BACKENDS[{index - 1}]: faltan endpoint o deployment"
+                )
+            backends.append({"name": f"backend-{index}", **backend})
+        return backends
+    
     @classmethod
     def get_info(cls) -> dict:
         """Retorna información de configuración (sin datos sensibles)"""
@@ -89,6 +180,7 @@ class AzureAIFoundryConfig:
             "deployment": cls.OPENAI_DEPLOYMENT,
             "temperature": cls.TEMPERATURE,
             "max_tokens": cls.MAX_TOKENS,
+            "backends": [backend["name"] for backend in cls.get_backends()],
             "content_safety": cls.ENABLE_CONTENT_SAFETY,
             "ai_search": cls.ENABLE_AI_SEARCH
         }
@@ -103,6 +195,27 @@ class BotConfig:
     PORT: int = int(os.getenv("BOT_PORT", "3978"))
     HOST: str = os.getenv("HOST", "0.0.0.0")
     
+    # Respuestas progresivas (streaming) actualizando el mensaje enviado
+    ENABLE_STREAMING: bool = os.getenv("ENABLE_STREAMING", "false").lower() == "true"
+    STREAM_UPDATE_INTERVAL: float = float(os.getenv("STREAM_UPDATE_INTERVAL_MS", "800")) / 1000
+    STREAM_MIN_CHUNK_CHARS: int = int(os.getenv("STREAM_MIN_CHUNK_CHARS", "60"))
+    # Con Content Safety: caracteres nuevos mínimos entre actualizaciones (cada una se modera)
+    STREAM_MODERATION_MIN_CHARS: int = int(os.getenv("STREAM_MODERATION_MIN_CHARS", "400"))
+    
+    # Mensajes que llegan mientras la conversación tiene un turno en curso:
+    # se agrupan en una sola llamada al modelo (hasta COALESCE_MAX_MESSAGES)
+    COALESCE_MESSAGES: bool = os.getenv("COALESCE_MESSAGES", "false").lower() == "true"
+    COALESCE_MAX_MESSAGES: int = int(os.getenv("COALESCE_MAX_MESSAGES", "5"))
+    
+    # Procesos que atienden el puerto (1 = un solo proceso, 0 = uno por CPU)
+    WORKERS: int = int(os.getenv("BOT_WORKERS", "1"))
+    # Reenviar cada conversación siempre al mismo worker (sus turnos y caché quedan en un proceso)
+    WORKER_AFFINITY: bool = os.getenv("BOT_WORKER_AFFINITY", "true").lower() == "true"
+    # Directorio de los sockets internos entre workers (vacío = directorio temporal)
+    WORKER_SOCKET_DIR: str = os.getenv("BOT_WORKER_SOCKET_DIR", "")
+    # Segundos para terminar los turnos en curso al detener o reiniciar un worker
+    SHUTDOWN_TIMEOUT: float = float(os.getenv("BOT_SHUTDOWN_TIMEOUT_SECONDS", "30"))
+    
     @classmethod
     def validate(cls) -> bool:
         """Valida configuraciones del bot"""
@@ -127,6 +240,103 @@ class BotConfig:
         return True
 
 
+class SessionConfig:
+    """Límites del almacén de conversaciones en memoria"""
+    
+    MAX_SESSIONS: int = int(os.getenv("SESSION_MAX_COUNT", "5000"))
+    IDLE_TTL: float = float(os.getenv("SESSION_IDLE_TTL_SECONDS", "3600"))
+    MEMORY_BUDGET_BYTES: int = int(
+        float(os.getenv("SESSION_MEMORY_BUDGET_MB", "256")) * 1024 * 1024
+    )
+    SWEEP_INTERVAL: float = float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "60"))
+    
+    # Almacén compartido entre procesos: "" (solo memoria local) | "memory" | "sqlite" | "redis"
+    STORE_BACKEND: str = os.getenv("SESSION_STORE_BACKEND", "").lower()
+    # Ruta del archivo SQLite o URL redis://[:password@]host:port/db
+    STORE_URL: str = os.getenv("SESSION_STORE_URL", "")
+    STORE_TTL: float = float(os.getenv("SESSION_STORE_TTL_SECONDS", "86400"))
+    # Escritura diferida: las sesiones modificadas se guardan en lotes
+    WRITE_BEHIND_INTERVAL: float = float(os.getenv("SESSION_WRITE_BEHIND_INTERVAL_SECONDS", "0.5"))
+    WRITE_BEHIND_MAX_BATCH: int = int(os.getenv("SESSION_WRITE_BEHIND_MAX_BATCH", "100"))
+    # Releer la sesión del almacén al empezar cada turno (otro proceso pudo atenderla)
+    STORE_REVALIDATE: bool = os.getenv("SESSION_STORE_REVALIDATE", "true").lower() == "true"
+
+
+class MemoryConfig:
+    """Memoria de conversación enviada al modelo"""
+    
+    # "buffer": historial completo | "summary": últimos turnos + resumen acumulado
+    MODE: str = os.getenv("MEMORY_MODE", "buffer").lower()
+    MAX_TURNS: int = int(os.getenv("MEMORY_MAX_TURNS", "10"))
+    TOKEN_BUDGET: int = int(os.getenv("MEMORY_TOKEN_BUDGET", "2000"))
+    SUMMARY_MAX_TOKENS: int = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "300"))
+
+
+class ResponseCacheConfig:
+    """Caché de respuestas para preguntas repetidas"""
+    
+    ENABLED: bool = os.getenv("ENABLE_RESPONSE_CACHE", "false").lower() == "true"
+    MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    TTL: float = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+    # "first_turn": solo preguntas sin historial previo | "all": cualquier mensaje
+    SCOPE: str = os.getenv("RESPONSE_CACHE_SCOPE", "first_turn").lower()
+    # Deployment de embeddings para el nivel semántico (vacío = solo coincidencia exacta)
+    EMBEDDING_DEPLOYMENT: str = os.getenv("RESPONSE_CACHE_EMBEDDING_DEPLOYMENT", "")
+    MIN_SIMILARITY: float = float(os.getenv("RESPONSE_CACHE_MIN_SIMILARITY", "0.92"))
+
+
+class UsageConfig:
+    """Contabilidad de uso de tokens"""
+    
+    # Ventanas de tiempo que se conservan (por defecto la última hora, por minuto)
+    WINDOW: float = float(os.getenv("USAGE_WINDOW_SECONDS", "60"))
+    WINDOWS: int = int(os.getenv("USAGE_WINDOWS", "60"))
+    # Máximo de conversaciones y de usuarios con contadores propios
+    # (los menos recientes se descartan)
+    MAX_KEYS: int = int(os.getenv("USAGE_MAX_KEYS", "10000"))
+
+
+class TracingConfig:
+    """Trazas por etapa de los turnos (formato OTLP/JSON)"""
+    
+    # Fracción de turnos trazados (0 = ninguno, 1 = todos)
+    SAMPLE_RATE: float = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+    # Exportar también los turnos más lentos que este umbral (0 = deshabilitado)
+    SLOW_THRESHOLD: float = float(os.getenv("TRACE_SLOW_TURN_MS", "0")) / 1000
+    # "stdout" o "file"
+    EXPORTER: str = os.getenv("TRACE_EXPORTER", "stdout").lower()
+    FILE: str = os.getenv("TRACE_FILE", "traces.jsonl")
+
+
+class LoggingConfig:
+    """Configuración de logs (ver app.logging_setup)"""
+    
+    LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    # "text" o "json" (un objeto por línea)
+    FORMAT: str = os.getenv("LOG_FORMAT", "text").lower()
+    # Escribir los logs desde un hilo propio en lugar del bucle de eventos
+    ASYNC: bool = os.getenv("LOG_ASYNC", "true").lower() == "true"
+    # Muestreo de líneas INFO/DEBUG por logger: "app.chat_engine=0.1,bot.teams_bot=0.1"
+    SAMPLING: str = os.getenv("LOG_SAMPLING", "")
+    
+    @classmethod
+    def get_sampling(cls) -> Dict[str, float]:
+        """
+        Fracción de líneas que se conservan por logger (y sus descendientes)
+        
+        Returns:
+            Diccionario nombre de logger -> fracción entre 0 y 1
+        """
+        rates = {}
+        for item in filter(None, (part.strip() for part in cls.SAMPLING.split(","))):
+            name, _, rate = item.partition("=")
+            try:
+                rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+            except ValueError:
+                raise ValueError(f"LOG_SAMPLING: valor inválido en '{item}'")
+        return rates
+
+
 class AppConfig:
     """Configuración de la aplicación"""
     
@@ -0,0 +1,238 @@
+"""
+Credencial de Azure compartida por el proceso, con caché de tokens y renovación anticipada
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from app.config import AzureAIFoundryConfig
+
+logger = logging.getLogger(__name__)
+
+# Scope de los servicios de Azure AI (Content Safety, Azure OpenAI)
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+# (scopes, tenant_id)
+TokenKey = Tuple[Tuple[str, ...], Optional[str]]
+
+
+def _default_credential() -> Any:
+    from azure.identity import DefaultAzureCredential
+    return DefaultAzureCredential()
+
+
+class TokenProvider:
+    """
+    Credencial única del proceso con caché de tokens por scope
+    
+    DefaultAzureCredential recorre su cadena de orígenes (entorno, identidad
+    administrada, CLI...) cada vez que se instancia y pide un token en cada
+    cliente nuevo. Aquí se crea una sola vez y los tokens se reutilizan
+    mientras les queden más de `refresh_margin` segundos; la tarea de
+    renovación los reemplaza cuando les quedan menos del doble, de modo que
+    los turnos de los usuarios siempre encuentran un token válido en caché.
+    
+    Implementa el protocolo TokenCredential de azure-core (get_token), por
+    lo que puede pasarse a los clientes síncronos del SDK; para los
+    asíncronos usar `async_credential()`.
+    """
+    
+    # Máximo y mínimo entre revisiones de la tarea de renovación (segundos)
+    CHECK_INTERVAL = 60.0
+    RETRY_INTERVAL = 10.0
+    
+    def __init__(
+        self,
+        credential_factory: Optional[Callable[[], Any]] = None,
+        refresh_margin: Optional[float] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Inicializa el proveedor (la credencial se crea en el primer uso)
+        
+        Args:
+            credential_factory: Crea la credencial subyacente (por defecto DefaultAzureCredential)
+            refresh_margin: Segundos antes de expirar en que un token deja de usarse
+            clock: Reloj en segundos epoch (como `expires_on` de los tokens)
+        """
+        self._factory = credential_factory or _default_credential
+        self.refresh_margin = (
+            refresh_margin if refresh_margin is not None
+            else AzureAIFoundryConfig.CREDENTIAL_REFRESH_MARGIN
+        )
+        self._clock = clock
+        self._credential: Any = None
+        self._tokens: Dict[TokenKey, Any] = {}
+        self._wanted: Set[TokenKey] = set()
+        self._lock = threading.RLock()
+        self._refresher: Optional[asyncio.Task] = None
+        self.stats = {"hits": 0, "fetches": 0, "refreshes": 0, "errors": 0}
+    
+    @property
+    def credential(self) -> Any:
+        """Credencial subyacente (creada una sola vez)"""
+        if self._credential is None:
+            with self._lock:
+                if self._credential is None:
+                    self._credential = self._factory()
+        return self._credential
+    
+    def _remaining(self, token: Any) -> float:
+        return token.expires_on - self._clock() if token is not None else 0.0
+    
+    def get_token(self, *scopes: str, claims: Optional[str] = None,
+                  tenant_id: Optional[str] = None, **kwargs: Any) -> Any:
+        """
+        Obtiene un token de acceso (de la caché si sigue vigente)
+        
+        Las solicitudes con `claims` (desafíos de acceso continuo) siempre
+        van a la credencial.
+        """
+        if claims:
+            return self.credential.get_token(*scopes, claims=claims, tenant_id=tenant_id, **kwargs)
+        
+        key = (scopes, tenant_id)
+        token = self._tokens.get(key)
+        if self._remaining(token) > self.refresh_margin:
+            self.stats["hits"] += 1
+            return token
+        
+        with self._lock:
+            token = self._tokens.get(key)
+            if self._remaining(token) > self.refresh_margin:
+                self.stats["hits"] += 1
+                return token
+            return self._fetch(key)
+    
+    def _fetch(self, key: TokenKey) -> Any:
+        scopes, tenant_id = key
+        kwargs = {"tenant_id": tenant_id} if tenant_id else {}
+        try:
+            token = self.credential.get_token(*scopes, **kwargs)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        self._tokens[key] = token
+        self._wanted.add(key)
+        self.stats["fetches"] += 1
+        return token
+    
+    async def get_token_async(self, *scopes: str, **kwargs: Any) -> Any:
+        """Versión asíncrona de get_token (la credencial se consulta en un hilo)"""
+        if not kwargs.get("claims"):
+            token = self._tokens.get((scopes, kwargs.get("tenant_id")))
+            if self._remaining(token) > self.refresh_margin:
+                self.stats["hits"] += 1
+                return token
+        return await asyncio.to_thread(self.get_token, *scopes, **kwargs)
+    
+    def async_credential(self) -> "AsyncTokenCredential":
+        """Adaptador para los clientes asíncronos del SDK de Azure"""
+        return AsyncTokenCredential(self)
+    
+    def register(self, *scopes: str, tenant_id: Optional[str] = None) -> None:
+        """Declara un scope que se usará, para obtener su token antes del primer turno"""
+        self._wanted.add((scopes, tenant_id))
+    
+    def refresh_due(self) -> int:
+        """
+        Obtiene los tokens registrados que faltan o están por expirar
+        
+        Returns:
+            Número de tokens obtenidos
+        """
+        refreshed = 0
+        for key in list(self._wanted):
+            if self._remaining(self._tokens.get(key)) > 2 * self.refresh_margin:
+                continue
+            try:
+                with self._lock:
+                    self._fetch(key)
+            except Exception as e:
+                logger.warning(f"No se pudo renovar el token de {', '.join(key[0])}: {e}")
+                continue
+            self.stats["refreshes"] += 1
+            refreshed += 1
+        return refreshed
+    
+    def _next_check(self) -> float:
+        """Segundos hasta que algún token registrado necesite renovarse"""
+        delay = self.CHECK_INTERVAL
+        for key in self._wanted:
+            due = self._remaining(self._tokens.get(key)) - 2 * self.refresh_margin
+            delay = min(delay, max(due, self.RETRY_INTERVAL))
+        return delay
+    
+    async def _refresh_loop(self) -> None:
+        while True:
+            if self._wanted:
+                await asyncio.to_thread(self.refresh_due)
+            await asyncio.sleep(self._next_check())
+    
+    def start(self) -> None:
+        """Inicia la renovación en segundo plano (requiere un bucle de eventos activo)"""
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.get_running_loop().create_task(self._refresh_loop())
+    
+    async def close(self) -> None:
+        """Detiene la renovación y cierra la credencial subyacente"""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+        credential, self._credential = self._credential, None
+        self._tokens.clear()
+        close = getattr(credential, "close", None)
+        if close is not None:
+            close()
+    
+    def get_statistics(self) -> Dict[str, Any]:
+        """Obtiene estadísticas de la caché de tokens"""
+        return {
+            **self.stats,
+            "tokens": len(self._tokens),
+            "expires_in": {
+                " ".join(scopes): round(self._remaining(token))
+                for (scopes, _), token in self._tokens.items()
+            },
+            "refreshing": self._refresher is not None and not self._refresher.done(),
+        }
+
+
+class AsyncTokenCredential:
+    """
+    Protocolo AsyncTokenCredential de azure-core sobre el proveedor compartido
+    
+    Cerrar el adaptador no cierra la credencial: es del proceso y la cierra
+    `TokenProvider.close()`.
+    """
+    
+    def __init__(self, provider: TokenProvider):
+        self.provider = provider
+    
+    async def get_token(self, *scopes: str, **kwargs: Any) -> Any:
+        return await self.provider.get_token_async(*scopes, **kwargs)
+    
+    async def close(self) -> None:
+        pass
+    
+    async def __aenter__(self) -> "AsyncTokenCredential":
+        return self
+    
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+
+_provider: Optional[TokenProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_token_provider() -> TokenProvider:
+    """Retorna el proveedor de credenciales del proceso"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = TokenProvider()
+    return _provider
@@ -0,0 +1,40 @@
+"""
+Serialización JSON rápida (orjson si está instalado, json de la biblioteca estándar si no)
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+# Implementación en uso ("orjson" o "json")
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """Decodifica JSON desde bytes o texto"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Codifica a JSON compacto en UTF-8
+    
+    Los tipos que orjson no admite (p. ej. claves no textuales) se
+    codifican con la biblioteca estándar.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj: Any) -> str:
+    """Codifica a JSON compacto como texto"""
+    return dumps(obj).decode("utf-8")
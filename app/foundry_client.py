@@ -3,7 +3,8 @@ Cliente para Azure AI Foundry
 """
 import logging
 from typing import Optional, Dict, Any
-from azure.identity import DefaultAzureCredential
+
+from app.credentials import get_token_provider
 
 # ⚠️ azure-ai-ml está comentado debido a problemas de compatibilidad
 # Ver docs/AZURE_AI_ML_SETUP.md para alternativas
@@ -26,9 +27,6 @@ class AzureAIFoundryClient:
         try:
             logger.info("Inicializando Azure AI Foundry Client...")
             
-            # Crear credencial de Azure
-            self.credential = DefaultAzureCredential()
-            
             # MLClient está deshabilitado - usando Azure OpenAI directamente
             self.ml_client = None
             logger.warning("MLClient deshabilitado. Usando Azure OpenAI directamente.")
@@ -42,6 +40,11 @@ class AzureAIFoundryClient:
             logger.error(f"Error inicializando Azure AI Foundry Client: {e}")
             raise
     
+    @property
+    def credential(self):
+        """Credencial de Azure compartida por el proceso (con caché de tokens)"""
+        return get_token_provider()
+    
     def get_project_info(self) -> Dict[str, Any]:
         """
         Obtiene información del proyecto de AI Foundry
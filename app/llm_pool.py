@@ -0,0 +1,213 @@
+"""
+Registro compartido de clientes LLM para Azure OpenAI
+"""
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
+
+from app.config import AzureAIFoundryConfig
+
+logger = logging.getLogger(__name__)
+
+PoolKey = Tuple[str, str, str]
+
+# Reintentos del SDK de OpenAI para los clientes que no usan app.retry
+SDK_MAX_RETRIES = 2
+
+
+class LLMClientPool:
+    """
+    Registro de clientes AzureChatOpenAI compartidos por todo el proceso.
+    
+    Cada combinación endpoint/deployment/api-version tiene un único cliente
+    con su propio pool de conexiones HTTP (sync y async), de modo que todas
+    las conversaciones reutilizan las mismas conexiones keep-alive. El router,
+    que reintenta con app.retry, usa una variante sin reintentos del SDK que
+    comparte esos mismos pools.
+    """
+    
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+    ):
+        """
+        Inicializa el registro
+        
+        Args:
+            max_connections: Máximo de conexiones simultáneas por cliente
+            max_keepalive_connections: Máximo de conexiones ociosas retenidas
+            keepalive_expiry: Segundos que una conexión ociosa se mantiene abierta
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections or AzureAIFoundryConfig.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=(
+                max_keepalive_connections or AzureAIFoundryConfig.LLM_MAX_KEEPALIVE_CONNECTIONS
+            ),
+            keepalive_expiry=(
+                keepalive_expiry if keepalive_expiry is not None
+                else AzureAIFoundryConfig.LLM_KEEPALIVE_EXPIRY
+            ),
+        )
+        self._clients: Dict[Tuple[PoolKey, bool], AzureChatOpenAI] = {}
+        self._embeddings: Dict[PoolKey, AzureOpenAIEmbeddings] = {}
+        self._http_clients: Dict[PoolKey, Tuple[httpx.Client, httpx.AsyncClient]] = {}
+        self._lock = threading.Lock()
+    
+    def get(
+        self,
+        endpoint: Optional[str] = None,
+        deployment: Optional[str] = None,
+        api_version: Optional[str] = None,
+        api_key: Optional[str] = None,
+        managed_retries: bool = False,
+    ) -> AzureChatOpenAI:
+        """
+        Obtiene (o crea una única vez) el cliente para un deployment
+        
+        Args:
+            endpoint: Endpoint de Azure OpenAI (por defecto el configurado)
+            deployment: Nombre del deployment (por defecto el configurado)
+            api_version: Versión de la API (por defecto la configurada)
+            api_key: Clave de API (por defecto la configurada)
+            managed_retries: El llamador reintenta por su cuenta (app.retry);
+                el cliente no reintenta. Si es False se usan los reintentos del SDK.
+        
+        Returns:
+            Cliente AzureChatOpenAI compartido
+        """
+        key = (
+            endpoint or AzureAIFoundryConfig.OPENAI_ENDPOINT,
+            deployment or AzureAIFoundryConfig.OPENAI_DEPLOYMENT,
+            api_version or AzureAIFoundryConfig.OPENAI_API_VERSION,
+        )
+        client = self._clients.get((key, managed_retries))
+        if client is not None:
+            return client
+        
+        with self._lock:
+            client = self._clients.get((key, managed_retries))
+            if client is None:
+                client = self._create_client(
+                    key, api_key or AzureAIFoundryConfig.OPENAI_API_KEY, managed_retries
+                )
+                self._clients[(key, managed_retries)] = client
+        return client
+    
+    def _create_client(self, key: PoolKey, api_key: str, managed_retries: bool) -> AzureChatOpenAI:
+        """Crea el cliente LLM para una clave (sobre los pools HTTP de esa clave)"""
+        endpoint, deployment, api_version = key
+        logger.info(f"Creando cliente LLM compartido para {deployment} ({api_version})")
+        
+        http_client, http_async_client = self._get_http_clients(key)
+        
+        return AzureChatOpenAI(
+            azure_endpoint=endpoint,
+            api_key=api_key,
+            azure_deployment=deployment,
+            api_version=api_version,
+            temperature=AzureAIFoundryConfig.TEMPERATURE,
+            max_tokens=AzureAIFoundryConfig.MAX_TOKENS,
+            timeout=AzureAIFoundryConfig.TIMEOUT,
+            http_client=http_client,
+            http_async_client=http_async_client,
+            top_p=0.95,
+            frequency_penalty=0,
+            presence_penalty=0,
+            # Con managed_retries los reintentos los gestiona app.retry (respetando
+            # Retry-After y el presupuesto de la solicitud); si no, los del SDK
+            max_retries=0 if managed_retries else SDK_MAX_RETRIES,
+            # Los encabezados de cuota se leen de la respuesta
+            include_response_headers=True
+        )
+    
+    def get_embeddings(
+        self,
+        deployment: str,
+        endpoint: Optional[str] = None,
+        api_version: Optional[str] = None,
+        api_key: Optional[str] = None,
+    ) -> AzureOpenAIEmbeddings:
+        """
+        Obtiene (o crea una única vez) el cliente de embeddings para un deployment
+        
+        Args:
+            deployment: Nombre del deployment de embeddings
+            endpoint: Endpoint de Azure OpenAI (por defecto el configurado)
+            api_version: Versión de la API (por defecto la configurada)
+            api_key: Clave de API (por defecto la configurada)
+            
+        Returns:
+            Cliente AzureOpenAIEmbeddings compartido
+        """
+        key = (
+            endpoint or AzureAIFoundryConfig.OPENAI_ENDPOINT,
+            deployment,
+            api_version or AzureAIFoundryConfig.OPENAI_API_VERSION,
+        )
+        embeddings = self._embeddings.get(key)
+        if embeddings is not None:
+            return embeddings
+        
+        with self._lock:
+            embeddings = self._embeddings.get(key)
+            if embeddings is None:
+                logger.info(f"Creando cliente de embeddings compartido para {deployment}")
+                http_client, http_async_client = self._get_http_clients(key)
+                embeddings = AzureOpenAIEmbeddings(
+                    azure_endpoint=key[0],
+                    api_key=api_key or AzureAIFoundryConfig.OPENAI_API_KEY,
+                    azure_deployment=deployment,
+                    api_version=key[2],
+                    http_client=http_client,
+                    http_async_client=http_async_client,
+                )
+                self._embeddings[key] = embeddings
+        return embeddings
+    
+    def _get_http_clients(self, key: PoolKey) -> Tuple[httpx.Client, httpx.AsyncClient]:
+        """Pools HTTP (sync y async) asociados a una clave"""
+        clients = self._http_clients.get(key)
+        if clients is None:
+            timeout = httpx.Timeout(AzureAIFoundryConfig.TIMEOUT)
+            clients = (
+                httpx.Client(limits=self.limits, timeout=timeout),
+                httpx.AsyncClient(limits=self.limits, timeout=timeout),
+            )
+            self._http_clients[key] = clients
+        return clients
+    
+    def size(self) -> int:
+        """Número de clientes creados"""
+        return len(self._clients)
+    
+    async def aclose(self) -> None:
+        """Cierra todos los pools HTTP (al apagar el proceso)"""
+        with self._lock:
+            http_clients = list(self._http_clients.values())
+            self._http_clients.clear()
+            self._clients.clear()
+            self._embeddings.clear()
+        
+        for http_client, http_async_client in http_clients:
+            http_client.close()
+            await http_async_client.aclose()
+        logger.info("Pools de conexiones LLM cerrados")
+
+
+_pool: Optional[LLMClientPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_llm_pool() -> LLMClientPool:
+    """Retorna el registro de clientes LLM del proceso"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = LLMClientPool()
+    return _pool
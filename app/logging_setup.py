@@ -0,0 +1,205 @@
+"""
+Configuración de logs del proceso: cola con escritura en segundo plano, JSON y muestreo
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from app import fastjson
+from app.config import LoggingConfig
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Atributos propios de LogRecord; el resto son campos de `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime"
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Un objeto JSON por línea
+    
+    Incluye los campos pasados en `extra` (p. ej. `conversation_id`), de
+    modo que los logs se pueden filtrar por conversación sin analizar el texto.
+    """
+    
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                if not isinstance(value, (str, int, float, bool, type(None))):
+                    value = str(value)
+                data[key] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data["stack"] = self.formatStack(record.stack_info)
+        return fastjson.dumps_str(data)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Conserva 1 de cada N líneas INFO/DEBUG de los loggers configurados
+    
+    El muestreo es por línea (logger + plantilla del mensaje): la primera
+    aparición de cada línea siempre se escribe y las líneas poco frecuentes
+    (arranque, errores) no se pierden. WARNING y superiores nunca se
+    descartan. Las líneas conservadas llevan `sampled=N`.
+    """
+    
+    # Máximo de líneas distintas con contador (los mensajes con f-string son todos distintos)
+    MAX_KEYS = 10000
+    
+    def __init__(self, rates: Dict[str, float], max_level: int = logging.INFO):
+        """
+        Inicializa el filtro
+        
+        Args:
+            rates: Fracción que se conserva por nombre de logger (aplica a sus descendientes)
+            max_level: Nivel máximo al que se aplica el muestreo
+        """
+        super().__init__()
+        self.rates = rates
+        self.max_level = max_level
+        self._every: Dict[str, int] = {}
+        self._counts: Dict[Tuple[str, Any], int] = {}
+        self.dropped = 0
+    
+    def _resolve(self, name: str) -> int:
+        """1 de cada cuántas líneas se conserva (el prefijo configurado más largo manda)"""
+        rate = 1.0
+        best = -1
+        for prefix, value in self.rates.items():
+            if (name == prefix or name.startswith(prefix + ".")) and len(prefix) > best:
+                rate, best = value, len(prefix)
+        return max(1, round(1 / rate)) if rate > 0 else 0
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        every = self._every.get(record.name)
+        if every is None:
+            every = self._every[record.name] = self._resolve(record.name)
+        if every == 1:
+            return True
+        if every == 0:
+            self.dropped += 1
+            return False
+        
+        key = (record.name, record.msg)
+        count = self._counts.get(key, 0)
+        if len(self._counts) >= self.MAX_KEYS and not count:
+            self._counts.clear()
+        self._counts[key] = count + 1
+        if count % every:
+            self.dropped += 1
+            return False
+        record.sampled = every
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Encola el registro sin formatearlo
+    
+    QueueHandler formatea el mensaje antes de encolar (pensado para colas
+    entre procesos); aquí la cola es del mismo proceso, así que el formateo
+    (incluidos los argumentos de los mensajes con %s y las trazas de
+    excepciones) ocurre en el hilo que escribe y no en el bucle de eventos.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[DeferredQueueHandler] = None
+_queue: Optional["queue.SimpleQueue[logging.LogRecord]"] = None
+_sampling: Optional[SamplingFilter] = None
+_configured = False
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    fmt: Optional[str] = None,
+    sampling: Optional[Dict[str, float]] = None,
+    use_queue: Optional[bool] = None,
+) -> None:
+    """
+    Configura el logger raíz del proceso (una sola vez; las llamadas siguientes no hacen nada)
+    
+    Args:
+        level: Nivel mínimo (por defecto LOG_LEVEL)
+        fmt: "text" o "json" (por defecto LOG_FORMAT)
+        sampling: Fracción de líneas INFO/DEBUG por logger (por defecto LOG_SAMPLING)
+        use_queue: Escribir desde un hilo en segundo plano (por defecto LOG_ASYNC)
+    """
+    global _listener, _handler, _queue, _sampling, _configured
+    if _configured:
+        return
+    _configured = True
+    
+    output = logging.StreamHandler()
+    output.setFormatter(
+        JsonFormatter() if (fmt or LoggingConfig.FORMAT) == "json"
+        else logging.Formatter(TEXT_FORMAT)
+    )
+    _sampling = SamplingFilter(sampling if sampling is not None else LoggingConfig.get_sampling())
+    
+    root = logging.getLogger()
+    root.setLevel(level or LoggingConfig.LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    
+    if not (use_queue if use_queue is not None else LoggingConfig.ASYNC):
+        output.addFilter(_sampling)
+        root.addHandler(output)
+        return
+    
+    _queue = queue.SimpleQueue()
+    _handler = DeferredQueueHandler(_queue)
+    # Las líneas descartadas por el muestreo ni siquiera se encolan
+    _handler.addFilter(_sampling)
+    root.addHandler(_handler)
+    _listener = logging.handlers.QueueListener(_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """
+    Escribe los registros pendientes y detiene el hilo de escritura
+    
+    Los registros posteriores se escriben directamente, sin cola.
+    """
+    global _listener, _handler
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(_handler)
+    for output in _listener.handlers:
+        output.addFilter(_sampling)
+        root.addHandler(output)
+    _listener.stop()
+    _listener = _handler = None
+
+
+def get_statistics() -> Dict[str, Any]:
+    """Estadísticas de los logs (líneas descartadas por el muestreo y pendientes de escribir)"""
+    return {
+        "async": _listener is not None,
+        "sampling": _sampling.rates if _sampling is not None else {},
+        "dropped": _sampling.dropped if _sampling is not None else 0,
+        "pending": _queue.qsize() if _queue is not None else 0,
+    }
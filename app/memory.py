@@ -0,0 +1,312 @@
+"""
+Memoria de conversación: historial completo o ventana con resumen acumulado
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from langchain.prompts import ChatPromptTemplate
+
+from app.config import MemoryConfig
+from app.session import ChatSession, Turn
+from app.tokens import TOKENS_PER_MESSAGE, count_message_tokens, count_tokens
+from app.usage import get_usage_tracker, read_usage
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Resume de forma progresiva una conversación entre un usuario y un asistente. "
+    "Conserva hechos, datos, decisiones, nombres y preguntas pendientes. "
+    "Responde únicamente con el resumen actualizado, en el idioma de la conversación."
+)
+
+SUMMARY_HUMAN_PROMPT = """Resumen actual:
+{summary}
+
+Nuevas líneas de la conversación:
+{new_lines}
+
+Resumen actualizado:"""
+
+SUMMARY_HEADER = "Resumen de la conversación anterior:"
+
+ROLE_LABELS = {"human": "Usuario", "ai": "Asistente"}
+
+
+class ConversationMemory:
+    """Memoria buffer: envía el historial completo en cada llamada"""
+    
+    mode = "buffer"
+    
+    def build_history(self, session: ChatSession) -> List[Turn]:
+        """Mensajes de historial que se envían al modelo"""
+        return session.history
+    
+    def history_tokens(self, session: ChatSession) -> int:
+        """Tokens de build_history, sin volver a tokenizar el historial"""
+        return session.history_tokens
+    
+    def tokens_saved(self, session: ChatSession) -> int:
+        """Tokens que build_history ahorra frente al historial completo"""
+        return 0
+    
+    def add_tokens_saved(self, session: ChatSession, tokens: int) -> None:
+        """Suma el ahorro de una llamada al modelo que terminó bien"""
+    
+    def after_turn(self, session: ChatSession) -> None:
+        """Se invoca después de agregar un intercambio al historial"""
+    
+    def get_statistics(self, session: ChatSession) -> Dict[str, Any]:
+        """Estadísticas de la memoria de la sesión"""
+        return {
+            "memory_mode": self.mode,
+            "tokens_saved": 0
+        }
+
+
+class SummaryState:
+    """Estado por sesión de la memoria con resumen"""
+    
+    __slots__ = ("summary", "summary_tokens", "pending", "folded_tokens", "tokens_saved", "task")
+    
+    def __init__(self):
+        self.summary = ""
+        self.summary_tokens = 0
+        # Turnos sacados de la ventana que aún no se incorporaron al resumen
+        self.pending: List[Turn] = []
+        # Tokens de todos los turnos ya incorporados al resumen
+        self.folded_tokens = 0
+        self.tokens_saved = 0
+        self.task: Optional[asyncio.Task] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Representación serializable (sin la tarea en curso)"""
+        return {
+            "summary": self.summary,
+            "summary_tokens": self.summary_tokens,
+            "pending": [[role, content] for role, content in self.pending],
+            "folded_tokens": self.folded_tokens,
+            "tokens_saved": self.tokens_saved,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SummaryState":
+        """Reconstruye el estado serializado con to_dict"""
+        state = cls()
+        state.summary = data.get("summary", "")
+        state.summary_tokens = data.get("summary_tokens", 0)
+        state.pending = [(role, content) for role, content in data.get("pending", [])]
+        state.folded_tokens = data.get("folded_tokens", 0)
+        state.tokens_saved = data.get("tokens_saved", 0)
+        return state
+
+
+class RollingSummaryMemory(ConversationMemory):
+    """
+    Memoria que mantiene los últimos turnos literales dentro de un presupuesto
+    de tokens y resume los anteriores de forma incremental en segundo plano.
+    
+    Mientras un resumen está en curso, los turnos pendientes se siguen enviando
+    literalmente, de modo que nunca se pierde contexto.
+    
+    Los resúmenes pasan por el router como cualquier otra llamada (planificador,
+    reintentos y circuito de cada backend) y su uso se suma a la conversación.
+    """
+    
+    mode = "summary"
+    
+    def __init__(self, router, max_turns: int, token_budget: int, summary_max_tokens: int):
+        """
+        Inicializa la memoria
+        
+        Args:
+            router: BackendRouter con el que se generan los resúmenes
+            max_turns: Máximo de intercambios literales en la ventana
+            token_budget: Presupuesto de tokens de la ventana literal
+            summary_max_tokens: Máximo de tokens de cada resumen generado
+        """
+        self.router = router
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", SUMMARY_SYSTEM_PROMPT),
+            ("human", SUMMARY_HUMAN_PROMPT),
+        ])
+    
+    @staticmethod
+    def _state(session: ChatSession) -> Optional[SummaryState]:
+        """Estado de la sesión (convertido si se restauró serializado del almacén)"""
+        state = session.memory_state
+        if isinstance(state, dict):
+            state = session.memory_state = SummaryState.from_dict(state)
+        return state
+    
+    def build_history(self, session: ChatSession) -> List[Turn]:
+        """Resumen + turnos pendientes + ventana literal"""
+        state = self._state(session)
+        if state is None:
+            return session.history
+        
+        history: List[Turn] = []
+        if state.summary:
+            history.append(("system", f"{SUMMARY_HEADER}\n{state.summary}"))
+        history.extend(state.pending)
+        history.extend(session.history)
+        return history
+    
+    def history_tokens(self, session: ChatSession) -> int:
+        """Tokens de build_history (resumen + pendientes + ventana)"""
+        state = self._state(session)
+        if state is None:
+            return session.history_tokens
+        tokens = session.history_tokens + count_message_tokens(state.pending)
+        if state.summary:
+            tokens += state.summary_tokens + count_tokens(SUMMARY_HEADER) + TOKENS_PER_MESSAGE
+        return tokens
+    
+    def tokens_saved(self, session: ChatSession) -> int:
+        """Tokens que el resumen ahorra frente a los turnos que reemplaza"""
+        state = self._state(session)
+        if state is None or not state.summary:
+            return 0
+        return max(0, state.folded_tokens - state.summary_tokens)
+    
+    def add_tokens_saved(self, session: ChatSession, tokens: int) -> None:
+        """Suma el ahorro de una llamada al modelo que terminó bien"""
+        state = self._state(session)
+        if state is not None:
+            state.tokens_saved += tokens
+    
+    def after_turn(self, session: ChatSession) -> None:
+        """Saca de la ventana los turnos que exceden el presupuesto y agenda el resumen"""
+        overflow: List[Turn] = []
+        
+        # Siempre se conserva al menos el último intercambio
+        while len(session.history) > 2 and (
+            len(session.history) // 2 > self.max_turns or session.history_tokens > self.token_budget
+        ):
+            overflow.extend(session.pop_oldest_turn())
+        
+        state = self._state(session)
+        if overflow:
+            if state is None:
+                state = SummaryState()
+                session.memory_state = state
+            state.pending.extend(overflow)
+        
+        if state is None or not state.pending or (state.task is not None and not state.task.done()):
+            return
+        
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._fold_sync(session, state)
+            return
+        state.task = loop.create_task(self._fold(session, state))
+    
+    async def _fold(self, session: ChatSession, state: SummaryState) -> None:
+        """Incorpora al resumen los turnos pendientes (en segundo plano)"""
+        while state.pending:
+            batch = list(state.pending)
+            inputs = self._inputs(state, batch)
+            prompt_tokens = self._prompt_tokens(state, batch)
+            try:
+                result = await self.router.ainvoke(
+                    session.session_id, inputs, prompt_tokens,
+                    prompt=self.prompt, max_tokens=self.summary_max_tokens
+                )
+            except Exception as e:
+                # Los turnos siguen pendientes y se reintenta en el próximo turno
+                logger.warning(f"No se pudo actualizar el resumen de la conversación: {e}")
+                return
+            deployment = result.response_metadata.get("deployment")
+            self._record_usage(session, result, deployment, prompt_tokens)
+            self._apply(state, batch, result.content)
+    
+    def _fold_sync(self, session: ChatSession, state: SummaryState) -> None:
+        """
+        Variante síncrona de _fold (sin event loop disponible)
+        
+        Como AIFoundryChatEngine.send_message, llama al backend principal sin
+        pasar por el planificador, que solo admite llamadas asíncronas.
+        """
+        batch = list(state.pending)
+        prompt_tokens = self._prompt_tokens(state, batch)
+        chain = self.router.primary.chain_for(self.prompt, self.summary_max_tokens)
+        try:
+            result = chain.invoke(self._inputs(state, batch))
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar el resumen de la conversación: {e}")
+            return
+        self._record_usage(session, result, self.router.primary.deployment, prompt_tokens)
+        self._apply(state, batch, result.content)
+    
+    @staticmethod
+    def _inputs(state: SummaryState, batch: List[Turn]) -> Dict[str, str]:
+        """Variables del prompt de resumen"""
+        new_lines = "\n".join(
+            f"{ROLE_LABELS.get(role, role)}: {content}" for role, content in batch
+        )
+        return {"summary": state.summary or "(vacío)", "new_lines": new_lines}
+    
+    @staticmethod
+    def _prompt_tokens(state: SummaryState, batch: List[Turn]) -> int:
+        """Tokens estimados del prompt de resumen (para reservar cuota)"""
+        return (
+            count_tokens(SUMMARY_SYSTEM_PROMPT) + count_tokens(SUMMARY_HUMAN_PROMPT)
+            + 2 * TOKENS_PER_MESSAGE + state.summary_tokens + count_message_tokens(batch)
+        )
+    
+    @staticmethod
+    def _record_usage(
+        session: ChatSession, result, deployment: Optional[str], prompt_tokens: int
+    ) -> None:
+        """Suma el uso del resumen a la sesión y a los contadores del proceso"""
+        usage = read_usage(result)
+        estimated = usage is None
+        if estimated:
+            usage = (prompt_tokens, count_tokens(result.content))
+        get_usage_tracker().record(
+            session.session_id,
+            None,
+            deployment,
+            *usage,
+            estimated=estimated
+        )
+        session.total_tokens_used += usage[0] + usage[1]
+        session.total_calls += 1
+    
+    @staticmethod
+    def _apply(state: SummaryState, batch: List[Turn], summary: str) -> None:
+        """Reemplaza el resumen y descarta los turnos ya resumidos"""
+        del state.pending[:len(batch)]
+        state.summary = summary.strip()
+        state.summary_tokens = count_tokens(state.summary)
+        state.folded_tokens += count_message_tokens(batch)
+    
+    def get_statistics(self, session: ChatSession) -> Dict[str, Any]:
+        """Estadísticas de la memoria de la sesión"""
+        state = self._state(session)
+        return {
+            "memory_mode": self.mode,
+            "tokens_saved": state.tokens_saved if state else 0,
+            "summary_tokens": state.summary_tokens if state else 0,
+            "pending_summary_messages": len(state.pending) if state else 0
+        }
+
+
+def create_memory(router) -> ConversationMemory:
+    """Crea la memoria configurada en MEMORY_MODE (los resúmenes usan el router)"""
+    if MemoryConfig.MODE == "summary":
+        logger.info(
+            f"Memoria con resumen: {MemoryConfig.MAX_TURNS} turnos, "
+            f"{MemoryConfig.TOKEN_BUDGET} tokens"
+        )
+        return RollingSummaryMemory(
+            router,
+            max_turns=MemoryConfig.MAX_TURNS,
+            token_budget=MemoryConfig.TOKEN_BUDGET,
+            summary_max_tokens=MemoryConfig.SUMMARY_MAX_TOKENS,
+        )
+    return ConversationMemory()
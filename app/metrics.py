@@ -0,0 +1,253 @@
+"""
+Métricas del proceso en formato de exposición de Prometheus
+"""
+import abc
+import logging
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Límites (segundos) pensados para latencias de red y de modelos de lenguaje
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+# Valor de una métrica calculada: un número o {valores de etiquetas: número}
+CollectedValue = Union[float, Mapping[LabelValues, float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(abc.ABC):
+    kind = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+    
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+    
+    @abc.abstractmethod
+    def render(self) -> List[str]:
+        """Líneas de la métrica en formato de exposición"""
+
+
+class Counter(_Metric):
+    """Contador monotónico por combinación de etiquetas"""
+    
+    kind = "counter"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+    
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """Incrementa el contador de las etiquetas dadas (en el orden de `labelnames`)"""
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+    
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+    
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, value in self._values.items():
+            series_labels = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}{series_labels} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Histograma con límites fijos
+    
+    Cada observación es una búsqueda binaria y un incremento; los conteos
+    acumulados de Prometheus se calculan solo al exponer.
+    """
+    
+    kind = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # etiquetas -> [conteos por límite (+ desbordamiento), suma]
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+    
+    def observe(self, value: float, *labels: str) -> None:
+        """Registra una observación (p. ej. una latencia en segundos)"""
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = series
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+    
+    def get_count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series is not None else 0
+    
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                bucket_labels = _format_labels(
+                    self.labelnames, labels, f'le="{_format_value(bound)}"'
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            series_labels = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{series_labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{series_labels} {cumulative}")
+        return lines
+
+
+class CollectedMetric(_Metric):
+    """
+    Métrica cuyo valor se lee al exponer (gauge o contador ya acumulado)
+    
+    Sirve para publicar estadísticas que los componentes ya mantienen
+    (sesiones activas, aciertos de caché, tokens) sin contarlas dos veces.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], CollectedValue],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+        self.kind = kind
+    
+    def render(self) -> List[str]:
+        try:
+            value = self.collect()
+        except Exception as e:
+            logger.warning(f"No se pudo leer la métrica {self.name}: {e}")
+            return []
+        lines = self._header()
+        if isinstance(value, Mapping):
+            for labels, sample in value.items():
+                sample_labels = _format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}{sample_labels} {_format_value(sample)}")
+        elif value is not None:
+            lines.append(f"{self.name} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registro de métricas del proceso"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+    
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None and not isinstance(metric, CollectedMetric):
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Crea (o retorna) un contador"""
+        return self._register(Counter(name, documentation, labelnames))
+    
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """Crea (o retorna) un histograma"""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+    
+    def collect(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], CollectedValue],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ) -> CollectedMetric:
+        """Registra (o reemplaza) una métrica calculada al exponer"""
+        return self._register(CollectedMetric(name, documentation, collect, labelnames, kind))
+    
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+    
+    def render(self) -> str:
+        """Texto en formato de exposición de Prometheus (0.0.4)"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Métricas del camino crítico
+TURN_LATENCY = REGISTRY.histogram(
+    "bot_turn_duration_seconds",
+    "Duración de un turno del bot, desde el mensaje hasta la última respuesta enviada "
+    "(outcome: ok, error o coalesced si el mensaje se agregó al turno de otro)",
+    ("kind", "outcome"),
+)
+LLM_LATENCY = REGISTRY.histogram(
+    "llm_request_duration_seconds",
+    "Duración de las llamadas al modelo que terminan bien",
+    ("backend", "mode"),
+)
+LLM_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "llm_time_to_first_token_seconds",
+    "Tiempo hasta el primer fragmento de una respuesta en streaming",
+    ("backend",),
+)
+LLM_ERRORS = REGISTRY.counter(
+    "llm_request_errors_total",
+    "Llamadas al modelo fallidas por backend y tipo de error",
+    ("backend", "error"),
+)
+LLM_QUEUE_WAIT = REGISTRY.histogram(
+    "llm_queue_wait_seconds",
+    "Espera en la cola de admisión antes de llamar al modelo",
+    ("backend",),
+)
+RETRIEVAL_LATENCY = REGISTRY.histogram(
+    "retrieval_request_duration_seconds",
+    "Duración de las búsquedas de contexto (sin contar los aciertos de caché)",
+    ("backend", "outcome"),
+)
+CONTENT_SAFETY_LATENCY = REGISTRY.histogram(
+    "content_safety_request_duration_seconds",
+    "Duración de las llamadas al servicio de Content Safety",
+    ("outcome",),
+)
@@ -0,0 +1,286 @@
+"""
+Caché de respuestas para preguntas repetidas (exacta y por similitud semántica)
+"""
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.cache import LRUCache, text_key
+from app.config import AzureAIFoundryConfig, AppConfig, ResponseCacheConfig
+from app.session import ChatSession, Turn
+
+logger = logging.getLogger(__name__)
+
+# Mensajes recientes del historial que forman parte de la clave con scope "all"
+HISTORY_KEY_MESSAGES = 4
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s\?\!\.¿¡,;:]+$")
+
+
+def normalize_prompt(text: str) -> str:
+    """Normaliza una pregunta para compararla: minúsculas, espacios simples, sin signos finales"""
+    text = _SPACES.sub(" ", text.strip().lower())
+    text = text.lstrip("¿¡ ")
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+class VectorIndex:
+    """
+    Índice vectorial en memoria con búsqueda por similitud coseno.
+    
+    Los vectores se guardan normalizados en una matriz preasignada; cuando
+    se llena, se reemplaza la entrada usada hace más tiempo.
+    """
+    
+    def __init__(self, capacity: int, ttl: float = 0, clock: Callable[[], float] = time.monotonic):
+        """
+        Inicializa el índice
+        
+        Args:
+            capacity: Máximo de vectores
+            ttl: Segundos de validez de cada entrada (0 = sin expiración)
+            clock: Reloj monotónico (inyectable para tests)
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self._clock = clock
+        self._matrix: Optional[np.ndarray] = None
+        self._values: List[Optional[str]] = [None] * capacity
+        self._expires_at = np.zeros(capacity)
+        self._last_used = np.full(capacity, -np.inf)
+        self._valid = np.zeros(capacity, dtype=bool)
+    
+    def __len__(self) -> int:
+        return int(self._valid.sum())
+    
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+    
+    def search(self, vector: List[float], min_similarity: float) -> Optional[str]:
+        """
+        Busca la entrada más similar
+        
+        Args:
+            vector: Embedding de la consulta
+            min_similarity: Similitud coseno mínima para considerar un acierto
+        
+        Returns:
+            Valor de la entrada más similar o None
+        """
+        if self._matrix is None or not self._valid.any():
+            return None
+        
+        now = self._clock()
+        if self.ttl:
+            self._valid &= self._expires_at > now
+        
+        scores = self._matrix @ self._normalize(vector)
+        scores[~self._valid] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] < min_similarity:
+            return None
+        
+        self._last_used[best] = now
+        return self._values[best]
+    
+    def add(self, vector: List[float], value: str) -> None:
+        """Agrega una entrada, reemplazando la menos usada si el índice está lleno"""
+        if self.capacity <= 0:
+            return
+        normalized = self._normalize(vector)
+        if self._matrix is None:
+            self._matrix = np.zeros((self.capacity, normalized.shape[0]), dtype=np.float32)
+        
+        free = np.flatnonzero(~self._valid)
+        slot = int(free[0]) if free.size else int(np.argmin(self._last_used))
+        
+        now = self._clock()
+        self._matrix[slot] = normalized
+        self._values[slot] = value
+        self._expires_at[slot] = now + self.ttl if self.ttl else np.inf
+        self._last_used[slot] = now
+        self._valid[slot] = True
+    
+    def clear(self) -> None:
+        """Vacía el índice"""
+        self._valid[:] = False
+        self._values = [None] * self.capacity
+
+
+class CacheLookup:
+    """Resultado de una consulta a la caché (reutilizado al guardar la respuesta)"""
+    
+    __slots__ = ("key", "vector", "response")
+    
+    def __init__(
+        self, key: str, vector: Optional[List[float]] = None, response: Optional[str] = None
+    ):
+        self.key = key
+        self.vector = vector
+        self.response = response
+
+
+class ResponseCache:
+    """
+    Caché de respuestas delante de la cadena de conversación.
+    
+    La clave combina la pregunta normalizada, el system prompt, los deployments
+    entre los que reparte el router, el contexto recuperado del índice de
+    búsqueda (si lo hay) y, si la conversación ya tiene historial (scope
+    "all"), sus últimos mensajes: una repregunta como "¿y eso cuánto cuesta?"
+    depende de lo que se habló antes, y una respuesta basada en documentos
+    deja de valer si los documentos cambian. El nivel exacto se resuelve en
+    memoria sin llamadas de red; el nivel semántico (opcional) compara el
+    embedding de la pregunta con los de respuestas anteriores y solo se usa
+    para preguntas sin historial ni contexto recuperado.
+    """
+    
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        scope: str = "first_turn",
+        embeddings=None,
+        min_similarity: float = 0.92,
+    ):
+        """
+        Inicializa la caché
+        
+        Args:
+            max_entries: Máximo de respuestas en cada nivel
+            ttl: Segundos de validez de cada respuesta
+            scope: "first_turn" (solo preguntas sin historial previo) o "all"
+            embeddings: Cliente de embeddings para el nivel semántico (None lo deshabilita)
+            min_similarity: Similitud coseno mínima para un acierto semántico
+        """
+        self.scope = scope
+        self.embeddings = embeddings
+        self.min_similarity = min_similarity
+        self.exact: LRUCache[str] = LRUCache(max_entries, ttl=ttl)
+        self.index = VectorIndex(max_entries, ttl=ttl) if embeddings is not None else None
+        # Con varios backends cualquiera puede responder: la clave cubre el conjunto
+        deployments = sorted(
+            f"{backend['endpoint']}/{backend['deployment']}"
+            for backend in AzureAIFoundryConfig.get_backends()
+        )
+        self.context = "\x00".join([AppConfig.SYSTEM_PROMPT, *deployments])
+        
+        self.lookups = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.embedding_errors = 0
+    
+    def applies_to(self, session: ChatSession) -> bool:
+        """Indica si la caché se usa para el próximo mensaje de la sesión"""
+        return self.scope == "all" or not session.history
+    
+    async def lookup(
+        self,
+        message: str,
+        history: Sequence[Turn] = (),
+        context: Sequence[Tuple[str, str]] = (),
+    ) -> CacheLookup:
+        """
+        Busca una respuesta para el mensaje
+        
+        Args:
+            message: Mensaje del usuario
+            history: Historial previo de la conversación (vacío en el primer turno)
+            context: Mensajes de contexto recuperado que irán en el prompt
+        
+        Returns:
+            CacheLookup con la respuesta si hubo acierto
+        """
+        self.lookups += 1
+        normalized = normalize_prompt(message)
+        recent = history[-HISTORY_KEY_MESSAGES:]
+        lookup = CacheLookup(text_key(
+            normalized,
+            self.context,
+            *(f"context:{content}" for _, content in context),
+            *(f"{role}:{content}" for role, content in recent),
+        ))
+        
+        cached = self.exact.get(lookup.key)
+        if cached is not None:
+            self.exact_hits += 1
+            lookup.response = cached
+            return lookup
+        
+        # Los vectores solo representan la pregunta: con historial o contexto no son comparables
+        if self.index is None or recent or context:
+            return lookup
+        
+        try:
+            lookup.vector = await self.embeddings.aembed_query(normalized)
+        except Exception as e:
+            self.embedding_errors += 1
+            logger.warning(f"No se pudo calcular el embedding para la caché: {e}")
+            return lookup
+        
+        cached = self.index.search(lookup.vector, self.min_similarity)
+        if cached is not None:
+            self.semantic_hits += 1
+            lookup.response = cached
+            # Promover al nivel exacto para la próxima vez
+            self.exact.put(lookup.key, cached)
+        return lookup
+    
+    def store(self, lookup: CacheLookup, response: str) -> None:
+        """Guarda la respuesta generada para una consulta fallida"""
+        self.exact.put(lookup.key, response)
+        if self.index is not None and lookup.vector is not None:
+            self.index.add(lookup.vector, response)
+    
+    def clear(self) -> None:
+        """Vacía ambos niveles"""
+        self.exact.clear()
+        if self.index is not None:
+            self.index.clear()
+    
+    @property
+    def hit_rate(self) -> float:
+        """Proporción de consultas respondidas desde la caché"""
+        hits = self.exact_hits + self.semantic_hits
+        return hits / self.lookups if self.lookups else 0.0
+    
+    def get_statistics(self) -> Dict[str, Any]:
+        """Métricas de la caché"""
+        return {
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "hit_rate": round(self.hit_rate, 4),
+            "entries": len(self.exact),
+            "vectors": len(self.index) if self.index is not None else 0,
+            "embedding_errors": self.embedding_errors
+        }
+
+
+def create_response_cache(pool) -> Optional[ResponseCache]:
+    """Crea la caché de respuestas si está habilitada (ENABLE_RESPONSE_CACHE)"""
+    if not ResponseCacheConfig.ENABLED:
+        return None
+    
+    embeddings = None
+    if ResponseCacheConfig.EMBEDDING_DEPLOYMENT:
+        embeddings = pool.get_embeddings(ResponseCacheConfig.EMBEDDING_DEPLOYMENT)
+    
+    logger.info(
+        f"Caché de respuestas habilitada ({ResponseCacheConfig.SCOPE}, "
+        f"semántica: {'sí' if embeddings is not None else 'no'})"
+    )
+    return ResponseCache(
+        max_entries=ResponseCacheConfig.MAX_ENTRIES,
+        ttl=ResponseCacheConfig.TTL,
+        scope=ResponseCacheConfig.SCOPE,
+        embeddings=embeddings,
+        min_similarity=ResponseCacheConfig.MIN_SIMILARITY,
+    )
@@ -0,0 +1,391 @@
+"""
+Recuperación de contexto (RAG) sobre Azure AI Search o un índice local en memoria
+"""
+import asyncio
+import json
+import logging
+import math
+import re
+import time
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.cache import LRUCache, text_key
+from app.config import AzureAIFoundryConfig
+from app.credentials import get_token_provider
+from app.metrics import RETRIEVAL_LATENCY
+from app.tokens import count_tokens
+from app.tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+# Scope de Azure AI Search cuando no hay clave de API
+SEARCH_SCOPE = "https://search.azure.com/.default"
+
+CONTEXT_HEADER = (
+    "Fragmentos de la base de conocimiento relevantes para la pregunta. "
+    "Úsalos si responden a lo que se pregunta y cita el número entre corchetes; "
+    "si no alcanzan, dilo."
+)
+
+_WORD = re.compile(r"\w+")
+
+
+class Document:
+    """Fragmento recuperado del índice"""
+    
+    __slots__ = ("id", "content", "title", "source", "score")
+    
+    def __init__(
+        self, id: str, content: str, title: str = "", source: str = "", score: float = 0.0
+    ):
+        self.id = id
+        self.content = content
+        self.title = title
+        self.source = source
+        self.score = score
+    
+    def scored(self, score: float) -> "Document":
+        """Copia del documento con el puntaje de una consulta"""
+        return Document(self.id, self.content, self.title, self.source, score)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "title": self.title,
+            "source": self.source,
+            "score": round(self.score, 4),
+        }
+
+
+def _terms(text: str) -> List[str]:
+    """Términos normalizados (minúsculas y sin acentos)"""
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    return _WORD.findall("".join(char for char in normalized if not unicodedata.combining(char)))
+
+
+class InMemoryIndex:
+    """
+    Índice local con ranking BM25, para desarrollo y pruebas sin Azure
+    
+    Los documentos se cargan de un archivo JSON (lista) o JSON Lines con
+    los campos id, content y, opcionalmente, title y source.
+    """
+    
+    name = "memory"
+    
+    def __init__(self, documents: Iterable[Document] = (), k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._documents: List[Document] = []
+        self._lengths: List[int] = []
+        # término -> {posición del documento: frecuencia}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._total_length = 0
+        for document in documents:
+            self.add(document)
+    
+    def __len__(self) -> int:
+        return len(self._documents)
+    
+    def add(self, document: Document) -> None:
+        """Indexa un documento (título y contenido)"""
+        position = len(self._documents)
+        terms = _terms(f"{document.title} {document.content}")
+        self._documents.append(document)
+        self._lengths.append(len(terms))
+        self._total_length += len(terms)
+        for term in terms:
+            postings = self._postings.setdefault(term, {})
+            postings[position] = postings.get(position, 0) + 1
+    
+    @classmethod
+    def from_file(cls, path: str) -> "InMemoryIndex":
+        """Carga los documentos de un archivo JSON o JSON Lines"""
+        with open(path, encoding="utf-8") as source:
+            text = source.read()
+        stripped = text.lstrip()
+        if stripped.startswith("["):
+            records = json.loads(text)
+        else:
+            records = [json.loads(line) for line in text.splitlines() if line.strip()]
+        return cls(
+            Document(
+                str(record.get("id", index)),
+                record.get("content", ""),
+                record.get("title", ""),
+                record.get("source", ""),
+            )
+            for index, record in enumerate(records)
+        )
+    
+    def _search(self, query: str, top: int) -> List[Document]:
+        if not self._documents:
+            return []
+        count = len(self._documents)
+        average = self._total_length / count or 1
+        scores: Dict[int, float] = {}
+        for term in set(_terms(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[position] / average)
+                weight = idf * frequency * (self.k1 + 1) / (frequency + norm)
+                scores[position] = scores.get(position, 0.0) + weight
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top]
+        return [self._documents[position].scored(score) for position, score in ranked]
+    
+    async def search(self, query: str, top: int) -> List[Document]:
+        return self._search(query, top)
+    
+    async def close(self) -> None:
+        pass
+
+
+class AzureSearchBackend:
+    """
+    Consultas a un índice de Azure AI Search mediante su API REST
+    
+    Usa una sesión HTTP con conexiones keep-alive (creada en el primer uso,
+    dentro del bucle de eventos) y la clave de API o, si no hay, un token de
+    la credencial compartida del proceso.
+    """
+    
+    name = "azure"
+    
+    def __init__(
+        self,
+        endpoint: str,
+        index: str,
+        api_key: str = "",
+        api_version: str = "2023-11-01",
+        semantic_configuration: str = "",
+        content_field: str = "content",
+        title_field: str = "title",
+        source_field: str = "source",
+        timeout: float = 5.0,
+    ):
+        self.url = f"{endpoint.rstrip('/')}/indexes/{index}/docs/search?api-version={api_version}"
+        self.api_key = api_key
+        self.semantic_configuration = semantic_configuration
+        self.content_field = content_field
+        self.title_field = title_field
+        self.source_field = source_field
+        self.timeout = timeout
+        self._session = None
+        if not api_key:
+            get_token_provider().register(SEARCH_SCOPE)
+    
+    async def _headers(self) -> Dict[str, str]:
+        if self.api_key:
+            return {"api-key": self.api_key}
+        token = await get_token_provider().get_token_async(SEARCH_SCOPE)
+        return {"Authorization": f"Bearer {token.token}"}
+    
+    def _get_session(self):
+        if self._session is None:
+            import aiohttp
+            
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+    
+    async def search(self, query: str, top: int) -> List[Document]:
+        body: Dict[str, Any] = {"search": query, "top": top}
+        if self.semantic_configuration:
+            body["queryType"] = "semantic"
+            body["semanticConfiguration"] = self.semantic_configuration
+        
+        headers = await self._headers()
+        async with self._get_session().post(self.url, json=body, headers=headers) as response:
+            if response.status >= 400:
+                detail = (await response.text())[:200]
+                raise RuntimeError(f"Azure AI Search respondió {response.status}: {detail}")
+            payload = await response.json()
+        
+        documents = []
+        for index, item in enumerate(payload.get("value", [])):
+            documents.append(Document(
+                str(item.get("id", index)),
+                str(item.get(self.content_field) or ""),
+                str(item.get(self.title_field) or ""),
+                str(item.get(self.source_field) or ""),
+                # El reranker semántico da un puntaje más útil que BM25 cuando está disponible
+                float(item.get("@search.rerankerScore") or item.get("@search.score") or 0.0),
+            ))
+        return documents
+    
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class Retriever:
+    """
+    Etapa de recuperación del motor de chat
+    
+    Consulta el índice, descarta los resultados con puntaje bajo y recorta
+    los mejores a un presupuesto de tokens. Los resultados se guardan por
+    consulta normalizada y las consultas idénticas simultáneas comparten una
+    sola búsqueda. Los errores del servicio no interrumpen el turno: se
+    responde sin contexto.
+    """
+    
+    def __init__(
+        self,
+        backend: Any,
+        top_k: int = 5,
+        token_budget: int = 1500,
+        min_score: float = 0.0,
+        cache_size: int = 1024,
+        cache_ttl: float = 300.0,
+    ):
+        """
+        Inicializa la etapa
+        
+        Args:
+            backend: Índice con `search(query, top)` y `close()` (Azure o en memoria)
+            top_k: Documentos que se piden al índice por consulta
+            token_budget: Tokens máximos del contexto agregado al prompt
+            min_score: Puntaje mínimo para usar un documento
+            cache_size: Consultas con resultado en caché (0 = sin caché)
+            cache_ttl: Segundos de validez de cada resultado
+        """
+        self.backend = backend
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.min_score = min_score
+        self.cache: LRUCache[List[Document]] = LRUCache(cache_size, ttl=cache_ttl)
+        self._pending: Dict[str, "asyncio.Task[List[Document]]"] = {}
+        self.stats = {"queries": 0, "searches": 0, "coalesced": 0, "errors": 0, "documents": 0}
+    
+    async def retrieve(self, query: str) -> List[Document]:
+        """
+        Documentos relevantes para una consulta, ya recortados al presupuesto
+        
+        Returns:
+            Documentos en orden de relevancia (vacío si no hay resultados o el índice falla)
+        """
+        query = " ".join(query.split())
+        if not query:
+            return []
+        self.stats["queries"] += 1
+        
+        key = text_key(query.lower())
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = asyncio.ensure_future(self._search(key, query))
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        # Si el turno que espera se cancela, la búsqueda sigue para los demás
+        return await asyncio.shield(task)
+    
+    async def _search(self, key: str, query: str) -> List[Document]:
+        self.stats["searches"] += 1
+        started = time.perf_counter()
+        attributes = {"retrieval.backend": self.backend.name}
+        with get_tracer().span("retrieval.search", **attributes) as span:
+            try:
+                results = await self.backend.search(query, self.top_k)
+            except Exception as e:
+                RETRIEVAL_LATENCY.observe(time.perf_counter() - started, self.backend.name, "error")
+                self.stats["errors"] += 1
+                span.record_error(e)
+                logger.warning(f"No se pudo consultar el índice de búsqueda: {e}")
+                return []
+            RETRIEVAL_LATENCY.observe(time.perf_counter() - started, self.backend.name, "ok")
+            
+            documents = self.trim(
+                [document for document in results if document.score >= self.min_score]
+            )
+            span.set_attribute("retrieval.documents", len(documents))
+        self.stats["documents"] += len(documents)
+        self.cache.put(key, documents)
+        return documents
+    
+    def trim(self, documents: List[Document]) -> List[Document]:
+        """Los documentos de mayor puntaje que caben en el presupuesto de tokens"""
+        selected = []
+        remaining = self.token_budget - count_tokens(CONTEXT_HEADER)
+        for document in documents:
+            cost = count_tokens(_format_document(len(selected) + 1, document))
+            if cost > remaining:
+                # Uno más corto de menor puntaje todavía puede caber
+                continue
+            selected.append(document)
+            remaining -= cost
+        return selected
+    
+    def get_statistics(self) -> Dict[str, Any]:
+        """Estadísticas de la recuperación"""
+        return {
+            "backend": self.backend.name,
+            **self.stats,
+            "cache": self.cache.get_stats(),
+        }
+    
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+def _format_document(number: int, document: Document) -> str:
+    heading = f"[{number}] {document.title}".rstrip()
+    if document.source:
+        heading += f" ({document.source})"
+    return f"{heading}\n{document.content}"
+
+
+def format_context(documents: List[Document]) -> List[Tuple[str, str]]:
+    """
+    Mensajes de contexto para el prompt a partir de los documentos recuperados
+    
+    Returns:
+        Lista (rol, contenido) para el placeholder `context` del prompt (vacía sin documentos)
+    """
+    if not documents:
+        return []
+    body = "\n\n".join(
+        _format_document(number, document) for number, document in enumerate(documents, 1)
+    )
+    return [("system", f"{CONTEXT_HEADER}\n\n{body}")]
+
+
+def create_retriever() -> Optional[Retriever]:
+    """Crea la etapa de recuperación si está habilitada (ENABLE_AI_SEARCH)"""
+    if not AzureAIFoundryConfig.ENABLE_AI_SEARCH:
+        return None
+    
+    if AzureAIFoundryConfig.AI_SEARCH_BACKEND == "memory":
+        backend = InMemoryIndex.from_file(AzureAIFoundryConfig.AI_SEARCH_LOCAL_INDEX_FILE)
+        logger.info(f"Recuperación sobre índice local: {len(backend)} documentos")
+    else:
+        backend = AzureSearchBackend(
+            AzureAIFoundryConfig.AI_SEARCH_ENDPOINT,
+            AzureAIFoundryConfig.AI_SEARCH_INDEX,
+            api_key=AzureAIFoundryConfig.AI_SEARCH_KEY,
+            api_version=AzureAIFoundryConfig.AI_SEARCH_API_VERSION,
+            semantic_configuration=AzureAIFoundryConfig.AI_SEARCH_SEMANTIC_CONFIG,
+            content_field=AzureAIFoundryConfig.AI_SEARCH_CONTENT_FIELD,
+            title_field=AzureAIFoundryConfig.AI_SEARCH_TITLE_FIELD,
+            source_field=AzureAIFoundryConfig.AI_SEARCH_SOURCE_FIELD,
+            timeout=AzureAIFoundryConfig.AI_SEARCH_TIMEOUT,
+        )
+        logger.info(
+            f"Recuperación sobre Azure AI Search: índice {AzureAIFoundryConfig.AI_SEARCH_INDEX}"
+        )
+    
+    return Retriever(
+        backend,
+        top_k=AzureAIFoundryConfig.AI_SEARCH_TOP_K,
+        token_budget=AzureAIFoundryConfig.AI_SEARCH_TOKEN_BUDGET,
+        min_score=AzureAIFoundryConfig.AI_SEARCH_MIN_SCORE,
+        cache_size=AzureAIFoundryConfig.AI_SEARCH_CACHE_SIZE,
+        cache_ttl=AzureAIFoundryConfig.AI_SEARCH_CACHE_TTL,
+    )
@@ -0,0 +1,215 @@
+"""
+Reintentos de llamadas al modelo respetando los límites de tasa del servicio
+"""
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Mapping, Optional, Tuple, TypeVar
+
+import openai
+from tenacity import AsyncRetrying, RetryCallState, retry_if_exception
+
+from app.config import AzureAIFoundryConfig
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """
+    Segundos de espera indicados por el servicio
+    
+    Acepta `retry-after-ms`, `retry-after` en segundos y `retry-after` como fecha HTTP.
+    """
+    if not headers:
+        return None
+    
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def parse_remaining_quota(
+    headers: Optional[Mapping[str, str]]
+) -> Tuple[Optional[int], Optional[int]]:
+    """Solicitudes y tokens restantes (`x-ratelimit-remaining-requests/tokens`)"""
+    if not headers:
+        return None, None
+    
+    def read(name: str) -> Optional[int]:
+        value = headers.get(name)
+        try:
+            return int(float(value)) if value is not None else None
+        except ValueError:
+            return None
+    
+    return read("x-ratelimit-remaining-requests"), read("x-ratelimit-remaining-tokens")
+
+
+def _error_headers(error: BaseException) -> Optional[Mapping[str, str]]:
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Errores transitorios: límites de tasa, errores 5xx, timeouts y fallos de conexión"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        headers = _error_headers(error) or {}
+        if headers.get("x-should-retry") == "false":
+            return False
+        return error.status_code in RETRYABLE_STATUS
+    return False
+
+
+class RetryPolicy:
+    """
+    Política de reintentos para llamadas al modelo.
+    
+    Usa backoff exponencial con jitter completo, nunca espera menos de lo que
+    indica `Retry-After` y no reintenta si la espera excede el presupuesto de
+    tiempo de la solicitud (REQUEST_TIMEOUT). Cada intento se corta al vencer
+    el presupuesto restante, así que intentos y esperas juntos no lo superan;
+    un intento que excede `attempt_timeout` se reintenta si queda tiempo. Las
+    pausas exigidas por el servicio y la cuota restante las aplica el router
+    sobre el planificador de cada backend.
+    """
+    
+    def __init__(
+        self,
+        budget: float,
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        attempt_timeout: Optional[float] = None,
+    ):
+        """
+        Inicializa la política
+        
+        Args:
+            budget: Segundos totales disponibles para la solicitud, incluidas las esperas
+            max_attempts: Máximo de intentos (incluido el primero)
+            base_delay: Espera base del backoff exponencial
+            max_delay: Espera máxima del backoff (sin contar Retry-After)
+            attempt_timeout: Segundos máximos de cada intento (por defecto, el presupuesto)
+        """
+        self.budget = budget
+        self.attempt_timeout = attempt_timeout or budget
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        
+        self.retries = 0
+        self.rate_limited = 0
+        self.exhausted = 0
+    
+    def _backoff(self, attempt: int) -> float:
+        """Backoff exponencial con jitter completo"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+    
+    def _stop(self, retry_state: RetryCallState) -> bool:
+        """Se detiene al agotar los intentos o si el servicio pide esperar más que el presupuesto"""
+        if retry_state.attempt_number >= self.max_attempts:
+            self.exhausted += 1
+            return True
+        retry_after = parse_retry_after(_error_headers(retry_state.outcome.exception())) or 0
+        if retry_state.seconds_since_start + retry_after >= self.budget:
+            self.exhausted += 1
+            return True
+        return False
+    
+    def _wait(self, retry_state: RetryCallState) -> float:
+        """Espera hasta el próximo intento, acotada al presupuesto restante"""
+        error = retry_state.outcome.exception()
+        retry_after = parse_retry_after(_error_headers(error))
+        delay = max(retry_after or 0, self._backoff(retry_state.attempt_number))
+        remaining = self.budget - retry_state.seconds_since_start
+        return max(0.0, min(delay, remaining))
+    
+    def _before_sleep(self, retry_state: RetryCallState) -> None:
+        """Registra el reintento"""
+        error = retry_state.outcome.exception()
+        self.retries += 1
+        status = getattr(error, "status_code", None)
+        if status == 429:
+            self.rate_limited += 1
+        logger.warning(
+            f"Llamada al modelo fallida ({status or type(error).__name__}); "
+            f"reintento {retry_state.attempt_number} en {retry_state.upcoming_sleep:.2f}s"
+        )
+    
+    @staticmethod
+    def _is_retryable(error: BaseException) -> bool:
+        # Un intento cortado por attempt_timeout también es transitorio
+        return is_retryable(error) or isinstance(error, asyncio.TimeoutError)
+    
+    def _retrying(self) -> AsyncRetrying:
+        return AsyncRetrying(
+            retry=retry_if_exception(self._is_retryable),
+            stop=self._stop,
+            wait=self._wait,
+            before_sleep=self._before_sleep,
+            reraise=True,
+        )
+    
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Ejecuta una llamada con reintentos
+        
+        Args:
+            fn: Función sin argumentos que crea la corrutina a ejecutar
+        
+        Returns:
+            Resultado de la llamada
+        
+        Raises:
+            asyncio.TimeoutError: Si el último intento no terminó dentro del presupuesto
+        """
+        started = time.monotonic()
+        
+        async def attempt() -> T:
+            remaining = self.budget - (time.monotonic() - started)
+            return await asyncio.wait_for(fn(), max(0.0, min(self.attempt_timeout, remaining)))
+        
+        return await self._retrying()(attempt)
+    
+    def get_statistics(self) -> dict:
+        """Contadores de reintentos"""
+        return {
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "exhausted": self.exhausted
+        }
+
+
+def create_retry_policy() -> RetryPolicy:
+    """Crea la política de reintentos configurada"""
+    return RetryPolicy(
+        budget=AzureAIFoundryConfig.TIMEOUT,
+        max_attempts=AzureAIFoundryConfig.LLM_RETRY_MAX_ATTEMPTS,
+        base_delay=AzureAIFoundryConfig.LLM_RETRY_BASE_DELAY,
+        max_delay=AzureAIFoundryConfig.LLM_RETRY_MAX_DELAY,
+        attempt_timeout=AzureAIFoundryConfig.TIMEOUT,
+    )
@@ -0,0 +1,421 @@
+"""
+Enrutamiento de llamadas al modelo entre varios deployments de Azure OpenAI
+"""
+import logging
+import time
+from typing import (
+    Any, AsyncIterator, Callable, Collection, Dict, List, Mapping, Optional, Tuple
+)
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.runnables import Runnable
+
+from app.config import AzureAIFoundryConfig
+from app.llm_pool import get_llm_pool
+from app.metrics import LLM_ERRORS, LLM_LATENCY, LLM_TIME_TO_FIRST_TOKEN
+from app.retry import (
+    RetryPolicy,
+    create_retry_policy,
+    is_retryable,
+    parse_remaining_quota,
+    parse_retry_after,
+)
+from app.scheduler import LLMScheduler, SchedulerBusyError, get_scheduler
+from app.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Pausa cuando el servicio responde 429 sin Retry-After o informa cuota agotada
+DEFAULT_RATE_LIMIT_PAUSE = 1.0
+
+# Latencia asumida para un backend sin mediciones (segundos)
+INITIAL_LATENCY = 1.0
+
+
+class Backend:
+    """Deployment de Azure OpenAI con sus estadísticas de salud y carga"""
+    
+    __slots__ = (
+        "name", "deployment", "weight", "llm", "chain", "chains", "scheduler",
+        "latency", "in_flight", "calls", "failures", "rate_limited",
+        "consecutive_failures", "open_until", "limited_until",
+    )
+    
+    def __init__(
+        self,
+        name: str,
+        deployment: str,
+        weight: float,
+        llm,
+        chain: Runnable,
+        scheduler: LLMScheduler,
+    ):
+        self.name = name
+        self.deployment = deployment
+        self.weight = max(weight, 0.01)
+        self.llm = llm
+        self.chain = chain
+        # Cadenas de otros prompts sobre el mismo LLM (p. ej. el de resumen)
+        self.chains: Dict[Tuple[int, Optional[int]], Tuple[Runnable, Runnable]] = {}
+        self.scheduler = scheduler
+        
+        self.latency = INITIAL_LATENCY
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.limited_until = 0.0
+    
+    def chain_for(self, prompt: Runnable, max_tokens: Optional[int] = None) -> Runnable:
+        """
+        Cadena de otro prompt sobre el LLM del backend (se crea una vez por prompt)
+        
+        Args:
+            prompt: Prompt a encadenar
+            max_tokens: Límite de tokens generados (por defecto el del LLM)
+        """
+        key = (id(prompt), max_tokens)
+        entry = self.chains.get(key)
+        if entry is None:
+            llm = self.llm.bind(max_tokens=max_tokens) if max_tokens else self.llm
+            # Se conserva el prompt para que su id no se reutilice
+            entry = self.chains[key] = (prompt, prompt | llm)
+        return entry[1]
+    
+    def get_statistics(self, now: float) -> Dict[str, Any]:
+        """Métricas del backend"""
+        return {
+            "deployment": self.deployment,
+            "weight": self.weight,
+            "latency_ms": round(self.latency * 1000, 1),
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "circuit": "open" if now < self.open_until else "closed",
+            "scheduler": self.scheduler.get_statistics()
+        }
+
+
+class BackendRouter:
+    """
+    Reparte las llamadas entre varios deployments.
+    
+    Elige el backend disponible con menor costo estimado (latencia media
+    móvil por llamadas en curso y en cola, dividido por su peso). Los
+    backends que responden 429 se evitan hasta que vence su Retry-After y
+    los que fallan repetidamente quedan fuera (circuito abierto) durante un
+    tiempo de enfriamiento. Si un backend falla con un error transitorio, la
+    misma solicitud se intenta de inmediato en el siguiente; solo cuando
+    todos fallan se aplica la política de reintentos con espera.
+    """
+    
+    def __init__(
+        self,
+        backends: List[Backend],
+        retry_policy: RetryPolicy,
+        failure_threshold: int = 5,
+        cooldown: float = 30,
+        latency_alpha: float = 0.2,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Inicializa el router
+        
+        Args:
+            backends: Backends disponibles (al menos uno)
+            retry_policy: Política de reintentos cuando fallan todos los backends
+            failure_threshold: Fallos consecutivos que abren el circuito de un backend
+            cooldown: Segundos que un circuito permanece abierto
+            latency_alpha: Peso de la última medición en la latencia media móvil
+            clock: Reloj monotónico (inyectable para tests)
+        """
+        if not backends:
+            raise ValueError("El router necesita al menos un backend")
+        self.backends = backends
+        self.retry_policy = retry_policy
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.latency_alpha = latency_alpha
+        self._clock = clock
+        self.failovers = 0
+    
+    @property
+    def primary(self) -> Backend:
+        """Backend principal (el de la configuración base)"""
+        return self.backends[0]
+    
+    def _cost(self, backend: Backend) -> float:
+        load = backend.in_flight + backend.scheduler.queued + 1
+        return backend.latency * load / backend.weight
+    
+    def pick(self, exclude: Collection[Backend] = ()) -> Optional[Backend]:
+        """
+        Elige el backend para la próxima llamada
+        
+        Args:
+            exclude: Backends ya intentados en esta solicitud
+        
+        Returns:
+            Backend elegido o None si no quedan candidatos
+        """
+        candidates = [b for b in self.backends if b not in exclude]
+        if not candidates:
+            return None
+        
+        now = self._clock()
+        healthy = [b for b in candidates if now >= b.open_until and now >= b.limited_until]
+        if healthy:
+            return min(healthy, key=self._cost)
+        # Todos limitados o con el circuito abierto: el que se recupere antes
+        return min(candidates, key=lambda b: max(b.open_until, b.limited_until))
+    
+    def _record_success(
+        self, backend: Backend, latency: float, headers: Optional[Mapping[str, str]]
+    ) -> None:
+        backend.latency += self.latency_alpha * (latency - backend.latency)
+        backend.consecutive_failures = 0
+        backend.open_until = 0.0
+        
+        remaining_requests, remaining_tokens = parse_remaining_quota(headers)
+        backend.scheduler.observe_quota(remaining_requests, remaining_tokens)
+        if remaining_requests == 0 or remaining_tokens == 0:
+            self._limit(backend, DEFAULT_RATE_LIMIT_PAUSE)
+    
+    def _record_failure(self, backend: Backend, error: BaseException) -> None:
+        status = getattr(error, "status_code", None)
+        LLM_ERRORS.inc(backend.name, str(status or type(error).__name__))
+        if not is_retryable(error):
+            # Errores de la solicitud (p. ej. 400) no indican un backend degradado
+            return
+        backend.failures += 1
+        if status == 429:
+            backend.rate_limited += 1
+            headers = getattr(getattr(error, "response", None), "headers", None)
+            retry_after = parse_retry_after(headers)
+            self._limit(backend, retry_after or DEFAULT_RATE_LIMIT_PAUSE)
+            return
+        
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self.failure_threshold:
+            backend.open_until = self._clock() + self.cooldown
+            logger.warning(
+                f"Circuito abierto para el backend '{backend.name}' durante {self.cooldown:.0f}s "
+                f"tras {backend.consecutive_failures} fallos consecutivos"
+            )
+    
+    def _limit(self, backend: Backend, seconds: float) -> None:
+        """Evita un backend limitado por el servicio y pausa su admisión"""
+        backend.limited_until = max(backend.limited_until, self._clock() + seconds)
+        backend.scheduler.pause(seconds)
+    
+    def _should_failover(self, error: BaseException, tried: Collection[Backend]) -> bool:
+        retryable = is_retryable(error) or isinstance(error, SchedulerBusyError)
+        if retryable and len(tried) < len(self.backends):
+            self.failovers += 1
+            return True
+        return False
+    
+    async def ainvoke(
+        self,
+        key: str,
+        inputs: Dict[str, Any],
+        prompt_tokens: int,
+        prompt: Optional[Runnable] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AIMessage:
+        """
+        Invoca la cadena en el mejor backend disponible
+        
+        Args:
+            key: Conversación que hace la llamada (reparto justo en cada backend)
+            inputs: Variables del prompt
+            prompt_tokens: Tokens estimados del prompt
+            prompt: Otro prompt en lugar del de conversación (p. ej. el de resumen)
+            max_tokens: Límite de tokens generados con `prompt` (por defecto MAX_TOKENS)
+        
+        Returns:
+            Mensaje generado por el modelo
+        """
+        return await self.retry_policy.call(
+            lambda: self._ainvoke_once(key, inputs, prompt_tokens, prompt, max_tokens)
+        )
+    
+    async def _ainvoke_once(
+        self,
+        key: str,
+        inputs: Dict[str, Any],
+        prompt_tokens: int,
+        prompt: Optional[Runnable] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AIMessage:
+        """Un intento: prueba los backends en orden de preferencia hasta que uno responde"""
+        tried: List[Backend] = []
+        while True:
+            backend = self.pick(tried)
+            tried.append(backend)
+            try:
+                reserved = prompt_tokens + (max_tokens or AzureAIFoundryConfig.MAX_TOKENS)
+                async with backend.scheduler.slot(key, reserved) as ticket:
+                    backend.in_flight += 1
+                    backend.calls += 1
+                    started = self._clock()
+                    try:
+                        chain = backend.chain if prompt is None else backend.chain_for(
+                            prompt, max_tokens
+                        )
+                        result = await chain.ainvoke(inputs)
+                    finally:
+                        backend.in_flight -= 1
+                    usage = result.usage_metadata or {}
+                    ticket.tokens_used = usage.get("total_tokens")
+            except Exception as e:
+                if not isinstance(e, SchedulerBusyError):
+                    self._record_failure(backend, e)
+                if self._should_failover(e, tried):
+                    logger.warning(
+                        f"Backend '{backend.name}' no disponible ({e}); probando otro backend"
+                    )
+                    continue
+                raise
+            
+            latency = self._clock() - started
+            self._record_success(backend, latency, result.response_metadata.get("headers"))
+            LLM_LATENCY.observe(latency, backend.name, "invoke")
+            result.response_metadata["deployment"] = backend.deployment
+            return result
+    
+    async def astream(
+        self,
+        key: str,
+        inputs: Dict[str, Any],
+        prompt_tokens: int
+    ) -> AsyncIterator[AIMessageChunk]:
+        """
+        Genera la respuesta en fragmentos desde el mejor backend disponible
+        
+        El cambio de backend y los reintentos solo ocurren antes del primer
+        fragmento; la capacidad del backend se mantiene reservada hasta que
+        termina el stream.
+        
+        Args:
+            key: Conversación que hace la llamada
+            inputs: Variables del prompt
+            prompt_tokens: Tokens estimados del prompt
+        
+        Yields:
+            Fragmentos generados por el modelo
+        """
+        backend, ticket, first, chunks, started = await self.retry_policy.call(
+            lambda: self._open_stream_once(key, inputs, prompt_tokens)
+        )
+        output: List[str] = []
+        try:
+            if first is not None:
+                output.append(first.content)
+                yield first
+            async for chunk in chunks:
+                output.append(chunk.content)
+                yield chunk
+            LLM_LATENCY.observe(self._clock() - started, backend.name, "stream")
+        except Exception as e:
+            self._record_failure(backend, e)
+            raise
+        finally:
+            await chunks.aclose()
+            backend.in_flight -= 1
+            ticket.tokens_used = prompt_tokens + count_tokens("".join(output))
+            backend.scheduler.release(ticket)
+    
+    async def _open_stream_once(self, key: str, inputs: Dict[str, Any], prompt_tokens: int):
+        """Un intento: abre el stream en el primer backend que entregue un fragmento"""
+        tried: List[Backend] = []
+        while True:
+            backend = self.pick(tried)
+            tried.append(backend)
+            try:
+                ticket = await backend.scheduler.acquire(
+                    key, prompt_tokens + AzureAIFoundryConfig.MAX_TOKENS
+                )
+            except SchedulerBusyError as e:
+                if self._should_failover(e, tried):
+                    continue
+                raise
+            
+            backend.in_flight += 1
+            backend.calls += 1
+            started = self._clock()
+            chunks = backend.chain.astream(inputs)
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except BaseException as e:
+                backend.in_flight -= 1
+                backend.scheduler.release(ticket)
+                if not isinstance(e, Exception):
+                    raise
+                self._record_failure(backend, e)
+                if self._should_failover(e, tried):
+                    logger.warning(
+                        f"Backend '{backend.name}' no disponible ({e}); probando otro backend"
+                    )
+                    continue
+                raise
+            
+            headers = None
+            if first is not None:
+                headers = first.response_metadata.get("headers")
+                first.response_metadata["deployment"] = backend.deployment
+            first_token = self._clock() - started
+            self._record_success(backend, first_token, headers)
+            LLM_TIME_TO_FIRST_TOKEN.observe(first_token, backend.name)
+            return backend, ticket, first, chunks, started
+    
+    def get_statistics(self) -> Dict[str, Any]:
+        """Métricas por backend"""
+        now = self._clock()
+        return {
+            "failovers": self.failovers,
+            "retries": self.retry_policy.get_statistics(),
+            "backends": {backend.name: backend.get_statistics(now) for backend in self.backends}
+        }
+
+
+def create_router(prompt) -> BackendRouter:
+    """
+    Crea el router con los backends configurados
+    
+    Args:
+        prompt: Prompt de conversación que se encadena con el LLM de cada backend
+    """
+    pool = get_llm_pool()
+    backends = []
+    for config in AzureAIFoundryConfig.get_backends():
+        llm = pool.get(
+            endpoint=config["endpoint"],
+            deployment=config["deployment"],
+            api_version=config.get("api_version"),
+            api_key=config.get("api_key"),
+            managed_retries=True,
+        )
+        backends.append(Backend(
+            name=config["name"],
+            deployment=config["deployment"],
+            weight=float(config.get("weight", 1)),
+            llm=llm,
+            chain=prompt | llm,
+            scheduler=get_scheduler(config["name"], config.get("tokens_per_minute")),
+        ))
+    
+    if len(backends) > 1:
+        names = ", ".join(backend.name for backend in backends)
+        logger.info(f"Router de modelos con {len(backends)} backends: {names}")
+    return BackendRouter(
+        backends,
+        retry_policy=create_retry_policy(),
+        failure_threshold=AzureAIFoundryConfig.ROUTER_FAILURE_THRESHOLD,
+        cooldown=AzureAIFoundryConfig.ROUTER_COOLDOWN,
+    )
@@ -0,0 +1,359 @@
+"""
+Control de admisión de llamadas al modelo: concurrencia, tokens por minuto y cola justa
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional
+
+from app.config import AzureAIFoundryConfig
+from app.metrics import LLM_QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerBusyError(Exception):
+    """La cola de llamadas al modelo está llena o la espera superó el límite"""
+
+
+class TokenBucket:
+    """
+    Presupuesto de tokens por minuto (cubeta que se rellena de forma continua).
+    
+    Las reservas se hacen con una estimación y se ajustan al uso real cuando
+    termina la llamada; el saldo puede quedar negativo temporalmente.
+    """
+    
+    def __init__(self, tokens_per_minute: int, clock: Callable[[], float] = time.monotonic):
+        """
+        Inicializa la cubeta llena
+        
+        Args:
+            tokens_per_minute: Cuota de tokens por minuto del deployment
+            clock: Reloj monotónico (inyectable para tests)
+        """
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self._clock = clock
+        self.tokens = self.capacity
+        self._updated = clock()
+    
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def wait_time(self, tokens: int) -> float:
+        """Segundos hasta que haya saldo para `tokens` (0 si ya lo hay)"""
+        self._refill()
+        needed = min(tokens, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+    
+    def consume(self, tokens: int) -> None:
+        """Descuenta tokens (un valor negativo los devuelve)"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - tokens)
+    
+    def limit(self, tokens: int) -> None:
+        """Reduce el saldo si el servicio informa menos tokens disponibles"""
+        self._refill()
+        self.tokens = min(self.tokens, float(tokens))
+    
+    def available(self) -> int:
+        """Saldo actual"""
+        self._refill()
+        return int(self.tokens)
+
+
+class Ticket:
+    """Permiso concedido para una llamada; `tokens_used` ajusta el presupuesto al liberar"""
+    
+    __slots__ = ("key", "tokens", "future", "enqueued_at", "tokens_used")
+    
+    def __init__(self, key: str, tokens: int, enqueued_at: float):
+        self.key = key
+        self.tokens = tokens
+        self.enqueued_at = enqueued_at
+        self.future: Optional[asyncio.Future] = None
+        self.tokens_used: Optional[int] = None
+
+
+class LLMScheduler:
+    """
+    Planificador de llamadas a un deployment.
+    
+    Limita las llamadas simultáneas y el consumo de tokens por minuto. Las
+    solicitudes que no pueden empezar esperan en una cola acotada, repartida
+    por conversación y atendida por turnos (round-robin), de modo que una
+    conversación con muchos mensajes no retrasa a las demás. Si la cola está
+    llena o la espera supera el límite se lanza SchedulerBusyError.
+    """
+    
+    def __init__(
+        self,
+        max_concurrency: int,
+        tokens_per_minute: int = 0,
+        max_queue: int = 100,
+        queue_timeout: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+        name: str = "primary",
+    ):
+        """
+        Inicializa el planificador
+        
+        Args:
+            max_concurrency: Máximo de llamadas simultáneas al deployment
+            tokens_per_minute: Cuota de tokens por minuto (0 = sin límite)
+            max_queue: Máximo de solicitudes en espera
+            queue_timeout: Segundos máximos de espera en cola (0 = sin límite)
+            clock: Reloj monotónico (inyectable para tests)
+            name: Backend al que pertenece (etiqueta de las métricas)
+        """
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._clock = clock
+        self.bucket = TokenBucket(tokens_per_minute, clock) if tokens_per_minute > 0 else None
+        
+        self._queues: Dict[str, Deque[Ticket]] = {}
+        self._turns: Deque[str] = deque()
+        self._queued = 0
+        self._in_flight = 0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+        
+        self.granted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.pauses = 0
+    
+    @property
+    def in_flight(self) -> int:
+        """Llamadas en curso"""
+        return self._in_flight
+    
+    @property
+    def queued(self) -> int:
+        """Solicitudes en espera"""
+        return self._queued
+    
+    def _can_start(self, ticket: Ticket) -> bool:
+        """Indica si hay concurrencia y presupuesto para iniciar la llamada"""
+        if self._in_flight >= self.max_concurrency or self._clock() < self._paused_until:
+            return False
+        return self.bucket is None or self.bucket.wait_time(ticket.tokens) == 0
+    
+    def _grant(self, ticket: Ticket) -> None:
+        self._in_flight += 1
+        self.granted += 1
+        wait = self._clock() - ticket.enqueued_at
+        self.total_wait += wait
+        LLM_QUEUE_WAIT.observe(wait, self.name)
+        if self.bucket is not None:
+            self.bucket.consume(ticket.tokens)
+    
+    async def acquire(self, key: str, tokens: int = 0) -> Ticket:
+        """
+        Espera un permiso para llamar al modelo
+        
+        Args:
+            key: Conversación que hace la llamada (unidad de reparto justo)
+            tokens: Tokens estimados de la llamada (prompt + máximo de respuesta)
+        
+        Returns:
+            Ticket que debe liberarse con `release`
+        
+        Raises:
+            SchedulerBusyError: Si la cola está llena o la espera expira
+        """
+        ticket = Ticket(key, tokens, self._clock())
+        
+        # Camino rápido: nadie esperando y hay capacidad
+        if not self._queued and self._can_start(ticket):
+            self._grant(ticket)
+            return ticket
+        
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerBusyError("Cola de llamadas al modelo llena")
+        
+        ticket.future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._turns.append(key)
+        queue.append(ticket)
+        self._queued += 1
+        self._dispatch()
+        
+        try:
+            if self.queue_timeout:
+                await asyncio.wait_for(asyncio.shield(ticket.future), self.queue_timeout)
+            else:
+                await ticket.future
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Se concedió justo al expirar o cancelarse: se devuelve el permiso
+                self.release(ticket)
+            else:
+                ticket.future.cancel()
+                self._discard(ticket)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise SchedulerBusyError("Tiempo de espera en cola agotado") from None
+            raise
+        return ticket
+    
+    def release(self, ticket: Ticket) -> None:
+        """Libera el permiso y ajusta el presupuesto con el uso real"""
+        self._in_flight -= 1
+        if self.bucket is not None and ticket.tokens_used is not None:
+            self.bucket.consume(ticket.tokens_used - ticket.tokens)
+        self._dispatch()
+    
+    @asynccontextmanager
+    async def slot(self, key: str, tokens: int = 0) -> AsyncIterator[Ticket]:
+        """Context manager asíncrono sobre acquire/release"""
+        ticket = await self.acquire(key, tokens)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+    
+    def pause(self, seconds: float) -> None:
+        """Detiene la admisión de llamadas nuevas (p. ej. tras un 429 con Retry-After)"""
+        if seconds <= 0:
+            return
+        until = self._clock() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self.pauses += 1
+            logger.info(f"Admisión de llamadas al modelo pausada {seconds:.2f}s")
+    
+    def observe_quota(
+        self, remaining_requests: Optional[int], remaining_tokens: Optional[int]
+    ) -> None:
+        """
+        Ajusta el presupuesto local a la cuota restante que informa el servicio
+        
+        Args:
+            remaining_requests: Valor de x-ratelimit-remaining-requests
+            remaining_tokens: Valor de x-ratelimit-remaining-tokens
+        """
+        if self.bucket is not None and remaining_tokens is not None:
+            self.bucket.limit(remaining_tokens)
+    
+    def _discard(self, ticket: Ticket) -> None:
+        """Quita de la cola una solicitud que ya no espera"""
+        queue = self._queues.get(ticket.key)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        self._queued -= 1
+        if not queue:
+            del self._queues[ticket.key]
+            self._turns.remove(ticket.key)
+        self._dispatch()
+    
+    def _dispatch(self) -> None:
+        """Concede permisos por turnos mientras haya capacidad"""
+        paused_for = self._paused_until - self._clock()
+        if self._turns and paused_for > 0:
+            self._schedule_wakeup(paused_for)
+            return
+        
+        while self._turns and self._in_flight < self.max_concurrency:
+            key = self._turns[0]
+            queue = self._queues[key]
+            ticket = queue[0]
+            if ticket.future.done():
+                # Cancelada mientras esperaba; `acquire` la quitará de la cola
+                self._discard(ticket)
+                continue
+            
+            if self.bucket is not None:
+                delay = self.bucket.wait_time(ticket.tokens)
+                if delay > 0:
+                    self._schedule_wakeup(delay)
+                    return
+            
+            queue.popleft()
+            self._queued -= 1
+            self._turns.popleft()
+            if queue:
+                self._turns.append(key)
+            else:
+                del self._queues[key]
+            
+            self._grant(ticket)
+            ticket.future.set_result(None)
+    
+    def _schedule_wakeup(self, delay: float) -> None:
+        """Reintenta el despacho cuando se haya repuesto el presupuesto"""
+        if self._wakeup is not None:
+            return
+        
+        def wakeup():
+            self._wakeup = None
+            self._dispatch()
+        
+        self._wakeup = asyncio.get_running_loop().call_later(delay, wakeup)
+    
+    def get_statistics(self) -> Dict[str, Any]:
+        """Métricas del planificador"""
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "max_concurrency": self.max_concurrency,
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "pauses": self.pauses,
+            "average_wait_ms": (
+                round(self.total_wait / self.granted * 1000, 1) if self.granted else 0
+            ),
+            "tokens_available": self.bucket.available() if self.bucket is not None else None
+        }
+
+
+_schedulers: Dict[str, LLMScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(
+    backend: str = "primary", tokens_per_minute: Optional[int] = None
+) -> LLMScheduler:
+    """
+    Retorna el planificador de un backend (uno por proceso y deployment)
+    
+    Args:
+        backend: Nombre del backend
+        tokens_per_minute: Cuota propia del deployment (por defecto LLM_TOKENS_PER_MINUTE)
+    """
+    scheduler = _schedulers.get(backend)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(backend)
+            if scheduler is None:
+                if tokens_per_minute is None:
+                    tokens_per_minute = AzureAIFoundryConfig.LLM_TOKENS_PER_MINUTE
+                scheduler = _schedulers[backend] = LLMScheduler(
+                    max_concurrency=AzureAIFoundryConfig.LLM_MAX_CONCURRENCY,
+                    tokens_per_minute=tokens_per_minute,
+                    max_queue=AzureAIFoundryConfig.LLM_MAX_QUEUE,
+                    queue_timeout=AzureAIFoundryConfig.LLM_QUEUE_TIMEOUT,
+                    name=backend,
+                )
+                logger.info(
+                    f"Planificador de '{backend}': {scheduler.max_concurrency} llamadas "
+                    f"simultáneas, {tokens_per_minute or 'sin límite de'} "
+                    f"tokens/min, cola de {scheduler.max_queue}"
+                )
+    return scheduler
@@ -0,0 +1,346 @@
+"""
+Estado compacto por conversación
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.tokens import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+# (rol, contenido) con rol "human" o "ai", formato aceptado por MessagesPlaceholder
+Turn = Tuple[str, str]
+
+# Costo aproximado en memoria de cada mensaje además de su texto (tupla + objetos str)
+MESSAGE_OVERHEAD_BYTES = 120
+SESSION_OVERHEAD_BYTES = 200
+
+
+def estimate_message_bytes(content: str) -> int:
+    """Estimación barata de la memoria que ocupa un mensaje del historial"""
+    return len(content) + MESSAGE_OVERHEAD_BYTES
+
+
+class ChatSession:
+    """
+    Registro mínimo de una conversación: historial y contadores.
+    
+    Todo lo costoso (cliente LLM, prompt, cadena) es compartido por el proceso;
+    cada conversación solo guarda sus datos.
+    """
+    
+    __slots__ = (
+        "session_id",
+        "history",
+        "total_tokens_used",
+        "total_calls",
+        "last_activity",
+        "approx_bytes",
+        "history_tokens",
+        "memory_state",
+        "version",
+    )
+    
+    def __init__(self, session_id: str, history: Optional[List[Turn]] = None):
+        """
+        Inicializa la sesión
+        
+        Args:
+            session_id: ID de la conversación
+            history: Historial previo (opcional)
+        """
+        self.session_id = session_id
+        self.history: List[Turn] = history if history is not None else []
+        self.total_tokens_used = 0
+        self.total_calls = 0
+        self.last_activity = time.monotonic()
+        self.approx_bytes = SESSION_OVERHEAD_BYTES + sum(
+            estimate_message_bytes(content) for _, content in self.history
+        )
+        # Tokens del historial, actualizados al agregar o quitar turnos (no se recalculan por turno)
+        self.history_tokens = count_message_tokens(self.history)
+        # Estado propio del modo de memoria (p. ej. resumen acumulado); None en modo buffer
+        self.memory_state = None
+        # Se incrementa con cada cambio; permite detectar copias desactualizadas
+        # cuando varios procesos comparten el almacén de sesiones
+        self.version = 0
+    
+    def touch(self) -> None:
+        """Marca la sesión como usada ahora"""
+        self.last_activity = time.monotonic()
+    
+    def add_turn(self, user_message: str, ai_message: str) -> None:
+        """Agrega un intercambio usuario/asistente al historial"""
+        turn = [("human", user_message), ("ai", ai_message)]
+        self.history.extend(turn)
+        self.approx_bytes += (
+            estimate_message_bytes(user_message) + estimate_message_bytes(ai_message)
+        )
+        self.history_tokens += count_message_tokens(turn)
+        self.version += 1
+        self.touch()
+    
+    def pop_oldest_turn(self) -> List[Turn]:
+        """Quita y retorna el intercambio más antiguo del historial"""
+        turn, self.history = self.history[:2], self.history[2:]
+        self.approx_bytes -= sum(estimate_message_bytes(content) for _, content in turn)
+        self.history_tokens -= count_message_tokens(turn)
+        return turn
+    
+    def clear(self) -> None:
+        """Limpia el historial"""
+        self.history = []
+        self.approx_bytes = SESSION_OVERHEAD_BYTES
+        self.history_tokens = 0
+        self.memory_state = None
+        self.version += 1
+        self.touch()
+    
+    @property
+    def message_count(self) -> int:
+        """Número de mensajes en el historial"""
+        return len(self.history)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Representación compacta serializable (JSON) de la sesión"""
+        memory_state = self.memory_state
+        if memory_state is not None and hasattr(memory_state, "to_dict"):
+            memory_state = memory_state.to_dict()
+        return {
+            "id": self.session_id,
+            "v": self.version,
+            "h": [[role, content] for role, content in self.history],
+            "tokens": self.total_tokens_used,
+            "calls": self.total_calls,
+            "memory": memory_state,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChatSession":
+        """
+        Reconstruye una sesión serializada con to_dict
+        
+        El estado de memoria se conserva como diccionario; la política de
+        memoria lo convierte a su propio tipo al usarlo.
+        """
+        session = cls(data["id"], [(role, content) for role, content in data.get("h", [])])
+        session.version = data.get("v", 0)
+        session.total_tokens_used = data.get("tokens", 0)
+        session.total_calls = data.get("calls", 0)
+        session.memory_state = data.get("memory")
+        return session
+
+
+class SessionSpillStore:
+    """
+    Destino opcional para sesiones desalojadas de memoria.
+    
+    Por defecto no guarda nada (las sesiones desalojadas se descartan);
+    las subclases pueden persistirlas para restaurarlas en el siguiente mensaje.
+    """
+    
+    def save(self, session: ChatSession) -> None:
+        """Guarda una sesión desalojada"""
+    
+    def load(self, session_id: str) -> Optional[ChatSession]:
+        """Recupera una sesión guardada previamente (o None)"""
+        return None
+
+
+class SessionCache:
+    """
+    Almacén acotado de sesiones con desalojo LRU, expiración por inactividad
+    y presupuesto aproximado de memoria sobre el historial.
+    
+    El tamaño de cada sesión se reconcilia cada vez que se accede a ella, por
+    lo que el total en bytes es aproximado (desfasado como mucho un turno
+    por sesión activa).
+    """
+    
+    def __init__(
+        self,
+        max_sessions: int,
+        idle_ttl: float,
+        max_bytes: int,
+        sweep_interval: float = 60.0,
+        spill_store: Optional[SessionSpillStore] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Inicializa el almacén
+        
+        Args:
+            max_sessions: Máximo de sesiones en memoria (0 = sin límite)
+            idle_ttl: Segundos de inactividad antes de expirar (0 = sin expiración)
+            max_bytes: Presupuesto aproximado de memoria del historial (0 = sin límite)
+            sweep_interval: Segundos mínimos entre barridos de expiración
+            spill_store: Destino opcional de las sesiones desalojadas
+            clock: Reloj monotónico (inyectable para tests)
+        """
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.spill_store = spill_store
+        self._clock = clock
+        
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self.total_bytes = 0
+        self._last_sweep = clock()
+        
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "restored": 0,
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+            "evicted_memory": 0,
+            "spilled": 0,
+        }
+    
+    def __len__(self) -> int:
+        return len(self._sessions)
+    
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+    
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        """Retorna la sesión en memoria sin crearla ni alterar el orden LRU"""
+        return self._sessions.get(session_id)
+    
+    def put(self, session: ChatSession) -> None:
+        """Agrega o reemplaza una sesión (p. ej. cargada del almacén compartido)"""
+        self.remove(session.session_id)
+        session.last_activity = self._clock()
+        self._sessions[session.session_id] = session
+        self._sizes[session.session_id] = 0
+        self.stats["restored"] += 1
+        self._reconcile(session)
+        self._enforce_limits(session.last_activity, keep=session.session_id)
+    
+    def values(self) -> Iterator[ChatSession]:
+        """Itera las sesiones en memoria (de la menos a la más reciente)"""
+        return iter(list(self._sessions.values()))
+    
+    def get_or_create(self, session_id: str) -> ChatSession:
+        """
+        Obtiene una sesión (restaurándola o creándola si no está en memoria)
+        y aplica los límites del almacén
+        
+        Args:
+            session_id: ID de la conversación
+            
+        Returns:
+            Sesión de la conversación
+        """
+        now = self._clock()
+        session = self._sessions.get(session_id)
+        
+        if session is not None and self.idle_ttl and now - session.last_activity > self.idle_ttl:
+            self._evict(session_id, "evicted_ttl")
+            session = None
+        
+        if session is not None:
+            self.stats["hits"] += 1
+            self._sessions.move_to_end(session_id)
+        else:
+            self.stats["misses"] += 1
+            if self.spill_store is not None:
+                session = self.spill_store.load(session_id)
+                if session is not None:
+                    self.stats["restored"] += 1
+            if session is None:
+                session = ChatSession(session_id)
+            self._sessions[session_id] = session
+            self._sizes[session_id] = 0
+        
+        session.last_activity = now
+        self._reconcile(session)
+        self._enforce_limits(now, keep=session_id)
+        return session
+    
+    def remove(self, session_id: str) -> bool:
+        """Elimina una sesión sin enviarla al spill store"""
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self.total_bytes -= self._sizes.pop(session_id, 0)
+        return True
+    
+    def clear(self) -> None:
+        """Elimina todas las sesiones en memoria"""
+        self._sessions.clear()
+        self._sizes.clear()
+        self.total_bytes = 0
+    
+    def sweep(self) -> int:
+        """
+        Expira las sesiones inactivas y reaplica los límites
+        
+        Returns:
+            Número de sesiones desalojadas
+        """
+        before = len(self._sessions)
+        self._last_sweep = -float("inf")
+        self._enforce_limits(self._clock())
+        return before - len(self._sessions)
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Métricas del almacén y de desalojos"""
+        return {
+            "active": len(self._sessions),
+            "approx_bytes": self.total_bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            **self.stats,
+        }
+    
+    def _reconcile(self, session: ChatSession) -> None:
+        """Actualiza el total en bytes con el tamaño actual de la sesión"""
+        previous = self._sizes.get(session.session_id, 0)
+        self._sizes[session.session_id] = session.approx_bytes
+        self.total_bytes += session.approx_bytes - previous
+    
+    def _enforce_limits(self, now: float, keep: Optional[str] = None) -> None:
+        """Aplica TTL, número máximo de sesiones y presupuesto de memoria"""
+        if self.idle_ttl and now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            expired = [
+                session_id for session_id, session in self._sessions.items()
+                if session_id != keep and now - session.last_activity > self.idle_ttl
+            ]
+            for session_id in expired:
+                self._evict(session_id, "evicted_ttl")
+        
+        while self.max_sessions and len(self._sessions) > self.max_sessions:
+            if not self._evict_oldest("evicted_lru", keep):
+                break
+        
+        while self.max_bytes and self.total_bytes > self.max_bytes:
+            if not self._evict_oldest("evicted_memory", keep):
+                break
+    
+    def _evict_oldest(self, reason: str, keep: Optional[str]) -> bool:
+        """Desaloja la sesión usada hace más tiempo (excepto `keep`)"""
+        for session_id in self._sessions:
+            if session_id != keep:
+                self._evict(session_id, reason)
+                return True
+        return False
+    
+    def _evict(self, session_id: str, reason: str) -> None:
+        """Desaloja una sesión, enviándola al spill store si existe"""
+        session = self._sessions.pop(session_id)
+        self.total_bytes -= self._sizes.pop(session_id, 0)
+        self.stats[reason] += 1
+        logger.debug(f"Sesión desalojada ({reason}): {session_id}")
+        
+        if self.spill_store is not None:
+            try:
+                self.spill_store.save(session)
+                self.stats["spilled"] += 1
+            except Exception as e:
+                logger.warning(f"No se pudo guardar la sesión desalojada {session_id}: {e}")
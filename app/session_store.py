@@ -0,0 +1,548 @@
+"""
+Almacén de sesiones compartido entre procesos o réplicas del bot
+"""
+import abc
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from app import fastjson
+from app.config import SessionConfig
+from app.session import ChatSession
+
+logger = logging.getLogger(__name__)
+
+Record = Dict[str, Any]
+
+
+def dumps_record(record: Record) -> str:
+    """Serialización compacta de una sesión"""
+    return fastjson.dumps_str(record)
+
+
+def loads_record(data) -> Record:
+    """Deserializa una sesión guardada con dumps_record"""
+    return fastjson.loads(data)
+
+
+class SessionStore(abc.ABC):
+    """
+    Interfaz de los almacenes de sesiones.
+    
+    Guardan el registro serializado de cada conversación (ChatSession.to_dict)
+    con una expiración, de modo que cualquier proceso pueda continuar una
+    conversación que empezó otro. Las escrituras llegan en lotes desde
+    WriteBehindWriter.
+    """
+    
+    backend = "none"
+    
+    @abc.abstractmethod
+    async def load(self, session_id: str) -> Optional[Record]:
+        """Lee una sesión (None si no existe o expiró)"""
+    
+    @abc.abstractmethod
+    async def save_many(self, records: Dict[str, Record]) -> None:
+        """Guarda un lote de sesiones"""
+    
+    @abc.abstractmethod
+    async def delete_many(self, session_ids: Iterable[str]) -> None:
+        """Elimina un lote de sesiones"""
+    
+    async def close(self) -> None:
+        """Libera conexiones"""
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Almacén en el propio proceso.
+    
+    No se comparte entre procesos; sirve para un único worker y para
+    pruebas. Guarda los registros serializados para que el comportamiento
+    sea idéntico al de los almacenes externos.
+    """
+    
+    backend = "memory"
+    
+    def __init__(self, ttl: float = 0, clock: Callable[[], float] = time.time):
+        """
+        Inicializa el almacén
+        
+        Args:
+            ttl: Segundos de vida de cada sesión desde su última escritura (0 = sin expiración)
+            clock: Reloj (inyectable para tests)
+        """
+        self.ttl = ttl
+        self._clock = clock
+        self._data: Dict[str, Tuple[str, float]] = {}
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    async def load(self, session_id: str) -> Optional[Record]:
+        entry = self._data.get(session_id)
+        if entry is None:
+            return None
+        data, expires = entry
+        if expires and self._clock() >= expires:
+            del self._data[session_id]
+            return None
+        return loads_record(data)
+    
+    async def save_many(self, records: Dict[str, Record]) -> None:
+        expires = self._clock() + self.ttl if self.ttl else 0
+        for session_id, record in records.items():
+            self._data[session_id] = (dumps_record(record), expires)
+    
+    async def delete_many(self, session_ids: Iterable[str]) -> None:
+        for session_id in session_ids:
+            self._data.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Almacén en un archivo SQLite.
+    
+    Permite compartir sesiones entre workers de la misma máquina (o un
+    volumen compartido). Usa modo WAL para que las lecturas no bloqueen a
+    las escrituras y ejecuta las consultas en un hilo para no bloquear el
+    bucle de eventos.
+    """
+    
+    backend = "sqlite"
+    
+    # Segundos mínimos entre purgas de sesiones expiradas
+    PURGE_INTERVAL = 300
+    
+    def __init__(self, path: str, ttl: float = 0, clock: Callable[[], float] = time.time):
+        """
+        Inicializa el almacén
+        
+        Args:
+            path: Ruta del archivo de base de datos
+            ttl: Segundos de vida de cada sesión desde su última escritura (0 = sin expiración)
+            clock: Reloj de pared (compartido entre procesos)
+        """
+        self.path = path
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._conn = sqlite3.connect(
+            path, timeout=10, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+    
+    def _load(self, session_id: str) -> Optional[Record]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE id = ? AND (expires = 0 OR expires > ?)",
+                (session_id, self._clock()),
+            ).fetchone()
+        return loads_record(row[0]) if row else None
+    
+    def _save_many(self, records: Dict[str, Record]) -> None:
+        now = self._clock()
+        expires = now + self.ttl if self.ttl else 0
+        rows = [
+            (session_id, dumps_record(record), expires)
+            for session_id, record in records.items()
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO sessions (id, data, expires) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET "
+                    "data = excluded.data, expires = excluded.expires",
+                    rows,
+                )
+                if self.ttl and now - self._last_purge >= self.PURGE_INTERVAL:
+                    self._last_purge = now
+                    self._conn.execute(
+                        "DELETE FROM sessions WHERE expires > 0 AND expires <= ?", (now,)
+                    )
+    
+    def _delete_many(self, session_ids: List[str]) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "DELETE FROM sessions WHERE id = ?", [(i,) for i in session_ids]
+                )
+    
+    async def load(self, session_id: str) -> Optional[Record]:
+        return await asyncio.to_thread(self._load, session_id)
+    
+    async def save_many(self, records: Dict[str, Record]) -> None:
+        await asyncio.to_thread(self._save_many, records)
+    
+    async def delete_many(self, session_ids: Iterable[str]) -> None:
+        await asyncio.to_thread(self._delete_many, list(session_ids))
+    
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RespError(Exception):
+    """Error devuelto por el servidor Redis"""
+
+
+class RespConnection:
+    """
+    Cliente mínimo del protocolo de Redis (RESP) sobre asyncio.
+    
+    Solo lo necesario para el almacén de sesiones: una conexión perezosa,
+    autenticación, selección de base y comandos en pipeline. Funciona con
+    cualquier servidor compatible (Redis, Azure Cache for Redis, Valkey).
+    """
+    
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        username: Optional[str] = None,
+        ssl: bool = False,
+        timeout: float = 5.0,
+    ):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.username = username
+        self.ssl = ssl
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+    
+    @classmethod
+    def from_url(cls, url: str) -> "RespConnection":
+        """Crea la conexión desde redis://[usuario:password@]host:puerto/db (rediss:// para TLS)"""
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", "rediss"):
+            raise ValueError(f"URL de Redis no válida: {url}")
+        path = parsed.path.lstrip("/")
+        return cls(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(path) if path else 0,
+            password=unquote(parsed.password) if parsed.password else None,
+            username=unquote(parsed.username) if parsed.username else None,
+            ssl=parsed.scheme == "rediss",
+        )
+    
+    @staticmethod
+    def _encode(args: Tuple[Any, ...]) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+    
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Conexión con Redis cerrada")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RespError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Respuesta de Redis no reconocida: {line!r}")
+    
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl or None),
+            self.timeout,
+        )
+        setup: List[Tuple[Any, ...]] = []
+        if self.password:
+            if self.username:
+                setup.append(("AUTH", self.username, self.password))
+            else:
+                setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            for reply in await self._send(setup):
+                if isinstance(reply, RespError):
+                    await self._disconnect()
+                    raise reply
+    
+    async def _disconnect(self) -> None:
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+    
+    async def _send(self, commands: List[Tuple[Any, ...]]) -> list:
+        self._writer.write(b"".join(self._encode(command) for command in commands))
+        await self._writer.drain()
+        return [await asyncio.wait_for(self._read_reply(), self.timeout) for _ in commands]
+    
+    async def pipeline(self, commands: List[Tuple[Any, ...]]) -> list:
+        """
+        Envía varios comandos en un solo viaje de red
+        
+        Returns:
+            Respuestas en el mismo orden (los errores de Redis se devuelven como RespError)
+        """
+        async with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    return await self._send(commands)
+                except (
+                    ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError
+                ):
+                    await self._disconnect()
+                    # Una conexión reciclada por el servidor se reintenta una vez
+                    if attempt == 2:
+                        raise
+    
+    async def execute(self, *args: Any):
+        """Ejecuta un comando y retorna su respuesta"""
+        reply = (await self.pipeline([args]))[0]
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+    
+    async def close(self) -> None:
+        """Cierra la conexión"""
+        async with self._lock:
+            await self._disconnect()
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Almacén en Redis (o un servidor compatible con su protocolo).
+    
+    Cada sesión es una clave con expiración; los lotes se envían en un único
+    pipeline. Es el backend para varias réplicas del bot.
+    """
+    
+    backend = "redis"
+    
+    def __init__(
+        self,
+        connection: RespConnection,
+        ttl: float = 0,
+        prefix: str = "teams-bot:session:",
+    ):
+        """
+        Inicializa el almacén
+        
+        Args:
+            connection: Conexión RESP
+            ttl: Segundos de vida de cada sesión desde su última escritura (0 = sin expiración)
+            prefix: Prefijo de las claves
+        """
+        self.connection = connection
+        self.ttl = ttl
+        self.prefix = prefix
+    
+    def _key(self, session_id: str) -> str:
+        return self.prefix + session_id
+    
+    async def load(self, session_id: str) -> Optional[Record]:
+        data = await self.connection.execute("GET", self._key(session_id))
+        return loads_record(data) if data is not None else None
+    
+    async def save_many(self, records: Dict[str, Record]) -> None:
+        expiry: Tuple[Any, ...] = ("PX", int(self.ttl * 1000)) if self.ttl else ()
+        commands = [
+            ("SET", self._key(session_id), dumps_record(record)) + expiry
+            for session_id, record in records.items()
+        ]
+        for reply in await self.connection.pipeline(commands):
+            if isinstance(reply, RespError):
+                raise reply
+    
+    async def delete_many(self, session_ids: Iterable[str]) -> None:
+        keys = [self._key(session_id) for session_id in session_ids]
+        if keys:
+            await self.connection.execute("DEL", *keys)
+    
+    async def close(self) -> None:
+        await self.connection.close()
+
+
+class WriteBehindWriter:
+    """
+    Escritura diferida de sesiones modificadas.
+    
+    Cada turno solo marca la sesión como pendiente; una tarea en segundo
+    plano la serializa y la escribe junto con las demás en un lote cada
+    `interval` segundos (o antes si se acumulan `max_batch`). Varios turnos
+    de una misma conversación dentro del intervalo generan una sola
+    escritura. Si el almacén falla, las sesiones quedan pendientes para el
+    siguiente lote.
+    """
+    
+    def __init__(self, store: SessionStore, interval: float = 0.5, max_batch: int = 100):
+        """
+        Inicializa el escritor
+        
+        Args:
+            store: Almacén de destino
+            interval: Segundos máximos que una modificación espera para escribirse
+            max_batch: Pendientes que fuerzan una escritura inmediata
+        """
+        self.store = store
+        self.interval = interval
+        self.max_batch = max(1, max_batch)
+        # None marca una sesión a eliminar
+        self._dirty: Dict[str, Optional[ChatSession]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        
+        self.writes = 0
+        self.deletes = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.errors = 0
+    
+    def is_pending(self, session_id: str) -> bool:
+        """Indica si la sesión tiene cambios aún no escritos"""
+        return session_id in self._dirty
+    
+    def mark(self, session: ChatSession) -> None:
+        """Programa la escritura de una sesión modificada"""
+        self._enqueue(session.session_id, session)
+    
+    def delete(self, session_id: str) -> None:
+        """Programa la eliminación de una sesión"""
+        self._enqueue(session_id, None)
+    
+    def _enqueue(self, session_id: str, session: Optional[ChatSession]) -> None:
+        if session_id in self._dirty:
+            self.coalesced += 1
+        self._dirty[session_id] = session
+        self._ensure_running()
+        if len(self._dirty) >= self.max_batch:
+            self._wakeup.set()
+    
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    async def flush(self) -> None:
+        """Escribe ahora todas las sesiones pendientes"""
+        if not self._dirty:
+            return
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            batch, self._dirty = self._dirty, {}
+            records = {
+                session_id: session.to_dict()
+                for session_id, session in batch.items()
+                if session is not None
+            }
+            deleted = [session_id for session_id, session in batch.items() if session is None]
+            try:
+                if records:
+                    await self.store.save_many(records)
+                if deleted:
+                    await self.store.delete_many(deleted)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(
+                    f"Error escribiendo {len(batch)} sesiones en el almacén ({e}); "
+                    "se reintentará"
+                )
+                # Lo modificado mientras se escribía tiene prioridad sobre el lote fallido
+                for session_id, session in batch.items():
+                    self._dirty.setdefault(session_id, session)
+                return
+            self.batches += 1
+            self.writes += len(records)
+            self.deletes += len(deleted)
+    
+    async def close(self) -> None:
+        """Escribe lo pendiente, detiene la tarea y cierra el almacén"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        await self.store.close()
+    
+    def get_statistics(self) -> Dict[str, Any]:
+        """Métricas de escritura"""
+        return {
+            "backend": self.store.backend,
+            "pending": len(self._dirty),
+            "writes": self.writes,
+            "deletes": self.deletes,
+            "batches": self.batches,
+            "coalesced": self.coalesced,
+            "errors": self.errors
+        }
+
+
+def create_session_store() -> Optional[SessionStore]:
+    """
+    Crea el almacén configurado en SESSION_STORE_BACKEND
+    
+    Returns:
+        Almacén o None si las sesiones solo viven en la memoria del proceso
+    """
+    backend = SessionConfig.STORE_BACKEND
+    ttl = SessionConfig.STORE_TTL
+    if not backend:
+        return None
+    if backend == "memory":
+        return MemorySessionStore(ttl=ttl)
+    if backend == "sqlite":
+        return SQLiteSessionStore(SessionConfig.STORE_URL or "sessions.db", ttl=ttl)
+    if backend == "redis":
+        return RedisSessionStore(
+            RespConnection.from_url(SessionConfig.STORE_URL or "redis://localhost:6379/0"),
+            ttl=ttl,
+        )
+    raise ValueError(f"SESSION_STORE_BACKEND no soportado: {backend}")
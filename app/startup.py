@@ -0,0 +1,124 @@
+"""
+Medición del arranque del proceso (importaciones y construcción del bot)
+"""
+import importlib
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Inicio del proceso: se toma al importar este módulo, que la aplicación
+# importa antes que el resto de sus dependencias
+PROCESS_STARTED = time.perf_counter()
+
+# Dependencias pesadas que se importan en segundo plano, después de abrir el puerto
+HEAVY_MODULES = (
+    "botbuilder.schema",
+    "botbuilder.core",
+    "openai",
+    "langchain_core",
+    "langchain",
+    "langchain_openai",
+    "azure.identity",
+    "numpy",
+)
+
+
+class StartupReport:
+    """
+    Tiempos del arranque: cuánto tarda el servidor en atender y el bot en estar listo
+    
+    Los tiempos se miden desde PROCESS_STARTED (al importar la aplicación),
+    de modo que incluyen configuración, importaciones y la construcción de
+    clientes.
+    """
+    
+    def __init__(
+        self,
+        clock: Callable[[], float] = time.perf_counter,
+        started: Optional[float] = None,
+    ):
+        """
+        Inicializa el reporte
+        
+        Args:
+            clock: Reloj (inyectable para tests)
+            started: Instante de inicio (por defecto PROCESS_STARTED con el reloj
+                por defecto, o el momento de crear el reporte con otro reloj)
+        """
+        self._clock = clock
+        if started is None:
+            started = PROCESS_STARTED if clock is time.perf_counter else clock()
+        self.started = started
+        self.serving_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self.error: Optional[str] = None
+        # Milisegundos por módulo importado y por fase de construcción
+        self.imports: Dict[str, float] = {}
+        self.phases: Dict[str, float] = {}
+    
+    def _elapsed_ms(self, since: float) -> float:
+        return round((self._clock() - since) * 1000, 1)
+    
+    def import_modules(self, names: Iterable[str]) -> None:
+        """Importa y cronometra cada módulo (los no instalados se omiten)"""
+        for name in names:
+            start = self._clock()
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                logger.debug(f"Módulo {name} no disponible: {e}")
+                continue
+            self.imports[name] = self._elapsed_ms(start)
+    
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Cronometra una fase del arranque"""
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.phases[name] = self._elapsed_ms(start)
+    
+    def mark_serving(self) -> None:
+        """El servidor HTTP ya atiende solicitudes (/health responde)"""
+        self.serving_at = self._clock()
+    
+    def mark_ready(self) -> None:
+        """El bot está construido y puede procesar mensajes"""
+        self.ready_at = self._clock()
+    
+    def mark_failed(self, error: BaseException) -> None:
+        """La construcción del bot falló"""
+        self.error = f"{type(error).__name__}: {error}"
+    
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+    
+    def _seconds(self, at: Optional[float]) -> Optional[float]:
+        return round(at - self.started, 3) if at is not None else None
+    
+    def get_report(self) -> Dict[str, Any]:
+        """Obtiene el reporte de arranque"""
+        return {
+            "ready": self.ready,
+            "serving_after_s": self._seconds(self.serving_at),
+            "ready_after_s": self._seconds(self.ready_at),
+            "imports_ms": dict(self.imports),
+            "phases_ms": dict(self.phases),
+            "error": self.error,
+        }
+    
+    def log_summary(self) -> None:
+        """Registra el reporte de arranque"""
+        slowest = sorted(self.imports.items(), key=lambda item: item[1], reverse=True)[:3]
+        imports = ", ".join(f"{name} {ms:.0f}ms" for name, ms in slowest)
+        phases = ", ".join(f"{name} {ms:.0f}ms" for name, ms in self.phases.items())
+        logger.info(
+            f"Arranque: atendiendo en {self._seconds(self.serving_at)}s, "
+            f"bot listo en {self._seconds(self.ready_at)}s "
+            f"(importaciones más lentas: {imports}; fases: {phases})"
+        )
@@ -0,0 +1,62 @@
+"""
+Conteo aproximado de tokens
+"""
+import logging
+from typing import Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Relación media caracteres/token para texto en español e inglés
+CHARS_PER_TOKEN = 4
+# Tokens adicionales que el formato de chat agrega por mensaje
+TOKENS_PER_MESSAGE = 4
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Carga una sola vez el tokenizador de tiktoken (si está disponible)"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.info(f"tiktoken no disponible, usando estimación de tokens: {e}")
+            _encoding = None
+    return _encoding
+
+
+def warm_up() -> None:
+    """
+    Carga el tokenizador por adelantado
+    
+    La primera carga lee (o descarga) el vocabulario de tiktoken; se hace en
+    el arranque para no bloquear el bucle de eventos durante un turno.
+    """
+    _get_encoding()
+
+
+def count_tokens(text: str) -> int:
+    """
+    Cuenta los tokens de un texto
+    
+    Args:
+        text: Texto a medir
+    
+    Returns:
+        Número de tokens (exacto con tiktoken, estimado si no está disponible)
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def count_message_tokens(messages: Iterable[Tuple[str, str]]) -> int:
+    """Cuenta los tokens de una lista de mensajes (rol, contenido)"""
+    return sum(count_tokens(content) + TOKENS_PER_MESSAGE for _, content in messages)
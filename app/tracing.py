@@ -0,0 +1,341 @@
+"""
+Trazas por etapa de cada turno, exportadas en formato OTLP/JSON (una línea por traza)
+"""
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from typing import IO, Any, Callable, Dict, List, Optional
+
+from app import fastjson
+from app.config import TracingConfig
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "teams-ai-foundry-bot"
+
+# Tipos de span y códigos de estado de OpenTelemetry
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        # OTLP/JSON codifica los enteros de 64 bits como texto
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Span:
+    """Etapa cronometrada de una traza"""
+    
+    __slots__ = ("trace", "name", "span_id", "parent_id", "kind", "start", "end_time",
+                 "attributes", "error", "_token")
+    
+    def __init__(
+        self,
+        trace: "Trace",
+        name: str,
+        parent_id: str,
+        kind: int,
+        attributes: Dict[str, Any],
+    ):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end_time: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self._token = None
+    
+    @property
+    def duration(self) -> float:
+        """Duración en segundos (hasta ahora si no ha terminado)"""
+        return ((self.end_time or time.time_ns()) - self.start) / 1e9
+    
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+    
+    def record_error(self, error: BaseException) -> None:
+        self.error = f"{type(error).__name__}: {error}"
+    
+    def end(self) -> None:
+        """Termina la etapa (las siguientes llamadas no tienen efecto)"""
+        if self.end_time is None:
+            self.end_time = time.time_ns()
+            self.trace.spans.append(self)
+    
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self)
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current.reset(self._token)
+        if exc is not None and isinstance(exc, Exception):
+            self.record_error(exc)
+        self.end()
+    
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end_time),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items()],
+            "status": (
+                {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK}
+            ),
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Span de los turnos no muestreados: no mide ni exporta nada"""
+    
+    __slots__ = ()
+    
+    duration = 0.0
+    
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+    
+    def record_error(self, error: BaseException) -> None:
+        pass
+    
+    def end(self) -> None:
+        pass
+    
+    def __enter__(self) -> "_NoopSpan":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """Spans de un turno; se exportan juntos al terminar la raíz"""
+    
+    __slots__ = ("trace_id", "sampled", "spans")
+    
+    def __init__(self, sampled: bool):
+        self.trace_id = os.urandom(16).hex()
+        self.sampled = sampled
+        self.spans: List[Span] = []
+
+
+class JsonLinesExporter:
+    """
+    Escribe cada traza como una solicitud OTLP/JSON en una línea
+    
+    Es el formato que lee el receptor `otlpjsonfile` del OpenTelemetry
+    Collector. La escritura ocurre en un hilo propio para no bloquear el
+    bucle de eventos.
+    """
+    
+    def __init__(
+        self, stream: IO[str], service_name: str = SERVICE_NAME, close_stream: bool = False
+    ):
+        self.stream = stream
+        self._close_stream = close_stream
+        self._resource = {"attributes": [_attribute("service.name", service_name)]}
+        self._queue: "queue.SimpleQueue[Optional[List[Span]]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self.exported = 0
+        self.errors = 0
+    
+    def export(self, spans: List[Span]) -> None:
+        """Encola los spans de una traza para escribirlos"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+        self._queue.put(spans)
+    
+    def _encode(self, spans: List[Span]) -> str:
+        return fastjson.dumps_str({
+            "resourceSpans": [{
+                "resource": self._resource,
+                "scopeSpans": [{
+                    "scope": {"name": "bot.tracing"},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }]
+        })
+    
+    def _run(self) -> None:
+        while True:
+            spans = self._queue.get()
+            if spans is None:
+                return
+            try:
+                self.stream.write(self._encode(spans) + "\n")
+                self.stream.flush()
+                self.exported += 1
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"No se pudo exportar la traza: {e}")
+    
+    def close(self) -> None:
+        """Escribe las trazas pendientes y cierra el destino"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._close_stream:
+            self.stream.close()
+
+
+class Tracer:
+    """
+    Trazas por etapa con muestreo
+    
+    `trace()` decide al inicio del turno si se muestrea (con probabilidad
+    `sample_rate`). Los turnos no muestreados usan un span vacío compartido
+    y sus etapas cuestan una lectura de contextvar. Con `slow_threshold` se
+    registran todos los turnos y se exportan además los que superan ese
+    tiempo, aunque no hayan salido en el muestreo.
+    """
+    
+    def __init__(
+        self,
+        exporter: Optional[JsonLinesExporter] = None,
+        sample_rate: float = 0.0,
+        slow_threshold: float = 0.0,
+        random_source: Callable[[], float] = random.random,
+    ):
+        """
+        Inicializa el trazador
+        
+        Args:
+            exporter: Destino de las trazas (None = trazas deshabilitadas)
+            sample_rate: Fracción de turnos que se exportan (0 a 1)
+            slow_threshold: Segundos a partir de los cuales un turno se exporta siempre (0 = no)
+            random_source: Generador uniforme en [0, 1) (inyectable para tests)
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self._random = random_source
+        self.stats = {"traces": 0, "sampled": 0, "slow": 0}
+    
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None and (self.sample_rate > 0 or self.slow_threshold > 0)
+    
+    def trace(self, name: str, **attributes: Any):
+        """
+        Inicia la traza de un turno (span raíz)
+        
+        Se usa como context manager; al salir se exporta si corresponde.
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        sampled = self.sample_rate >= 1 or self._random() < self.sample_rate
+        if not sampled and not self.slow_threshold:
+            return NOOP_SPAN
+        return _RootSpan(self, Trace(sampled), name, attributes)
+    
+    def span(self, name: str, **attributes: Any):
+        """Etapa dentro de la traza en curso (context manager; vacío si no hay traza)"""
+        parent = _current.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(parent.trace, name, parent.span_id, SPAN_KIND_INTERNAL, attributes)
+    
+    def start_span(self, name: str, **attributes: Any):
+        """
+        Etapa que se termina con `end()` y no pasa a ser la etapa en curso
+        
+        Para generadores asíncronos, que pueden reanudarse desde otra tarea.
+        """
+        return self.span(name, **attributes)
+    
+    def _finish(self, root: Span) -> None:
+        trace = root.trace
+        self.stats["traces"] += 1
+        slow = bool(self.slow_threshold) and root.duration >= self.slow_threshold
+        if not trace.sampled and not slow:
+            return
+        self.stats["sampled" if trace.sampled else "slow"] += 1
+        self.exporter.export(trace.spans)
+    
+    def get_statistics(self) -> Dict[str, Any]:
+        """Estadísticas del trazado"""
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "slow_threshold_ms": round(self.slow_threshold * 1000),
+            **self.stats,
+            "exported": self.exporter.exported if self.exporter is not None else 0,
+        }
+    
+    def close(self) -> None:
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+class _RootSpan(Span):
+    """Span raíz: al terminar entrega la traza al trazador"""
+    
+    __slots__ = ("tracer",)
+    
+    def __init__(self, tracer: Tracer, trace: Trace, name: str, attributes: Dict[str, Any]):
+        super().__init__(trace, name, "", SPAN_KIND_SERVER, attributes)
+        self.tracer = tracer
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        super().__exit__(exc_type, exc, tb)
+        self.tracer._finish(self)
+
+
+def create_tracer() -> Tracer:
+    """Crea el trazador según la configuración"""
+    exporter = None
+    if TracingConfig.SAMPLE_RATE > 0 or TracingConfig.SLOW_THRESHOLD > 0:
+        if TracingConfig.EXPORTER == "file":
+            exporter = JsonLinesExporter(
+                open(TracingConfig.FILE, "a", encoding="utf-8"), close_stream=True
+            )
+        else:
+            exporter = JsonLinesExporter(sys.stdout)
+        logger.info(
+            f"Trazas por etapa: muestreo {TracingConfig.SAMPLE_RATE:.0%}, "
+            f"turnos lentos desde {TracingConfig.SLOW_THRESHOLD * 1000:.0f}ms, "
+            f"destino {TracingConfig.FILE if TracingConfig.EXPORTER == 'file' else 'stdout'}"
+        )
+    return Tracer(exporter, TracingConfig.SAMPLE_RATE, TracingConfig.SLOW_THRESHOLD)
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Retorna el trazador del proceso"""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = create_tracer()
+    return _tracer
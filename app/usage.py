@@ -0,0 +1,215 @@
+"""
+Contabilidad de uso de tokens por conversación, usuario, deployment y ventana de tiempo
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Iterable, Optional, Tuple
+
+from app.config import UsageConfig
+
+
+def read_usage(message: Any) -> Optional[Tuple[int, int]]:
+    """
+    Tokens (prompt, completion) que informa la respuesta del modelo
+    
+    Usa `usage_metadata` de LangChain y, si falta, el `token_usage` del
+    proveedor. Retorna None si la respuesta no trae uso (p. ej. streaming).
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage")
+    if token_usage:
+        return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+    return None
+
+
+class UsageCounter:
+    """Llamadas y tokens acumulados"""
+    
+    __slots__ = ("calls", "prompt_tokens", "completion_tokens", "estimated_calls")
+    
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Llamadas cuyo uso se estimó localmente porque el servicio no lo informó
+        self.estimated_calls = 0
+    
+    def add(self, prompt_tokens: int, completion_tokens: int, estimated: bool = False) -> None:
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        if estimated:
+            self.estimated_calls += 1
+    
+    def merge(self, other: "UsageCounter") -> None:
+        self.calls += other.calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.estimated_calls += other.estimated_calls
+    
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+    
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "estimated_calls": self.estimated_calls,
+        }
+
+
+class UsageTracker:
+    """
+    Agregados de uso de tokens del proceso
+    
+    Cada llamada al modelo suma a cuatro contadores compactos (de su
+    conversación, usuario, deployment y ventana de tiempo) a partir del uso
+    que informa la respuesta: no hay callbacks por token ni bloqueos, ya que
+    se actualiza desde el bucle de eventos. Conversaciones y usuarios se
+    limitan a los `max_keys` con actividad más reciente.
+    """
+    
+    def __init__(
+        self,
+        window: Optional[float] = None,
+        windows: Optional[int] = None,
+        max_keys: Optional[int] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Inicializa los contadores
+        
+        Args:
+            window: Duración de cada ventana de tiempo en segundos
+            windows: Número de ventanas que se conservan
+            max_keys: Máximo de conversaciones (y de usuarios) con contador propio
+        """
+        self.window = window or UsageConfig.WINDOW
+        self.max_keys = max_keys or UsageConfig.MAX_KEYS
+        self._clock = clock
+        self.total = UsageCounter()
+        self.conversations: "OrderedDict[str, UsageCounter]" = OrderedDict()
+        self.users: "OrderedDict[str, UsageCounter]" = OrderedDict()
+        self.deployments: Dict[str, UsageCounter] = {}
+        # (inicio de la ventana, contador), de la más antigua a la actual
+        self.windows: Deque[Tuple[float, UsageCounter]] = deque(
+            maxlen=windows or UsageConfig.WINDOWS
+        )
+    
+    def _keyed(self, table: "OrderedDict[str, UsageCounter]", key: str) -> UsageCounter:
+        counter = table.get(key)
+        if counter is None:
+            counter = table[key] = UsageCounter()
+            if len(table) > self.max_keys:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(key)
+        return counter
+    
+    def _current_window(self) -> UsageCounter:
+        now = self._clock()
+        start = now - now % self.window
+        if not self.windows or self.windows[-1][0] != start:
+            self.windows.append((start, UsageCounter()))
+        return self.windows[-1][1]
+    
+    def record(
+        self,
+        conversation_id: str,
+        user_id: Optional[str],
+        deployment: Optional[str],
+        prompt_tokens: int,
+        completion_tokens: int,
+        estimated: bool = False,
+    ) -> None:
+        """
+        Registra una llamada al modelo
+        
+        Args:
+            conversation_id: Conversación que hizo la llamada
+            user_id: Usuario que envió el mensaje (None si no se conoce)
+            deployment: Deployment que respondió (None si no se conoce)
+            prompt_tokens: Tokens de entrada
+            completion_tokens: Tokens generados
+            estimated: El uso se estimó localmente
+        """
+        counters = [
+            self.total,
+            self._keyed(self.conversations, conversation_id),
+            self._current_window(),
+        ]
+        if user_id:
+            counters.append(self._keyed(self.users, user_id))
+        if deployment:
+            counter = self.deployments.get(deployment)
+            if counter is None:
+                counter = self.deployments[deployment] = UsageCounter()
+            counters.append(counter)
+        for counter in counters:
+            counter.add(prompt_tokens, completion_tokens, estimated)
+    
+    @staticmethod
+    def _lookup(table: Dict[str, UsageCounter], key: Optional[str]) -> Dict[str, int]:
+        counter = table.get(key) if key else None
+        return (counter or UsageCounter()).to_dict()
+    
+    def get_conversation(self, conversation_id: str) -> Dict[str, int]:
+        """Uso acumulado de una conversación"""
+        return self._lookup(self.conversations, conversation_id)
+    
+    def get_user(self, user_id: Optional[str]) -> Dict[str, int]:
+        """Uso acumulado de un usuario"""
+        return self._lookup(self.users, user_id)
+    
+    def get_recent(self, seconds: float) -> Dict[str, int]:
+        """Uso de las ventanas que empezaron en los últimos `seconds` segundos"""
+        since = self._clock() - seconds
+        recent = UsageCounter()
+        for start, counter in reversed(self.windows):
+            if start < since:
+                break
+            recent.merge(counter)
+        return recent.to_dict()
+    
+    @staticmethod
+    def _top(table: Dict[str, UsageCounter], limit: int) -> Iterable[Tuple[str, UsageCounter]]:
+        return sorted(table.items(), key=lambda item: item[1].total_tokens, reverse=True)[:limit]
+    
+    def get_statistics(self, top: int = 10) -> Dict[str, Any]:
+        """
+        Resumen del uso del proceso
+        
+        Args:
+            top: Número de usuarios y conversaciones con más tokens a incluir
+        """
+        span = self.window * (self.windows.maxlen or 1)
+        return {
+            "total": self.total.to_dict(),
+            "last_window": self.get_recent(self.window),
+            "last_span": self.get_recent(span),
+            "window_seconds": self.window,
+            "span_seconds": span,
+            "deployments": {name: counter.to_dict() for name, counter in self.deployments.items()},
+            "top_users": {key: counter.to_dict() for key, counter in self._top(self.users, top)},
+            "top_conversations": {
+                key: counter.to_dict() for key, counter in self._top(self.conversations, top)
+            },
+            "tracked_users": len(self.users),
+            "tracked_conversations": len(self.conversations),
+        }
+
+
+_tracker: Optional[UsageTracker] = None
+
+
+def get_usage_tracker() -> UsageTracker:
+    """Retorna los contadores de uso del proceso"""
+    global _tracker
+    if _tracker is None:
+        _tracker = UsageTracker()
+    return _tracker
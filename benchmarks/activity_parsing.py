@@ -0,0 +1,121 @@
+"""
+Benchmark del camino de /api/messages: decodificación JSON y construcción de la Activity
+
+Compara el camino original (json + Activity().deserialize de msrest) con el
+rápido (fastjson + parse_activity) sobre actividades típicas de Teams y
+reporta el tiempo de CPU por solicitud.
+
+Uso:
+    python -m benchmarks.activity_parsing [--iterations 5000]
+"""
+import argparse
+import json
+import time
+from typing import Callable, Dict, List
+
+from botbuilder.schema import Activity
+
+from app import fastjson
+from bot.activity import parse_activity
+
+_BASE = {
+    "channelId": "msteams",
+    "serviceUrl": "https://smba.trafficmanager.net/amer/",
+    "from": {"id": "29:1a2b3c", "name": "Ana Pérez", "aadObjectId": "6f1c2d3e-0000-1111-2222-333344445555"},
+    "recipient": {"id": "28:bot-app-id", "name": "Asistente"},
+    "channelData": {"tenant": {"id": "72f988bf-0000-1111-2222-2d7cd011db47"}},
+    "locale": "es-ES",
+    "localTimezone": "America/Buenos_Aires",
+}
+
+PAYLOADS: Dict[str, dict] = {
+    "personal_message": {
+        **_BASE,
+        "type": "message",
+        "id": "1731240000123",
+        "timestamp": "2024-11-10T12:00:00.1234567Z",
+        "localTimestamp": "2024-11-10T09:00:00.1234567-03:00",
+        "text": "¿Cuál es la política de vacaciones para el próximo trimestre?",
+        "textFormat": "plain",
+        "conversation": {"conversationType": "personal", "tenantId": "72f988bf", "id": "a:1xyzPersonal"},
+        "entities": [{"type": "clientInfo", "locale": "es-ES", "country": "AR", "platform": "Web", "timezone": "America/Buenos_Aires"}],
+    },
+    "channel_mention": {
+        **_BASE,
+        "type": "message",
+        "id": "1731240000456",
+        "timestamp": "2024-11-10T12:01:00.7654321Z",
+        "text": "<at>Asistente</at> resume el hilo, por favor",
+        "textFormat": "plain",
+        "attachments": [{"contentType": "text/html", "content": "<div><at>Asistente</at> resume el hilo, por favor</div>"}],
+        "conversation": {"isGroup": True, "conversationType": "channel", "tenantId": "72f988bf", "id": "19:abc@thread.tacv2;messageid=1731240000000"},
+        "entities": [
+            {"type": "mention", "text": "<at>Asistente</at>", "mentioned": {"id": "28:bot-app-id", "name": "Asistente"}},
+            {"type": "clientInfo", "locale": "es-ES", "country": "AR", "platform": "Windows"},
+        ],
+    },
+    "conversation_update": {
+        **_BASE,
+        "type": "conversationUpdate",
+        "id": "f:1731240000789",
+        "timestamp": "2024-11-10T12:02:00.000Z",
+        "conversation": {"conversationType": "personal", "tenantId": "72f988bf", "id": "a:1xyzPersonal"},
+        "membersAdded": [{"id": "29:1a2b3c", "aadObjectId": "6f1c2d3e"}, {"id": "28:bot-app-id"}],
+    },
+}
+
+
+def baseline(raw: bytes) -> Activity:
+    """Camino original del handler"""
+    return Activity().deserialize(json.loads(raw))
+
+
+def fast(raw: bytes) -> Activity:
+    """Camino rápido del handler"""
+    return parse_activity(fastjson.loads(raw))
+
+
+def measure(fn: Callable[[bytes], Activity], raw: bytes, iterations: int) -> float:
+    """Microsegundos de CPU por llamada"""
+    for _ in range(min(iterations, 200)):
+        fn(raw)
+    started = time.process_time()
+    for _ in range(iterations):
+        fn(raw)
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def run(iterations: int) -> List[dict]:
+    """Ejecuta el benchmark sobre todas las actividades de ejemplo"""
+    results = []
+    for name, payload in PAYLOADS.items():
+        raw = json.dumps(payload).encode("utf-8")
+        assert fast(raw).serialize() == baseline(raw).serialize(), f"Resultado distinto en {name}"
+        before = measure(baseline, raw, iterations)
+        after = measure(fast, raw, iterations)
+        results.append({
+            "payload": name,
+            "baseline_us": round(before, 1),
+            "fast_us": round(after, 1),
+            "saved_us": round(before - after, 1),
+            "speedup": round(before / after, 1) if after else None,
+        })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    
+    print(f"JSON: {fastjson.BACKEND} | iteraciones: {args.iterations}")
+    print(f"{'actividad':<22}{'original (µs)':>15}{'rápido (µs)':>14}{'ahorro (µs)':>14}{'x':>7}")
+    for row in run(args.iterations):
+        print(
+            f"{row['payload']:<22}{row['baseline_us']:>15}{row['fast_us']:>14}"
+            f"{row['saved_us']:>14}{row['speedup']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+Prueba de carga del bot completo contra servicios de Azure simulados
+
+Levanta en el mismo proceso `bot.bot_app.APP` y un servidor que imita Azure
+OpenAI, Content Safety y el Bot Connector (benchmarks.mock_azure), y reproduce
+actividades sintéticas de Teams en muchas conversaciones. Reporta turnos por
+segundo, latencia p50/p95/p99 de /api/messages (que responde al terminar el
+turno) y memoria residente del proceso.
+
+Uso:
+    python -m benchmarks.load_test [--conversations 200] [--messages 5] [--concurrency 50]
+        [--latency-ms 300] [--error-rate 0.05] [--streaming] [--json reporte.json]
+        [--max-p95-ms 2000]
+
+La configuración del bot se lee del entorno como en producción (MEMORY_MODE,
+ENABLE_RESPONSE_CACHE, LLM_MAX_CONCURRENCY...); los endpoints y credenciales
+se reemplazan por los del servidor simulado.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from app import fastjson
+from benchmarks.mock_azure import MockAzure
+
+MESSAGES = (
+    "¿Cuál es la política de vacaciones para el próximo trimestre?",
+    "Resume en tres puntos el último informe de ventas",
+    "¿Cómo solicito acceso a la VPN corporativa?",
+    "Redacta un correo para reprogramar la reunión del jueves",
+    "¿Qué diferencia hay entre un gasto operativo y uno de capital?",
+    "Dame ideas para la agenda del kick-off del equipo",
+    "¿Quién aprueba las compras de más de mil dólares?",
+    "Explica el proceso de onboarding de un nuevo proveedor",
+)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Percentil por el método del rango más cercano (values ordenados)"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def rss_mb() -> Dict[str, float]:
+    """Memoria residente actual y máxima del proceso en MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    current_mb = peak_mb
+    try:
+        with open("/proc/self/statm") as statm:
+            current_mb = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        pass
+    return {"current": round(current_mb, 1), "peak": round(max(peak_mb, current_mb), 1)}
+
+
+def configure_environment(mock_url: str, streaming: bool) -> None:
+    """Apunta la configuración del bot al servidor simulado (antes de importarlo)"""
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": mock_url,
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "AZURE_OPENAI_BACKENDS": "",
+        "CONTENT_SAFETY_ENDPOINT": mock_url,
+        "CONTENT_SAFETY_KEY": "benchmark",
+        "SESSION_STORE_BACKEND": "",
+        "BOT_WORKERS": "1",
+        # Requeridas por la validación; la autenticación se desactiva en run()
+        "MICROSOFT_APP_ID": "benchmark",
+        "MICROSOFT_APP_PASSWORD": "benchmark",
+        "ENABLE_STREAMING": "true" if streaming else "false",
+    })
+    for name, value in {
+        "AZURE_SUBSCRIPTION_ID": "benchmark",
+        "AZURE_RESOURCE_GROUP": "benchmark",
+        "AZURE_AI_PROJECT_NAME": "benchmark",
+        "AZURE_OPENAI_DEPLOYMENT_NAME": "gpt-4o-mini",
+        "ENABLE_CONTENT_SAFETY": "true",
+    }.items():
+        os.environ.setdefault(name, value)
+
+
+def make_activity(service_url: str, conversation: int, text: str) -> Dict[str, Any]:
+    """Actividad de mensaje personal de Teams"""
+    user_id = f"29:benchmark-user-{conversation}"
+    return {
+        "type": "message",
+        "id": uuid.uuid4().hex,
+        "timestamp": "2024-11-10T12:00:00.000Z",
+        "channelId": "msteams",
+        "serviceUrl": service_url,
+        "from": {"id": user_id, "name": f"Usuario {conversation}", "aadObjectId": f"aad-{conversation}"},
+        "recipient": {"id": "28:benchmark-bot", "name": "Asistente"},
+        "conversation": {
+            "conversationType": "personal",
+            "tenantId": "benchmark-tenant",
+            "id": f"a:benchmark-{conversation}",
+        },
+        "channelData": {"tenant": {"id": "benchmark-tenant"}},
+        "text": text,
+        "textFormat": "plain",
+        "locale": "es-ES",
+    }
+
+
+class LoadGenerator:
+    """
+    Conversaciones concurrentes que envían mensajes de a uno
+    
+    Cada conversación espera la respuesta de su mensaje (más `think_time`)
+    antes de enviar el siguiente, como un usuario real; `concurrency` limita
+    las conversaciones activas a la vez.
+    """
+    
+    def __init__(
+        self,
+        bot_url: str,
+        service_url: str,
+        conversations: int,
+        messages: int,
+        concurrency: int,
+        think_time: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.bot_url = bot_url
+        self.service_url = service_url
+        self.conversations = conversations
+        self.messages = messages
+        self.concurrency = concurrency
+        self.think_time = think_time
+        self._random = random.Random(seed)
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+    
+    async def _conversation(self, session: aiohttp.ClientSession, index: int, slots: asyncio.Semaphore) -> None:
+        async with slots:
+            for sequence in range(self.messages):
+                body = fastjson.dumps(make_activity(
+                    self.service_url, index, self._random.choice(MESSAGES)
+                ))
+                started = time.perf_counter()
+                try:
+                    async with session.post(
+                        self.bot_url, data=body, headers={"Content-Type": "application/json"}
+                    ) as response:
+                        await response.read()
+                        status = str(response.status)
+                except aiohttp.ClientError as e:
+                    status = type(e).__name__
+                self.latencies.append(time.perf_counter() - started)
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+                if self.think_time:
+                    await asyncio.sleep(self.think_time)
+    
+    async def run(self) -> float:
+        """Envía todos los mensajes y retorna la duración en segundos"""
+        slots = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=None)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                self._conversation(session, index, slots) for index in range(self.conversations)
+            ))
+            return time.perf_counter() - started
+    
+    def summary(self, duration: float, failed_replies: int = 0) -> Dict[str, Any]:
+        """
+        Resumen de la corrida
+        
+        Args:
+            duration: Segundos que tardó la corrida
+            failed_replies: Turnos que respondieron 2xx pero con un mensaje de error del bot
+        """
+        latencies = sorted(self.latencies)
+        ok = sum(count for status, count in self.statuses.items() if status.startswith("2"))
+        ok -= failed_replies
+        return {
+            "turns": len(latencies),
+            "duration_s": round(duration, 2),
+            "throughput_rps": round(len(latencies) / duration, 1) if duration else 0.0,
+            "error_rate": round(1 - ok / len(latencies), 4) if latencies else 0.0,
+            "statuses": dict(sorted(self.statuses.items())),
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 1),
+                "p95": round(percentile(latencies, 0.95) * 1000, 1),
+                "p99": round(percentile(latencies, 0.99) * 1000, 1),
+                "max": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+                "mean": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+            },
+        }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Levanta el servidor simulado y el bot, ejecuta la carga y arma el reporte"""
+    mock = MockAzure(
+        latency=args.latency_ms / 1000,
+        token_latency=args.token_latency_ms / 1000,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        safety_latency=args.safety_latency_ms / 1000,
+        safety_error_rate=args.safety_error_rate,
+        seed=args.seed,
+    )
+    mock_url = await mock.start()
+    configure_environment(mock_url, args.streaming)
+    
+    from app.config import BotConfig
+    import bot.bot_app as bot_app
+    
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    # Sin APP_ID el adaptador acepta actividades sin token y no pide tokens al responder
+    BotConfig.APP_ID = BotConfig.APP_PASSWORD = ""
+    
+    rss_before_start = rss_mb()
+    runner = web.AppRunner(bot_app.APP, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    bot_port = site._server.sockets[0].getsockname()[1]
+    await bot_app.APP["bot_loader"]
+    if bot_app.BOT is None:
+        raise RuntimeError(f"El bot no pudo construirse: {bot_app.STARTUP.error}")
+    
+    from app.chat_engine import ERROR_RESPONSE
+    
+    mock.failure_texts.add(ERROR_RESPONSE)
+    
+    bot_url = f"http://127.0.0.1:{bot_port}/api/messages"
+    generator = LoadGenerator(
+        bot_url,
+        mock_url,
+        conversations=args.warmup,
+        messages=1,
+        concurrency=args.concurrency,
+        seed=args.seed,
+    )
+    if args.warmup:
+        await generator.run()
+        mock.reset()
+    rss_before = rss_mb()
+    
+    generator = LoadGenerator(
+        bot_url,
+        mock_url,
+        conversations=args.conversations,
+        messages=args.messages,
+        concurrency=args.concurrency,
+        think_time=args.think_ms / 1000,
+        seed=args.seed,
+    )
+    duration = await generator.run()
+    rss_after = rss_mb()
+    
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{bot_port}/health") as response:
+            health = await response.json()
+    
+    await runner.cleanup()
+    await mock.close()
+    
+    expected_replies = args.conversations * args.messages
+    return {
+        "config": {
+            "conversations": args.conversations,
+            "messages": args.messages,
+            "concurrency": args.concurrency,
+            "streaming": args.streaming,
+            "latency_ms": args.latency_ms,
+            "token_latency_ms": args.token_latency_ms,
+            "completion_tokens": args.completion_tokens,
+            "error_rate": args.error_rate,
+            "safety_error_rate": args.safety_error_rate,
+        },
+        **generator.summary(duration, mock.stats["failed_replies"]),
+        "rss_mb": {
+            "startup": rss_before_start["current"],
+            "before": rss_before["current"],
+            "after": rss_after["current"],
+            "peak": rss_after["peak"],
+        },
+        "mock": {
+            **mock.stats,
+            "conversations_replied": len(mock.replies),
+            "missing_replies": max(0, expected_replies - sum(mock.replies.values())),
+        },
+        "bot": {
+            "active_sessions": health.get("active_sessions"),
+            "startup_s": (health.get("startup") or {}).get("ready_after_s"),
+        },
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    latency = report["latency_ms"]
+    rss = report["rss_mb"]
+    mock = report["mock"]
+    print(
+        f"Turnos: {report['turns']} en {report['duration_s']}s "
+        f"({report['throughput_rps']} turnos/s) | errores: {report['error_rate']:.2%} {report['statuses']}"
+    )
+    print(
+        f"Latencia (ms): p50 {latency['p50']} | p95 {latency['p95']} | p99 {latency['p99']} "
+        f"| máx {latency['max']} | media {latency['mean']}"
+    )
+    print(
+        f"RSS (MB): al arrancar {rss['startup']} | antes {rss['before']} | "
+        f"después {rss['after']} | máximo {rss['peak']}"
+    )
+    print(
+        f"Servicios simulados: {mock['chat_requests']} llamadas al modelo "
+        f"({mock['chat_throttled']} con 429, {mock['chat_streams']} en streaming), "
+        f"{mock['safety_requests']} análisis de Content Safety ({mock['safety_throttled']} con 429), "
+        f"{mock['activities_sent']} mensajes y {mock['activities_updated']} actualizaciones enviados, "
+        f"{mock['missing_replies']} turnos sin respuesta"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5, help="Mensajes por conversación")
+    parser.add_argument("--concurrency", type=int, default=50, help="Conversaciones activas a la vez")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pausa entre mensajes de una conversación")
+    parser.add_argument("--warmup", type=int, default=10, help="Turnos previos que no se miden")
+    parser.add_argument("--streaming", action="store_true", help="Respuestas en streaming (ENABLE_STREAMING)")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Tiempo hasta el primer token")
+    parser.add_argument("--token-latency-ms", type=float, default=10.0, help="Tiempo por token generado")
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de llamadas al modelo con 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After de los 429 (segundos)")
+    parser.add_argument("--safety-latency-ms", type=float, default=30.0)
+    parser.add_argument("--safety-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Guardar el reporte en este archivo")
+    parser.add_argument("--max-p95-ms", type=float, help="Falla (código 1) si el p95 supera este valor")
+    parser.add_argument("--max-error-rate", type=float, help="Falla (código 1) si la tasa de errores la supera")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar los logs del bot")
+    args = parser.parse_args()
+    
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            output.write(fastjson.dumps_str(report))
+    
+    failures = []
+    if args.max_p95_ms is not None and report["latency_ms"]["p95"] > args.max_p95_ms:
+        failures.append(f"p95 {report['latency_ms']['p95']}ms > {args.max_p95_ms}ms")
+    if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+        failures.append(f"errores {report['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    if failures:
+        print(f"❌ Regresión: {'; '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Servidor local que imita los servicios externos del bot para pruebas de carga
+
+Habla los formatos de red de:
+- Azure OpenAI chat completions (respuesta completa y streaming SSE)
+- Azure AI Content Safety (text:analyze)
+- Bot Connector de Bot Framework (envío y actualización de actividades)
+
+La latencia y la inyección de 429 son configurables, de modo que el bot se
+puede medir sin cuota de Azure ni red.
+"""
+import asyncio
+import random
+import time
+import uuid
+from typing import Any, Dict, Iterable, Optional
+
+from aiohttp import web
+
+from app import fastjson
+
+CHAT_PATH = "/openai/deployments/{deployment}/chat/completions"
+CONTENT_SAFETY_PATH = "/contentsafety/text:analyze"
+CONNECTOR_PATH = "/v3/conversations/{conversation_id}/activities"
+
+CATEGORIES = ("Hate", "SelfHarm", "Sexual", "Violence")
+
+_WORDS = (
+    "según la política vigente los empleados pueden solicitar sus días con "
+    "anticipación a través del portal y su responsable aprueba la solicitud "
+    "antes de que comience el periodo indicado en el calendario del equipo"
+).split()
+
+
+def _json(data: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> web.Response:
+    return web.Response(
+        body=fastjson.dumps(data), status=status, headers=headers, content_type="application/json"
+    )
+
+
+class MockAzure:
+    """
+    Servicios de Azure y Bot Connector simulados en un único servidor aiohttp
+    
+    Cada llamada al modelo espera `latency` segundos antes del primer token
+    y `token_latency` por token generado; con probabilidad `error_rate`
+    responde 429 con Retry-After, como un deployment sin cuota.
+    """
+    
+    def __init__(
+        self,
+        latency: float = 0.3,
+        token_latency: float = 0.01,
+        completion_tokens: int = 60,
+        error_rate: float = 0.0,
+        retry_after: float = 1.0,
+        safety_latency: float = 0.03,
+        safety_error_rate: float = 0.0,
+        connector_latency: float = 0.01,
+        jitter: float = 0.2,
+        failure_texts: Iterable[str] = (),
+        seed: Optional[int] = None,
+    ):
+        """
+        Inicializa el servidor simulado
+        
+        Args:
+            latency: Segundos hasta el primer token de cada respuesta del modelo
+            token_latency: Segundos por token generado
+            completion_tokens: Tokens de cada respuesta del modelo
+            error_rate: Fracción de llamadas al modelo que responden 429
+            retry_after: Valor de Retry-After (segundos) de los 429
+            safety_latency: Segundos por análisis de Content Safety
+            safety_error_rate: Fracción de análisis de Content Safety que responden 429
+            connector_latency: Segundos por actividad enviada al Bot Connector
+            jitter: Variación relativa aleatoria de todas las latencias (0.2 = ±20%)
+            failure_texts: Respuestas del bot que indican un turno fallido (mensajes de error)
+            seed: Semilla del generador aleatorio (para corridas reproducibles)
+        """
+        self.latency = latency
+        self.token_latency = token_latency
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.safety_latency = safety_latency
+        self.safety_error_rate = safety_error_rate
+        self.connector_latency = connector_latency
+        self.jitter = jitter
+        self.failure_texts = set(failure_texts)
+        self._random = random.Random(seed)
+        self.stats: Dict[str, int] = {}
+        # Mensajes visibles recibidos por conversación (sin indicadores de escritura)
+        self.replies: Dict[str, int] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+        self.reset()
+    
+    def reset(self) -> None:
+        """Pone los contadores en cero (p. ej. después del calentamiento)"""
+        self.stats = dict.fromkeys((
+            "chat_requests", "chat_streams", "chat_throttled",
+            "safety_requests", "safety_throttled",
+            "activities_sent", "failed_replies", "activities_updated", "typing_sent",
+        ), 0)
+        self.replies = {}
+    
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(CHAT_PATH, self.chat_completions)
+        app.router.add_post(CONTENT_SAFETY_PATH, self.analyze_text)
+        app.router.add_post(CONNECTOR_PATH, self.send_activity)
+        app.router.add_post(CONNECTOR_PATH + "/{activity_id}", self.send_activity)
+        app.router.add_put(CONNECTOR_PATH + "/{activity_id}", self.update_activity)
+        return app
+    
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Empieza a atender (puerto 0 = uno libre) y retorna la URL base (sin / final)"""
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}"
+    
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    async def _sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            await asyncio.sleep(seconds * (1 + self._random.uniform(-self.jitter, self.jitter)))
+    
+    def _throttled(self, rate: float) -> Optional[web.Response]:
+        if not rate or self._random.random() >= rate:
+            return None
+        return _json(
+            {"error": {"code": "429", "message": "Requests to the service have exceeded the rate limit."}},
+            status=429,
+            headers={
+                "retry-after": str(max(1, round(self.retry_after))),
+                "retry-after-ms": str(int(self.retry_after * 1000)),
+            },
+        )
+    
+    # Azure OpenAI
+    
+    def _completion_text(self, count: int) -> list:
+        start = self._random.randrange(len(_WORDS))
+        return [_WORDS[(start + i) % len(_WORDS)] for i in range(count)]
+    
+    @staticmethod
+    def _prompt_tokens(body: Dict[str, Any]) -> int:
+        # Aproximación: ~4 caracteres por token más el formato de cada mensaje
+        return sum(4 + len(str(message.get("content", ""))) // 4 for message in body.get("messages", []))
+    
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.stats["chat_requests"] += 1
+        throttled = self._throttled(self.error_rate)
+        if throttled is not None:
+            self.stats["chat_throttled"] += 1
+            return throttled
+        
+        body = await request.json()
+        deployment = request.match_info["deployment"]
+        prompt_tokens = self._prompt_tokens(body)
+        words = self._completion_text(min(self.completion_tokens, body.get("max_tokens") or self.completion_tokens))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+        }
+        headers = {
+            "x-ratelimit-remaining-requests": "1000",
+            "x-ratelimit-remaining-tokens": "1000000",
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        
+        if not body.get("stream"):
+            await self._sleep(self.latency + self.token_latency * len(words))
+            return _json({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": deployment,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }, headers=headers)
+        
+        self.stats["chat_streams"] += 1
+        response = web.StreamResponse(headers={**headers, "Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        
+        async def event(delta: Optional[Dict[str, Any]], finish_reason: Optional[str] = None, **extra: Any) -> None:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": deployment,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                **extra,
+            }
+            await response.write(b"data: " + fastjson.dumps(chunk) + b"\n\n")
+        
+        await self._sleep(self.latency)
+        await event({"role": "assistant", "content": ""})
+        for index, word in enumerate(words):
+            if index:
+                await self._sleep(self.token_latency)
+            await event({"content": word if not index else " " + word})
+        await event({}, "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await event(None, usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+    
+    # Content Safety
+    
+    async def analyze_text(self, request: web.Request) -> web.Response:
+        self.stats["safety_requests"] += 1
+        throttled = self._throttled(self.safety_error_rate)
+        if throttled is not None:
+            self.stats["safety_throttled"] += 1
+            return throttled
+        await request.read()
+        await self._sleep(self.safety_latency)
+        return _json({
+            "blocklistsMatch": [],
+            "categoriesAnalysis": [{"category": category, "severity": 0} for category in CATEGORIES],
+        })
+    
+    # Bot Connector
+    
+    async def send_activity(self, request: web.Request) -> web.Response:
+        activity = await request.json()
+        await self._sleep(self.connector_latency)
+        if activity.get("type") == "typing":
+            self.stats["typing_sent"] += 1
+        else:
+            self.stats["activities_sent"] += 1
+            if activity.get("text") in self.failure_texts:
+                self.stats["failed_replies"] += 1
+            conversation_id = request.match_info["conversation_id"]
+            self.replies[conversation_id] = self.replies.get(conversation_id, 0) + 1
+        return _json({"id": uuid.uuid4().hex})
+    
+    async def update_activity(self, request: web.Request) -> web.Response:
+        await request.read()
+        await self._sleep(self.connector_latency)
+        self.stats["activities_updated"] += 1
+        return _json({"id": request.match_info["activity_id"]})
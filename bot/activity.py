@@ -0,0 +1,107 @@
+"""
+Lectura rápida de actividades del Bot Framework
+"""
+import re
+from datetime import datetime
+from typing import Any, Dict, Tuple, Type
+
+from botbuilder.schema import Activity, Attachment, ChannelAccount, ConversationAccount, Entity
+from msrest.serialization import Model
+
+# Tipos del esquema que se copian tal cual
+_PASSTHROUGH_TYPES = {"object", "{object}"}
+_PRIMITIVE_TYPES = {"str": str, "bool": bool}
+
+# Modelos que el lector rápido sabe construir; cualquier otro usa el deserializador de msrest
+_MODELS: Dict[str, Type[Model]] = {
+    "ChannelAccount": ChannelAccount,
+    "ConversationAccount": ConversationAccount,
+    "Attachment": Attachment,
+    "Entity": Entity,
+}
+
+# Fracción de segundos con más de 6 dígitos (Teams envía 7)
+_EXTRA_FRACTION = re.compile(r"(\.\d{6})\d+")
+
+
+class _Unsupported(Exception):
+    """El lector rápido no cubre un campo de la actividad"""
+
+
+def _fields(model: Type[Model]) -> Dict[str, Tuple[str, str]]:
+    """Clave JSON -> (atributo, tipo) a partir del esquema del modelo"""
+    return {spec["key"]: (attr, spec["type"]) for attr, spec in model._attribute_map.items()}
+
+
+_FIELDS: Dict[Type[Model], Dict[str, Tuple[str, str]]] = {
+    model: _fields(model) for model in (Activity, *_MODELS.values())
+}
+
+
+def _parse_datetime(value: Any) -> datetime:
+    if not isinstance(value, str):
+        raise _Unsupported
+    text = _EXTRA_FRACTION.sub(r"\1", value)
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        raise _Unsupported from None
+
+
+def _convert(kind: str, value: Any) -> Any:
+    if kind in _PASSTHROUGH_TYPES:
+        return value
+    primitive = _PRIMITIVE_TYPES.get(kind)
+    if primitive is not None:
+        if not isinstance(value, primitive):
+            raise _Unsupported
+        return value
+    if kind == "iso-8601":
+        return _parse_datetime(value)
+    model = _MODELS.get(kind)
+    if model is not None:
+        return _build(model, value)
+    if kind.startswith("[") and isinstance(value, list):
+        item_kind = kind[1:-1]
+        return [_convert(item_kind, item) for item in value]
+    raise _Unsupported
+
+
+def _build(model: Type[Model], data: Any) -> Model:
+    if not isinstance(data, dict):
+        raise _Unsupported
+    fields = _FIELDS[model]
+    obj = model()
+    for key, value in data.items():
+        field = fields.get(key)
+        if field is None:
+            # Igual que msrest: las claves desconocidas se conservan aparte
+            obj.additional_properties[key] = value
+        elif value is not None:
+            attr, kind = field
+            setattr(obj, attr, _convert(kind, value))
+    return obj
+
+
+def parse_activity(body: Dict[str, Any]) -> Activity:
+    """
+    Construye la Activity de una solicitud ya decodificada
+    
+    Equivale a `Activity().deserialize(body)`, pero asigna los campos
+    directamente a partir del esquema en lugar de recorrerlo con el
+    deserializador reflexivo de msrest. Cubre los campos de los mensajes y
+    actualizaciones de conversación de Teams; si la actividad trae un campo
+    de otro tipo (acciones sugeridas, reacciones, etc.) se usa msrest.
+    
+    Args:
+        body: Actividad decodificada del JSON de la solicitud
+    
+    Returns:
+        Activity equivalente a la del deserializador de msrest
+    """
+    try:
+        return _build(Activity, body)
+    except _Unsupported:
+        return Activity().deserialize(body)
@@ -2,24 +2,37 @@
 Aplicación principal del bot con Azure AI Foundry
 """
 import sys
+import asyncio
 import logging
+import threading
 from aiohttp import web
 from aiohttp.web import Request, Response
-from botbuilder.core import (
-    BotFrameworkAdapterSettings,
-    BotFrameworkAdapter,
-    TurnContext,
+
+# Primero: app.startup toma la hora de inicio del proceso al importarse
+from app.startup import HEAVY_MODULES, StartupReport
+from app import fastjson
+from app.config import BotConfig, AzureAIFoundryConfig, SessionConfig
+from app.credentials import get_token_provider
+from app.logging_setup import get_statistics as get_logging_statistics, setup_logging
+from app.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY
+from app.tracing import get_tracer
+from app.usage import get_usage_tracker
+from bot.workers import (
+    FORWARDED_HEADER,
+    ConversationAffinity,
+    WorkerInfo,
+    create_reuseport_socket,
+    resolve_worker_count,
+    run_supervisor,
+    worker_socket_dir,
+    worker_socket_path,
 )
-from botbuilder.schema import Activity
 
-from app.config import BotConfig, AzureAIFoundryConfig
-from bot.teams_bot import TeamsAIFoundryBot
+# Reloj de arranque (medido desde la importación de app.startup)
+STARTUP = StartupReport()
 
 # Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Validar configuraciones
@@ -31,16 +44,14 @@ except ValueError as e:
     logger.error(f"❌ Error de configuración: {e}")
     sys.exit(1)
 
-# Configurar Bot Framework Adapter
-SETTINGS = BotFrameworkAdapterSettings(
-    app_id=BotConfig.APP_ID,
-    app_password=BotConfig.APP_PASSWORD
-)
-ADAPTER = BotFrameworkAdapter(SETTINGS)
+# Adaptador de Bot Framework y bot: se construyen en segundo plano (ver load_bot)
+ADAPTER = None
+BOT = None
+_load_lock = threading.Lock()
 
 
 # Manejador de errores
-async def on_error(context: TurnContext, error: Exception):
+async def on_error(context, error: Exception):
     """Maneja errores del bot"""
     logger.error(f"Error en el bot: {error}", exc_info=True)
     
@@ -51,10 +62,126 @@ async def on_error(context: TurnContext, error: Exception):
     )
 
 
-ADAPTER.on_turn_error = on_error
+def load_bot() -> None:
+    """
+    Importa las dependencias pesadas y construye el adaptador y el bot
+    
+    Se ejecuta una sola vez: en un hilo en cuanto el servidor empieza a
+    atender, o directamente con create_app(eager=True).
+    """
+    global ADAPTER, BOT
+    with _load_lock:
+        if BOT is not None:
+            return
+        
+        modules = HEAVY_MODULES
+        if AzureAIFoundryConfig.ENABLE_CONTENT_SAFETY:
+            modules += ("azure.ai.contentsafety",)
+        STARTUP.import_modules(modules)
+        
+        with STARTUP.phase("import_bot"):
+            from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
+            from bot.cards import AdaptiveCards
+            from bot.teams_bot import TeamsAIFoundryBot
+            from app.tokens import warm_up as warm_up_tokenizer
+        
+        with STARTUP.phase("adapter"):
+            adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings(
+                app_id=BotConfig.APP_ID,
+                app_password=BotConfig.APP_PASSWORD
+            ))
+            adapter.on_turn_error = on_error
+        
+        with STARTUP.phase("bot"):
+            bot = TeamsAIFoundryBot()
+        
+        with STARTUP.phase("cards"):
+            AdaptiveCards.warm_up()
+        
+        with STARTUP.phase("tokenizer"):
+            warm_up_tokenizer()
+        
+        register_metrics(bot)
+        ADAPTER, BOT = adapter, bot
 
-# Crear instancia del bot
-BOT = TeamsAIFoundryBot()
+
+def register_metrics(bot) -> None:
+    """Publica en /metrics las estadísticas que ya mantienen los componentes del bot"""
+    from app.chat_engine import get_shared_resources
+    
+    shared = get_shared_resources()
+    sessions = bot.conversation_manager.sessions
+    safety_cache = bot.content_safety.cache
+    backends = shared.router.backends
+    
+    REGISTRY.collect(
+        "bot_active_sessions", "Conversaciones en memoria en este proceso",
+        bot.conversation_manager.get_active_count
+    )
+    REGISTRY.collect(
+        "bot_session_cache_requests_total", "Búsquedas de conversaciones en la caché local",
+        lambda: {("hit",): sessions.stats["hits"], ("miss",): sessions.stats["misses"]},
+        ("result",), kind="counter"
+    )
+    REGISTRY.collect(
+        "content_safety_cache_requests_total",
+        "Búsquedas en la caché de resultados de Content Safety",
+        lambda: {("hit",): safety_cache.hits, ("miss",): safety_cache.misses},
+        ("result",), kind="counter"
+    )
+    response_cache = shared.response_cache
+    if response_cache is not None:
+        REGISTRY.collect(
+            "response_cache_lookups_total", "Consultas a la caché de respuestas",
+            lambda: response_cache.lookups, kind="counter"
+        )
+        REGISTRY.collect(
+            "response_cache_hits_total", "Respuestas servidas desde la caché por nivel",
+            lambda: {
+                ("exact",): response_cache.exact_hits,
+                ("semantic",): response_cache.semantic_hits
+            },
+            ("tier",), kind="counter"
+        )
+    REGISTRY.collect(
+        "llm_in_flight", "Llamadas al modelo en curso por backend",
+        lambda: {(backend.name,): backend.in_flight for backend in backends}, ("backend",)
+    )
+    REGISTRY.collect(
+        "llm_queue_depth", "Solicitudes esperando admisión por backend",
+        lambda: {(backend.name,): backend.scheduler.queued for backend in backends}, ("backend",)
+    )
+
+
+def _token_samples():
+    samples = {}
+    for deployment, counter in get_usage_tracker().deployments.items():
+        samples[(deployment, "prompt")] = counter.prompt_tokens
+        samples[(deployment, "completion")] = counter.completion_tokens
+    return samples
+
+
+REGISTRY.collect(
+    "bot_ready", "1 cuando el bot terminó de construirse", lambda: int(BOT is not None)
+)
+REGISTRY.collect(
+    "llm_tokens_total", "Tokens consumidos por deployment y tipo",
+    _token_samples, ("deployment", "type"), kind="counter"
+)
+
+
+def json_response(data, status: int = 200) -> Response:
+    """Respuesta JSON codificada con el serializador rápido"""
+    return Response(body=fastjson.dumps(data), status=status, content_type="application/json")
+
+
+# Worker actual en modo multiproceso (None con un solo proceso)
+WORKER = WorkerInfo.from_env()
+AFFINITY = (
+    ConversationAffinity(WORKER, worker_socket_dir(BotConfig.PORT))
+    if WORKER is not None and WORKER.count > 1 and BotConfig.WORKER_AFFINITY
+    else None
+)
 
 
 # Endpoint de mensajes
@@ -69,18 +196,38 @@ async def messages(req: Request) -> Response:
         Response HTTP
     """
     if req.content_type == "application/json":
-        body = await req.json()
+        raw = await req.read()
+        try:
+            body = fastjson.loads(raw)
+        except ValueError:
+            logger.warning("Request con JSON inválido")
+            return Response(status=400)
     else:
         logger.warning("Request con content-type incorrecto")
         return Response(status=415)
     
-    activity = Activity().deserialize(body)
+    if AFFINITY is not None and FORWARDED_HEADER not in req.headers:
+        owner = AFFINITY.owner((body.get("conversation") or {}).get("id", ""))
+        if owner != WORKER.index:
+            response = await AFFINITY.forward(owner, raw, req.headers)
+            if response is not None:
+                return response
+    
+    if BOT is None:
+        # Primeros mensajes tras el arranque: esperar a que termine la carga
+        await asyncio.shield(req.app["bot_loader"])
+        if BOT is None:
+            return Response(status=503)
+    
+    from bot.activity import parse_activity
+    
+    activity = parse_activity(body)
     auth_header = req.headers.get("Authorization", "")
     
     try:
         response = await ADAPTER.process_activity(activity, auth_header, BOT.on_turn)
         if response:
-            return web.json_response(data=response.body, status=response.status)
+            return json_response(response.body, status=response.status)
         return Response(status=201)
     except Exception as e:
         logger.error(f"Error procesando actividad: {e}", exc_info=True)
@@ -90,19 +237,60 @@ async def messages(req: Request) -> Response:
 # Health check
 async def health(req: Request) -> Response:
     """Health check endpoint"""
-    return web.json_response({
+    if BOT is None:
+        # El servidor ya atiende; el bot se sigue construyendo en segundo plano
+        failed = STARTUP.error is not None
+        return json_response({
+            "status": "unhealthy" if failed else "starting",
+            "service": "teams-ai-foundry-bot",
+            "startup": STARTUP.get_report(),
+            "worker": WORKER.get_statistics() if WORKER is not None else None
+        }, status=503 if failed else 200)
+    
+    from app.chat_engine import get_shared_resources
+    
+    shared = get_shared_resources()
+    response_cache = shared.response_cache
+    return json_response({
         "status": "healthy",
         "service": "teams-ai-foundry-bot",
         "project": AzureAIFoundryConfig.PROJECT_NAME,
         "hub": AzureAIFoundryConfig.HUB_NAME,
-        "deployment": AzureAIFoundryConfig.OPENAI_DEPLOYMENT
+        "deployment": AzureAIFoundryConfig.OPENAI_DEPLOYMENT,
+        "sessions": BOT.conversation_manager.get_store_statistics(),
+        "content_safety": BOT.content_safety.get_statistics(),
+        "response_cache": (
+            response_cache.get_statistics() if response_cache is not None else None
+        ),
+        "llm_router": shared.router.get_statistics(),
+        "retrieval": shared.retriever.get_statistics() if shared.retriever is not None else None,
+        "credentials": get_token_provider().get_statistics(),
+        "tracing": get_tracer().get_statistics(),
+        "logging": get_logging_statistics(),
+        "startup": STARTUP.get_report(),
+        "worker": WORKER.get_statistics() if WORKER is not None else None
+    })
+
+
+# Uso de tokens
+async def usage(req: Request) -> Response:
+    """Uso de tokens del proceso por deployment, usuario, conversación y ventana de tiempo"""
+    return json_response({
+        **get_usage_tracker().get_statistics(),
+        "worker": WORKER.index if WORKER is not None else None
     })
 
 
+# Métricas
+async def metrics(req: Request) -> Response:
+    """Métricas del proceso en formato de Prometheus"""
+    return Response(text=REGISTRY.render(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
 # Info endpoint
 async def info(req: Request) -> Response:
     """Info endpoint"""
-    return web.json_response({
+    return json_response({
         "service": "Teams AI Foundry Bot",
         "version": "1.0.0",
         "platform": "Azure AI Foundry",
@@ -113,34 +301,135 @@ async def info(req: Request) -> Response:
     })
 
 
-# Crear aplicación web
-APP = web.Application()
-APP.router.add_post("/api/messages", messages)
-APP.router.add_get("/health", health)
-APP.router.add_get("/info", info)
-APP.router.add_get("/", health)
+async def evict_idle_sessions():
+    """Expira periódicamente las conversaciones inactivas"""
+    while True:
+        await asyncio.sleep(SessionConfig.SWEEP_INTERVAL)
+        if BOT is None:
+            continue
+        try:
+            BOT.conversation_manager.evict_idle()
+        except Exception as e:
+            logger.error(f"Error expirando conversaciones: {e}", exc_info=True)
 
 
-if __name__ == "__main__":
+async def warm_up():
+    """Construye el bot fuera del bucle de eventos"""
     try:
-        logger.info("="*70)
-        logger.info("🤖 Iniciando Teams AI Foundry Bot")
-        logger.info("="*70)
-        logger.info(f"Puerto: {BotConfig.PORT}")
-        logger.info(f"Host: {BotConfig.HOST}")
-        logger.info(f"Bot App ID: {BotConfig.APP_ID}")
-        logger.info(f"AI Foundry Project: {AzureAIFoundryConfig.PROJECT_NAME}")
-        logger.info(f"AI Foundry Hub: {AzureAIFoundryConfig.HUB_NAME}")
-        logger.info(f"Deployment: {AzureAIFoundryConfig.OPENAI_DEPLOYMENT}")
-        logger.info(f"Content Safety: {'✅' if AzureAIFoundryConfig.ENABLE_CONTENT_SAFETY else '❌'}")
-        logger.info(f"AI Search: {'✅' if AzureAIFoundryConfig.ENABLE_AI_SEARCH else '❌'}")
-        logger.info("="*70)
-        
+        await asyncio.to_thread(load_bot)
+    except Exception as e:
+        STARTUP.mark_failed(e)
+        logger.error(f"❌ Error construyendo el bot: {e}", exc_info=True)
+        return
+    STARTUP.mark_ready()
+    STARTUP.log_summary()
+    # Obtiene ya los tokens de Azure AD que usará el bot y los renueva antes de expirar
+    get_token_provider().start()
+
+
+async def on_startup(app: web.Application):
+    """Empieza a atender de inmediato y construye el bot en segundo plano"""
+    STARTUP.mark_serving()
+    app["bot_loader"] = asyncio.create_task(warm_up())
+    app["session_sweeper"] = asyncio.create_task(evict_idle_sessions())
+
+
+async def on_shutdown(app: web.Application):
+    """Detiene tareas de mantenimiento y libera los pools de conexiones compartidos"""
+    # El hilo de carga no se puede interrumpir: esperar para cerrar lo que construya
+    await asyncio.wait([app["bot_loader"]])
+    app["session_sweeper"].cancel()
+    if AFFINITY is not None:
+        await AFFINITY.close()
+    if BOT is None:
+        return
+    
+    from app.chat_engine import get_shared_resources
+    from app.llm_pool import get_llm_pool
+    
+    retriever = get_shared_resources().retriever
+    if retriever is not None:
+        await retriever.close()
+    await BOT.conversation_manager.close()
+    await BOT.content_safety.close()
+    await get_token_provider().close()
+    await get_llm_pool().aclose()
+    get_tracer().close()
+
+
+def create_app(eager: bool = False) -> web.Application:
+    """
+    Crea la aplicación web
+    
+    Args:
+        eager: Construir el bot antes de retornar (por defecto se construye
+            en segundo plano cuando el servidor ya atiende)
+    
+    Returns:
+        Aplicación de aiohttp
+    """
+    if eager:
+        load_bot()
+    app = web.Application()
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    app.router.add_post("/api/messages", messages)
+    app.router.add_get("/health", health)
+    app.router.add_get("/info", info)
+    app.router.add_get("/usage", usage)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/", health)
+    return app
+
+
+# Crear aplicación web
+APP = create_app()
+
+
+def serve():
+    """Atiende el puerto en este proceso (solo o como worker del supervisor)"""
+    if WORKER is None:
         web.run_app(
             APP,
             host=BotConfig.HOST,
-            port=BotConfig.PORT
+            port=BotConfig.PORT,
+            shutdown_timeout=BotConfig.SHUTDOWN_TIMEOUT
         )
+        return
+    
+    # Puerto público compartido con los demás workers + socket interno para la afinidad
+    logger.info(f"Worker {WORKER.index}/{WORKER.count} iniciado (pid {WORKER.pid})")
+    web.run_app(
+        APP,
+        sock=create_reuseport_socket(BotConfig.HOST, BotConfig.PORT),
+        path=worker_socket_path(worker_socket_dir(BotConfig.PORT), WORKER.index),
+        shutdown_timeout=BotConfig.SHUTDOWN_TIMEOUT,
+        print=None
+    )
+
+
+if __name__ == "__main__":
+    try:
+        if WORKER is None:
+            logger.info("="*70)
+            logger.info("🤖 Iniciando Teams AI Foundry Bot")
+            logger.info("="*70)
+            logger.info(f"Puerto: {BotConfig.PORT}")
+            logger.info(f"Host: {BotConfig.HOST}")
+            logger.info(f"Workers: {resolve_worker_count(BotConfig.WORKERS)}")
+            logger.info(f"Bot App ID: {BotConfig.APP_ID}")
+            logger.info(f"AI Foundry Project: {AzureAIFoundryConfig.PROJECT_NAME}")
+            logger.info(f"AI Foundry Hub: {AzureAIFoundryConfig.HUB_NAME}")
+            logger.info(f"Deployment: {AzureAIFoundryConfig.OPENAI_DEPLOYMENT}")
+            content_safety = AzureAIFoundryConfig.ENABLE_CONTENT_SAFETY
+            logger.info(f"Content Safety: {'✅' if content_safety else '❌'}")
+            logger.info(f"AI Search: {'✅' if AzureAIFoundryConfig.ENABLE_AI_SEARCH else '❌'}")
+            logger.info("="*70)
+            
+            if resolve_worker_count(BotConfig.WORKERS) > 1:
+                sys.exit(run_supervisor())
+        
+        serve()
     except Exception as e:
         logger.error(f"❌ Error al iniciar el bot: {e}")
         sys.exit(1)
@@ -1,17 +1,132 @@
 """
 Adaptive Cards para Teams (mejoradas para AI Foundry)
 """
+import logging
 from botbuilder.schema import Attachment
 from botbuilder.core import CardFactory
 from app.config import AzureAIFoundryConfig
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _format_cache_hit_rate(stats: Dict[str, Any]) -> str:
+    hit_rate = stats.get("response_cache_hit_rate")
+    return f"{hit_rate:.0%} de aciertos" if hit_rate is not None else "Deshabilitada"
+
+
+def _format_usage(usage: Optional[Dict[str, int]]) -> str:
+    if not usage:
+        return "N/A"
+    return f"{usage['prompt_tokens']:,} / {usage['completion_tokens']:,}"
+
+
+# Hechos de la tarjeta de estadísticas: (título, valor a partir de las estadísticas)
+STATS_FACTS: Tuple[Tuple[str, Callable[[Dict[str, Any]], str]], ...] = (
+    ("Mensajes:", lambda stats: str(stats.get("message_count", 0))),
+    ("Tokens usados:", lambda stats: f"{stats.get('total_tokens_used', 0):,}"),
+    ("Llamadas al modelo:", lambda stats: str(stats.get("total_calls", 0))),
+    ("Promedio tokens/llamada:", lambda stats: str(stats.get("average_tokens_per_call", 0))),
+    ("Tokens ahorrados (resumen):", lambda stats: f"{stats.get('tokens_saved', 0):,}"),
+    ("Caché de respuestas:", _format_cache_hit_rate),
+    ("Tokens de entrada / salida:", lambda stats: _format_usage(stats.get("usage"))),
+    (
+        "Tus tokens (todas las conversaciones):",
+        lambda stats: _format_usage(stats.get("user_usage")),
+    ),
+    ("Modelo:", lambda stats: stats.get("model", "N/A")),
+    ("Proyecto:", lambda stats: stats.get("project", "N/A")),
+)
 
 
 class AdaptiveCards:
-    """Generador de Adaptive Cards"""
+    """
+    Generador de Adaptive Cards
+    
+    Las tarjetas que solo dependen de la configuración (bienvenida, ayuda,
+    proyecto, acerca de) se construyen una vez y se reutilizan; no deben
+    modificarse después de obtenerlas. La de estadísticas parte de un
+    esqueleto fijo y solo genera los valores de cada llamada.
+    """
+    
+    _static_cards: Dict[str, Attachment] = {}
+    
+    # Esqueleto de la tarjeta de estadísticas (partes fijas, compartidas entre llamadas)
+    _STATS_CARD = {
+        "type": "AdaptiveCard",
+        "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
+        "version": "1.4",
+    }
+    _STATS_TITLE = {
+        "type": "TextBlock",
+        "text": "📊 Estadísticas de la Sesión",
+        "size": "Large",
+        "weight": "Bolder",
+        "color": "Accent"
+    }
+    _STATS_FACT_SET = {"type": "FactSet"}
+    
+    @classmethod
+    def _static_card(cls, name: str, builder: Callable[[], Attachment]) -> Attachment:
+        card = cls._static_cards.get(name)
+        if card is None:
+            card = cls._static_cards[name] = builder()
+        return card
+    
+    @classmethod
+    def warm_up(cls) -> int:
+        """
+        Construye las tarjetas estáticas (p. ej. al iniciar el bot)
+        
+        Returns:
+            Número de tarjetas en caché
+        """
+        cls.create_welcome_card()
+        cls.create_help_card()
+        cls.create_project_info_card()
+        cls.create_about_card()
+        return len(cls._static_cards)
+    
+    @classmethod
+    def refresh(cls) -> int:
+        """Reconstruye las tarjetas estáticas tras un cambio de configuración"""
+        cls._static_cards.clear()
+        count = cls.warm_up()
+        logger.info(f"Tarjetas estáticas reconstruidas: {count}")
+        return count
+    
+    @classmethod
+    def create_welcome_card(cls) -> Attachment:
+        """Tarjeta de bienvenida (en caché)"""
+        return cls._static_card("welcome", cls._build_welcome_card)
+    
+    @classmethod
+    def create_project_info_card(cls) -> Attachment:
+        """Tarjeta con información del proyecto de AI Foundry (en caché)"""
+        return cls._static_card("project", cls._build_project_info_card)
+    
+    @classmethod
+    def create_help_card(cls) -> Attachment:
+        """Tarjeta de ayuda (en caché)"""
+        return cls._static_card("help", cls._build_help_card)
+    
+    @classmethod
+    def create_about_card(cls) -> Attachment:
+        """Tarjeta acerca del bot (en caché)"""
+        return cls._static_card("about", cls._build_about_card)
+    
+    @classmethod
+    def create_stats_card(cls, stats: Dict[str, Any]) -> Attachment:
+        """Tarjeta de estadísticas mejorada"""
+        facts = [{"title": title, "value": value(stats)} for title, value in STATS_FACTS]
+        card = {
+            **cls._STATS_CARD,
+            "body": [cls._STATS_TITLE, {**cls._STATS_FACT_SET, "facts": facts}]
+        }
+        return CardFactory.adaptive_card(card)
     
     @staticmethod
-    def create_welcome_card() -> Attachment:
+    def _build_welcome_card() -> Attachment:
         """Tarjeta de bienvenida"""
         card = {
             "type": "AdaptiveCard",
@@ -94,55 +209,7 @@ class AdaptiveCards:
         return CardFactory.adaptive_card(card)
     
     @staticmethod
-    def create_stats_card(stats: Dict[str, Any]) -> Attachment:
-        """Tarjeta de estadísticas mejorada"""
-        card = {
-            "type": "AdaptiveCard",
-            "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
-            "version": "1.4",
-            "body": [
-                {
-                    "type": "TextBlock",
-                    "text": "📊 Estadísticas de la Sesión",
-                    "size": "Large",
-                    "weight": "Bolder",
-                    "color": "Accent"
-                },
-                {
-                    "type": "FactSet",
-                    "facts": [
-                        {
-                            "title": "Mensajes:",
-                            "value": str(stats.get("message_count", 0))
-                        },
-                        {
-                            "title": "Tokens usados:",
-                            "value": f"{stats.get('total_tokens_used', 0):,}"
-                        },
-                        {
-                            "title": "Llamadas al modelo:",
-                            "value": str(stats.get("total_calls", 0))
-                        },
-                        {
-                            "title": "Promedio tokens/llamada:",
-                            "value": str(stats.get("average_tokens_per_call", 0))
-                        },
-                        {
-                            "title": "Modelo:",
-                            "value": stats.get("model", "N/A")
-                        },
-                        {
-                            "title": "Proyecto:",
-                            "value": stats.get("project", "N/A")
-                        }
-                    ]
-                }
-            ]
-        }
-        return CardFactory.adaptive_card(card)
-    
-    @staticmethod
-    def create_project_info_card() -> Attachment:
+    def _build_project_info_card() -> Attachment:
         """Tarjeta con información del proyecto de AI Foundry"""
         card = {
             "type": "AdaptiveCard",
@@ -193,7 +260,7 @@ class AdaptiveCards:
         return CardFactory.adaptive_card(card)
     
     @staticmethod
-    def create_help_card() -> Attachment:
+    def _build_help_card() -> Attachment:
         """Tarjeta de ayuda"""
         card = {
             "type": "AdaptiveCard",
@@ -239,7 +306,7 @@ class AdaptiveCards:
         return CardFactory.adaptive_card(card)
     
     @staticmethod
-    def create_about_card() -> Attachment:
+    def _build_about_card() -> Attachment:
         """Tarjeta acerca del bot"""
         card = {
             "type": "AdaptiveCard",
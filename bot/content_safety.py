@@ -1,19 +1,111 @@
 """
 Integración con Azure AI Content Safety (parte de AI Foundry)
 """
+import asyncio
 import logging
-from typing import Dict, List, Optional
-from azure.ai.contentsafety import ContentSafetyClient
-from azure.ai.contentsafety.models import AnalyzeTextOptions
-from azure.identity import DefaultAzureCredential
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from app.cache import LRUCache, text_key
 from app.config import AzureAIFoundryConfig
+from app.credentials import COGNITIVE_SERVICES_SCOPE, get_token_provider
+from app.metrics import CONTENT_SAFETY_LATENCY
+from bot.prefilter import ModerationStage, create_default_prefilters
 
 logger = logging.getLogger(__name__)
 
 
+class ContentBlockedError(Exception):
+    """El contenido fue bloqueado por Content Safety"""
+
+
+class ContentSafetyBatcher:
+    """
+    Agrupa las solicitudes de análisis que llegan dentro de una ventana corta.
+    
+    Content Safety analiza un texto por solicitud, así que cada lote se
+    despacha en paralelo (con concurrencia acotada) y los textos idénticos
+    del lote comparten una única llamada.
+    """
+    
+    def __init__(self, analyze, window: float, max_concurrency: int):
+        """
+        Inicializa el agrupador
+        
+        Args:
+            analyze: Corrutina que analiza un texto y retorna el resultado
+            window: Segundos que se esperan para agrupar solicitudes
+            max_concurrency: Máximo de llamadas simultáneas al servicio
+        """
+        self._analyze = analyze
+        self.window = window
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._pending: Dict[str, Tuple[str, List[asyncio.Future]]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.remote_calls = 0
+        self.coalesced = 0
+    
+    def submit(self, key: str, text: str) -> "asyncio.Future[Dict[str, Any]]":
+        """
+        Encola un texto para el próximo lote
+        
+        Args:
+            key: Hash del texto
+            text: Texto a analizar
+        
+        Returns:
+            Future con el resultado del análisis
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        
+        entry = self._pending.get(key)
+        if entry is not None:
+            entry[1].append(future)
+            self.coalesced += 1
+        else:
+            self._pending[key] = (text, [future])
+        
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return future
+    
+    def _flush(self) -> None:
+        """Despacha el lote acumulado"""
+        self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        self.batches += 1
+        for text, futures in batch.values():
+            asyncio.ensure_future(self._dispatch(text, futures))
+    
+    async def _dispatch(self, text: str, futures: List[asyncio.Future]) -> None:
+        """Analiza un texto y resuelve todas las solicitudes que lo esperan"""
+        async with self._semaphore:
+            self.remote_calls += 1
+            try:
+                result = await self._analyze(text)
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+        
+        for future in futures:
+            if not future.done():
+                future.set_result(result)
+
+
 class ContentSafetyManager:
     """
     Gestor de Content Safety de Azure AI
+    
+    Antes de llamar al servicio pasa el texto por etapas locales (pre-filtro)
+    que resuelven sin red los casos evidentes. Para el resto usa el cliente
+    asíncrono del SDK, agrupa solicitudes concurrentes y cachea los resultados
+    por hash del texto, de modo que saludos repetidos o respuestas ya
+    analizadas no vuelven a llamar al servicio.
     """
     
     # Thresholds de severidad
@@ -23,70 +115,133 @@ class ContentSafetyManager:
         "high": 0      # Bloquea todo contenido potencialmente problemático
     }
     
-    def __init__(self):
-        """Inicializa el cliente de Content Safety"""
+    def __init__(self, prefilters: Optional[List[ModerationStage]] = None):
+        """
+        Inicializa el cliente de Content Safety
+        
+        Args:
+            prefilters: Etapas locales previas al servicio (por defecto las configuradas)
+        """
+        self.prefilters = (
+            prefilters if prefilters is not None else create_default_prefilters()
+        )
+        self.client = None
+        self.credential = None
+        self.batcher: Optional[ContentSafetyBatcher] = None
+        self.cache: LRUCache[Dict[str, Any]] = LRUCache(
+            AzureAIFoundryConfig.CONTENT_SAFETY_CACHE_SIZE,
+            ttl=AzureAIFoundryConfig.CONTENT_SAFETY_CACHE_TTL
+        )
+        self.threshold = self.THRESHOLDS.get(
+            AzureAIFoundryConfig.CONTENT_SAFETY_THRESHOLD,
+            1
+        )
+        
         if not AzureAIFoundryConfig.ENABLE_CONTENT_SAFETY:
             logger.info("Content Safety deshabilitado")
-            self.client = None
+            return
+        
+        if not AzureAIFoundryConfig.CONTENT_SAFETY_ENDPOINT:
+            logger.warning("Content Safety habilitado pero falta CONTENT_SAFETY_ENDPOINT")
             return
         
         try:
             logger.info("Inicializando Content Safety Client...")
+            # El SDK solo se importa si el servicio está habilitado
+            from azure.ai.contentsafety.aio import ContentSafetyClient
+            from azure.core.credentials import AzureKeyCredential
             
-            # Nota: El endpoint de Content Safety debe estar configurado en AI Foundry
-            # Aquí usamos DefaultAzureCredential para autenticación
-            credential = DefaultAzureCredential()
-            
-            # El endpoint debe obtenerse de las conexiones de AI Foundry
-            # Por ahora usamos el endpoint de OpenAI como base
-            # En producción, esto vendría de la configuración de AI Foundry
-            self.client = None  # Implementación depende de la configuración específica
+            # Clave de API si está configurada; si no, la credencial compartida de Azure AD
+            if AzureAIFoundryConfig.CONTENT_SAFETY_KEY:
+                self.credential = AzureKeyCredential(AzureAIFoundryConfig.CONTENT_SAFETY_KEY)
+            else:
+                provider = get_token_provider()
+                provider.register(COGNITIVE_SERVICES_SCOPE)
+                self.credential = provider.async_credential()
             
-            self.threshold = self.THRESHOLDS.get(
-                AzureAIFoundryConfig.CONTENT_SAFETY_THRESHOLD,
-                1
+            self.client = ContentSafetyClient(
+                AzureAIFoundryConfig.CONTENT_SAFETY_ENDPOINT,
+                self.credential
+            )
+            self.batcher = ContentSafetyBatcher(
+                self._analyze_remote,
+                window=AzureAIFoundryConfig.CONTENT_SAFETY_BATCH_WINDOW,
+                max_concurrency=AzureAIFoundryConfig.CONTENT_SAFETY_MAX_CONCURRENCY
             )
             
             logger.info("✅ Content Safety Client inicializado")
-            
+        
         except Exception as e:
             logger.warning(f"No se pudo inicializar Content Safety: {e}")
             self.client = None
     
-    def analyze_text(self, text: str) -> Dict[str, any]:
+    async def _analyze_remote(self, text: str) -> Dict[str, Any]:
+        """Llama al servicio y convierte la respuesta al formato del gestor"""
+        from azure.ai.contentsafety.models import AnalyzeTextOptions
+        
+        started = time.perf_counter()
+        try:
+            response = await self.client.analyze_text(AnalyzeTextOptions(text=text))
+        except Exception:
+            CONTENT_SAFETY_LATENCY.observe(time.perf_counter() - started, "error")
+            raise
+        CONTENT_SAFETY_LATENCY.observe(time.perf_counter() - started, "ok")
+        categories = {
+            str(getattr(item.category, "value", item.category)).lower(): item.severity or 0
+            for item in response.categories_analysis or []
+        }
+        is_safe = all(severity <= self.threshold for severity in categories.values())
+        return {
+            "is_safe": is_safe,
+            "categories": categories,
+            "message": "Contenido seguro" if is_safe else "Contenido bloqueado"
+        }
+    
+    async def analyze_text(self, text: str) -> Dict[str, Any]:
         """
         Analiza un texto para detectar contenido inapropiado
         
         Args:
             text: Texto a analizar
-            
+        
         Returns:
             Diccionario con resultados del análisis
         """
-        if not self.client or not AzureAIFoundryConfig.ENABLE_CONTENT_SAFETY:
+        if not AzureAIFoundryConfig.ENABLE_CONTENT_SAFETY:
             return {
                 "is_safe": True,
                 "categories": {},
                 "message": "Content Safety no habilitado"
             }
         
-        try:
-            # Implementación de análisis de contenido
-            # Esto es un placeholder - la implementación real depende del SDK
-            logger.info(f"Analizando contenido: {text[:50]}...")
-            
-            # Simulación de respuesta
+        # Pre-filtro local: los casos evidentes no llegan al servicio
+        for stage in self.prefilters:
+            verdict = stage.classify(text)
+            if verdict is not None:
+                return {
+                    "is_safe": verdict,
+                    "categories": {},
+                    "message": f"Resuelto por pre-filtro local ({stage.name})"
+                }
+        
+        if not self.client:
             return {
                 "is_safe": True,
-                "categories": {
-                    "hate": 0,
-                    "self_harm": 0,
-                    "sexual": 0,
-                    "violence": 0
-                },
-                "message": "Contenido seguro"
+                "categories": {},
+                "message": "Content Safety no habilitado"
             }
-            
+        
+        key = text_key(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        try:
+            logger.info("Analizando contenido: %.50s...", text)
+            result = await self.batcher.submit(key, text)
+            self.cache.put(key, result)
+            return result
+        
         except Exception as e:
             logger.error(f"Error analizando contenido: {e}")
             return {
@@ -95,18 +250,40 @@ class ContentSafetyManager:
                 "message": f"Error en análisis: {str(e)}"
             }
     
-    def is_content_safe(self, text: str) -> bool:
+    async def is_content_safe(self, text: str) -> bool:
         """
         Verifica si el contenido es seguro
         
         Args:
             text: Texto a verificar
-            
+        
         Returns:
             True si el contenido es seguro
         """
         if not AzureAIFoundryConfig.ENABLE_CONTENT_SAFETY:
             return True
         
-        result = self.analyze_text(text)
+        result = await self.analyze_text(text)
         return result.get("is_safe", True)
+    
+    def get_statistics(self) -> Dict[str, Any]:
+        """Métricas de caché y agrupación de solicitudes"""
+        return {
+            "enabled": self.client is not None,
+            "cache": self.cache.get_stats(),
+            "batches": self.batcher.batches if self.batcher else 0,
+            "remote_calls": self.batcher.remote_calls if self.batcher else 0,
+            "coalesced": self.batcher.coalesced if self.batcher else 0,
+            "prefilters": {
+                stage.name: stage.get_statistics() for stage in self.prefilters
+            }
+        }
+    
+    async def close(self) -> None:
+        """Cierra el cliente y la credencial asíncronos"""
+        if self.client is not None:
+            await self.client.close()
+        # La credencial compartida de Azure AD la cierra su proveedor
+        close = getattr(self.credential, "close", None)
+        if close is not None:
+            await close()
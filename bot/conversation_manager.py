@@ -1,19 +1,235 @@
 """
 Gestor de conversaciones para múltiples usuarios
 """
+import asyncio
 import logging
-from typing import Dict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
 from app.chat_engine import AIFoundryChatEngine
+from app.config import BotConfig, SessionConfig
+from app.session import ChatSession, SessionCache, SessionSpillStore
+from app.session_store import SessionStore, WriteBehindWriter, create_session_store
 
 logger = logging.getLogger(__name__)
 
 
-class ConversationManager:
-    """Gestiona múltiples instancias de chat engines"""
+class TurnBatch:
+    """Mensajes que se atienden en un mismo turno de la conversación"""
+    
+    __slots__ = ("messages", "outcome")
+    
+    def __init__(self, *messages: str):
+        self.messages: List[str] = list(messages)
+        # Al terminar el turno: None si se atendió, o el lote con los mensajes
+        # agrupados que quedaron sin atender si el turno falló o se canceló
+        self.outcome: asyncio.Future = asyncio.get_running_loop().create_future()
+    
+    @property
+    def text(self) -> str:
+        """Texto combinado que se envía al modelo"""
+        return "\n\n".join(self.messages)
+
+
+class _Lane:
+    """Estado de turnos de una conversación"""
+    
+    __slots__ = ("lock", "pending", "users")
     
     def __init__(self):
-        """Inicializa el gestor"""
-        self.engines: Dict[str, AIFoundryChatEngine] = {}
+        self.lock = asyncio.Lock()
+        self.pending: Optional[TurnBatch] = None
+        self.users = 0
+
+
+class ConversationTurns:
+    """
+    Serializa los turnos de cada conversación.
+    
+    Dentro de una conversación los mensajes se atienden de a uno y en orden
+    de llegada, de modo que dos respuestas no intercalan el historial;
+    conversaciones distintas siguen siendo completamente paralelas. Con
+    agrupación habilitada, los mensajes que llegan mientras hay un turno en
+    curso se juntan en el siguiente turno: el primero lo atiende con el
+    texto combinado y el resto no genera respuesta propia. Si ese turno
+    falla o se cancela, los mensajes agrupados pasan al siguiente de ellos,
+    que los atiende en su propio turno.
+    """
+    
+    def __init__(self, coalesce: bool = False, max_batch: int = 5):
+        """
+        Inicializa los turnos
+        
+        Args:
+            coalesce: Agrupar los mensajes que llegan durante un turno en curso
+            max_batch: Máximo de mensajes por turno agrupado
+        """
+        self.coalesce = coalesce
+        self.max_batch = max(1, max_batch)
+        self._lanes: Dict[str, _Lane] = {}
+        self.waited = 0
+        self.coalesced = 0
+        self.handed_off = 0
+    
+    @asynccontextmanager
+    async def turn(
+        self,
+        conversation_id: str,
+        message: str,
+        coalesce: bool = True
+    ) -> AsyncIterator[Optional[TurnBatch]]:
+        """
+        Espera el turno de un mensaje en su conversación
+        
+        Args:
+            conversation_id: ID de la conversación
+            message: Mensaje del usuario
+            coalesce: Permite agrupar este mensaje (los comandos no se agrupan)
+        
+        Yields:
+            Lote a atender, o None si el mensaje se agregó al turno de otro mensaje
+        """
+        lane = self._lanes.get(conversation_id)
+        if lane is None:
+            lane = self._lanes[conversation_id] = _Lane()
+        lane.users += 1
+        coalesce = coalesce and self.coalesce
+        # Lote a cargo de este mensaje
+        batch: Optional[TurnBatch] = None
+        served = False
+        try:
+            pending = lane.pending
+            if coalesce and pending is not None and len(pending.messages) < self.max_batch:
+                pending.messages.append(message)
+                self.coalesced += 1
+                batch = await self._follow(pending, len(pending.messages) - 1)
+                if batch is None:
+                    yield None
+                    return
+            else:
+                batch = TurnBatch(message)
+                if lane.lock.locked():
+                    self.waited += 1
+                    if coalesce:
+                        lane.pending = batch
+            
+            async with lane.lock:
+                # El lote se cierra al empezar el turno: lo que llegue después va al siguiente
+                if lane.pending is batch:
+                    lane.pending = None
+                yield batch
+                served = True
+        finally:
+            if batch is not None:
+                if lane.pending is batch:
+                    lane.pending = None
+                self._finish(batch, served)
+            lane.users -= 1
+            if lane.users == 0:
+                del self._lanes[conversation_id]
+    
+    async def _follow(self, batch: TurnBatch, index: int) -> Optional[TurnBatch]:
+        """
+        Espera el turno que atiende un mensaje agrupado
+        
+        Args:
+            batch: Lote al que se agregó el mensaje
+            index: Posición del mensaje en el lote
+        
+        Returns:
+            None si el lote se atendió, o el lote que este mensaje debe atender
+            porque el turno anterior falló
+        """
+        while True:
+            try:
+                handoff = await asyncio.shield(batch.outcome)
+            except asyncio.CancelledError:
+                # Si el lote ya le había pasado a este mensaje, sigue al siguiente
+                if batch.outcome.done() and index == 1:
+                    handoff = batch.outcome.result()
+                    if handoff is not None:
+                        self._finish(handoff, served=False)
+                raise
+            if handoff is None:
+                return None
+            index -= 1
+            if index == 0:
+                return handoff
+            batch = handoff
+    
+    def _finish(self, batch: TurnBatch, served: bool) -> None:
+        """Cierra un lote; si no se atendió, sus mensajes agrupados pasan al siguiente"""
+        if batch.outcome.done():
+            return
+        if served or len(batch.messages) == 1:
+            batch.outcome.set_result(None)
+            return
+        self.handed_off += 1
+        logger.warning(
+            f"Turno interrumpido; {len(batch.messages) - 1} mensajes agrupados "
+            "pasan al siguiente turno"
+        )
+        batch.outcome.set_result(TurnBatch(*batch.messages[1:]))
+    
+    def get_statistics(self) -> Dict[str, int]:
+        """Métricas de turnos"""
+        return {
+            "active_conversations": len(self._lanes),
+            "waited": self.waited,
+            "coalesced": self.coalesced,
+            "handed_off": self.handed_off
+        }
+
+
+class ConversationManager:
+    """
+    Gestiona las conversaciones activas.
+    
+    Solo guarda una ChatSession compacta por conversación; los chat engines
+    son vistas ligeras que comparten LLM, prompt y cadena. Las sesiones viven
+    en un almacén acotado (LRU, expiración por inactividad y presupuesto de
+    memoria) para que el proceso no crezca sin límite.
+    
+    Con un almacén compartido (SESSION_STORE_BACKEND) la memoria local actúa
+    como caché: al empezar cada turno la sesión se lee del almacén si falta
+    o si otro proceso la modificó, y al terminar se programa su escritura
+    diferida. Así varios workers o réplicas pueden atender la misma
+    conversación sin perder contexto.
+    """
+    
+    def __init__(
+        self,
+        spill_store: Optional[SessionSpillStore] = None,
+        store: Optional[SessionStore] = None
+    ):
+        """
+        Inicializa el gestor
+        
+        Args:
+            spill_store: Destino opcional de las sesiones desalojadas
+            store: Almacén compartido (por defecto el configurado en SESSION_STORE_BACKEND)
+        """
+        self.sessions = SessionCache(
+            max_sessions=SessionConfig.MAX_SESSIONS,
+            idle_ttl=SessionConfig.IDLE_TTL,
+            max_bytes=SessionConfig.MEMORY_BUDGET_BYTES,
+            sweep_interval=SessionConfig.SWEEP_INTERVAL,
+            spill_store=spill_store,
+        )
+        self.turns = ConversationTurns(
+            coalesce=BotConfig.COALESCE_MESSAGES,
+            max_batch=BotConfig.COALESCE_MAX_MESSAGES,
+        )
+        if store is None:
+            store = create_session_store()
+        self.writer: Optional[WriteBehindWriter] = None
+        if store is not None:
+            self.writer = WriteBehindWriter(
+                store,
+                interval=SessionConfig.WRITE_BEHIND_INTERVAL,
+                max_batch=SessionConfig.WRITE_BEHIND_MAX_BATCH,
+            )
+            logger.info(f"Almacén de sesiones compartido: {store.backend}")
+        self.store_errors = 0
         logger.info("ConversationManager inicializado")
     
     def get_or_create_engine(self, conversation_id: str) -> AIFoundryChatEngine:
@@ -26,32 +242,113 @@ class ConversationManager:
         Returns:
             Chat engine para la conversación
         """
-        if conversation_id not in self.engines:
-            logger.info(f"Creando AIFoundryChatEngine para: {conversation_id}")
-            self.engines[conversation_id] = AIFoundryChatEngine(session_id=conversation_id)
+        if conversation_id not in self.sessions:
+            logger.info("Creando sesión para: %s", conversation_id)
         
-        return self.engines[conversation_id]
+        return AIFoundryChatEngine(session=self.sessions.get_or_create(conversation_id))
+    
+    async def get_or_create_engine_async(self, conversation_id: str) -> AIFoundryChatEngine:
+        """Como get_or_create_engine, cargando antes la sesión del almacén compartido"""
+        await self.load_session(conversation_id)
+        return self.get_or_create_engine(conversation_id)
+    
+    async def load_session(self, conversation_id: str) -> None:
+        """
+        Trae la sesión del almacén compartido si falta en memoria o está desactualizada
+        
+        Args:
+            conversation_id: ID de la conversación
+        """
+        if self.writer is None or self.writer.is_pending(conversation_id):
+            # Sin almacén, o la copia local tiene cambios aún no escritos
+            return
+        local = self.sessions.get(conversation_id)
+        if local is not None and not SessionConfig.STORE_REVALIDATE:
+            return
+        
+        try:
+            record = await self.writer.store.load(conversation_id)
+        except Exception as e:
+            self.store_errors += 1
+            logger.warning(f"No se pudo leer la sesión {conversation_id} del almacén: {e}")
+            return
+        if record is not None and (local is None or record.get("v", 0) > local.version):
+            self.sessions.put(ChatSession.from_dict(record))
+    
+    @asynccontextmanager
+    async def turn(
+        self,
+        conversation_id: str,
+        message: str,
+        coalesce: bool = True
+    ) -> AsyncIterator[Optional[TurnBatch]]:
+        """
+        Turno exclusivo de la conversación (ver ConversationTurns.turn)
+        
+        Con almacén compartido, la sesión se sincroniza al empezar el turno
+        y se programa su escritura al terminar.
+        
+        Uso:
+            async with manager.turn(conversation_id, text) as batch:
+                if batch is None:
+                    return  # agregado al turno de un mensaje anterior
+                ...
+        """
+        async with self.turns.turn(conversation_id, message, coalesce=coalesce) as batch:
+            if batch is None or self.writer is None:
+                yield batch
+                return
+            
+            await self.load_session(conversation_id)
+            try:
+                yield batch
+            finally:
+                session = self.sessions.get(conversation_id)
+                if session is not None:
+                    self.writer.mark(session)
     
     def remove_engine(self, conversation_id: str) -> bool:
-        """Elimina un chat engine"""
-        if conversation_id in self.engines:
-            logger.info(f"Eliminando engine: {conversation_id}")
-            del self.engines[conversation_id]
+        """Elimina la sesión de una conversación (también del almacén compartido)"""
+        if self.writer is not None:
+            self.writer.delete(conversation_id)
+        if self.sessions.remove(conversation_id):
+            logger.info(f"Eliminando sesión: {conversation_id}")
             return True
         return False
     
+    def evict_idle(self) -> int:
+        """Expira las conversaciones inactivas"""
+        evicted = self.sessions.sweep()
+        if evicted:
+            logger.info(f"Conversaciones desalojadas: {evicted}")
+        return evicted
+    
     def get_active_count(self) -> int:
         """Obtiene número de conversaciones activas"""
-        return len(self.engines)
+        return len(self.sessions)
     
     def get_all_statistics(self) -> list:
         """Obtiene estadísticas de todas las conversaciones"""
         return [
-            engine.get_statistics() 
-            for engine in self.engines.values()
+            AIFoundryChatEngine(session=session).get_statistics()
+            for session in self.sessions.values()
         ]
     
     def clear_all(self):
         """Limpia todas las conversaciones"""
         logger.info("Limpiando todas las conversaciones")
-        self.engines.clear()
+        self.sessions.clear()
+    
+    async def close(self) -> None:
+        """Escribe las sesiones pendientes y cierra el almacén compartido"""
+        if self.writer is not None:
+            await self.writer.close()
+    
+    def get_store_statistics(self) -> Dict[str, Any]:
+        """Obtiene métricas del almacén de sesiones (ocupación, desalojos y turnos)"""
+        stats = {**self.sessions.get_stats(), "turns": self.turns.get_statistics()}
+        if self.writer is not None:
+            stats["shared_store"] = {
+                **self.writer.get_statistics(), "read_errors": self.store_errors
+            }
+        return stats
@@ -0,0 +1,165 @@
+"""
+Pre-filtro local de moderación (sin red) previo a Azure Content Safety
+"""
+import logging
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+from app.config import AzureAIFoundryConfig
+
+logger = logging.getLogger(__name__)
+
+# Mensajes cortos habituales que no requieren análisis remoto
+DEFAULT_ALLOWLIST = (
+    "hola", "buenas", "buenos dias", "buenas tardes", "buenas noches",
+    "gracias", "muchas gracias", "ok", "okay", "vale", "perfecto", "genial",
+    "si", "no", "adios", "hasta luego", "hi", "hello", "hey", "thanks",
+    "thank you", "good morning", "bye", "yes",
+)
+
+_PUNCTUATION = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin acentos, sin signos de puntuación y con espacios simples"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+class ModerationStage:
+    """
+    Etapa de moderación local.
+    
+    `classify` retorna True si el texto es claramente seguro, False si es
+    claramente inseguro y None si debe escalarse al servicio remoto.
+    """
+    
+    name = "stage"
+    
+    def classify(self, text: str) -> Optional[bool]:
+        """Clasifica un texto sin llamadas de red"""
+        return None
+    
+    def get_statistics(self) -> Dict[str, int]:
+        """Contadores de la etapa"""
+        return {}
+
+
+class LocalModerationFilter(ModerationStage):
+    """
+    Clasificador local basado en una lista de bloqueo compilada en una única
+    expresión regular y una lista de mensajes cortos permitidos.
+    """
+    
+    name = "local"
+    
+    def __init__(
+        self,
+        blocklist: Iterable[str] = (),
+        allowlist: Iterable[str] = DEFAULT_ALLOWLIST,
+        max_allowlist_chars: int = 40,
+    ):
+        """
+        Inicializa el filtro
+        
+        Args:
+            blocklist: Términos bloqueados; los que empiezan por "re:" son expresiones
+                regulares, evaluadas sobre el texto normalizado
+            allowlist: Mensajes cortos que se consideran seguros
+            max_allowlist_chars: Longitud máxima para consultar la lista permitida
+        """
+        self.blocklist_pattern = self._compile_blocklist(blocklist)
+        self.allowlist = {normalize_text(item) for item in allowlist if item.strip()}
+        self.max_allowlist_chars = max_allowlist_chars
+        
+        self.safe_hits = 0
+        self.unsafe_hits = 0
+        self.escalated = 0
+    
+    @staticmethod
+    def _compile_blocklist(blocklist: Iterable[str]) -> Optional["re.Pattern"]:
+        """
+        Compila todos los términos en una sola alternativa (un solo recorrido del texto)
+        
+        Las expresiones regulares inválidas se registran y se omiten, de modo
+        que un error en la lista configurada no impide arrancar el bot.
+        """
+        alternatives: List[str] = []
+        for term in blocklist:
+            term = term.strip()
+            if not term:
+                continue
+            if term.startswith("re:"):
+                try:
+                    re.compile(term[3:])
+                except re.error as e:
+                    logger.warning(f"Expresión inválida en la lista de bloqueo: {term!r} ({e})")
+                    continue
+                alternatives.append(f"(?:{term[3:]})")
+            else:
+                alternatives.append(r"\b" + re.escape(normalize_text(term)) + r"\b")
+        
+        if not alternatives:
+            return None
+        # Términos más largos primero: la alternancia prefiere la coincidencia más específica
+        alternatives.sort(key=len, reverse=True)
+        return re.compile("|".join(alternatives))
+    
+    def classify(self, text: str) -> Optional[bool]:
+        """Clasifica un texto como seguro, inseguro o ambiguo"""
+        normalized = normalize_text(text)
+        
+        if self.blocklist_pattern is not None and self.blocklist_pattern.search(normalized):
+            self.unsafe_hits += 1
+            return False
+        
+        if len(normalized) <= self.max_allowlist_chars and normalized in self.allowlist:
+            self.safe_hits += 1
+            return True
+        
+        self.escalated += 1
+        return None
+    
+    def get_statistics(self) -> Dict[str, int]:
+        """Contadores de decisiones locales y escalados"""
+        return {
+            "safe": self.safe_hits,
+            "unsafe": self.unsafe_hits,
+            "escalated": self.escalated,
+            "calls_avoided": self.safe_hits + self.unsafe_hits
+        }
+
+
+def _split_list(value: str) -> List[str]:
+    """Separa una lista de configuración por comas"""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def create_default_prefilters() -> List[ModerationStage]:
+    """Crea las etapas locales configuradas (vacío si están deshabilitadas)"""
+    if not AzureAIFoundryConfig.CONTENT_SAFETY_PREFILTER:
+        return []
+    
+    blocklist = _split_list(AzureAIFoundryConfig.CONTENT_SAFETY_BLOCKLIST)
+    if AzureAIFoundryConfig.CONTENT_SAFETY_BLOCKLIST_FILE:
+        try:
+            with open(AzureAIFoundryConfig.CONTENT_SAFETY_BLOCKLIST_FILE, encoding="utf-8") as f:
+                blocklist.extend(
+                    line.strip() for line in f if line.strip() and not line.startswith("#")
+                )
+        except OSError as e:
+            logger.warning(f"No se pudo leer la lista de bloqueo: {e}")
+    
+    allowlist = (
+        _split_list(AzureAIFoundryConfig.CONTENT_SAFETY_ALLOWLIST) or list(DEFAULT_ALLOWLIST)
+    )
+    
+    logger.info(
+        f"Pre-filtro local de moderación: {len(blocklist)} términos bloqueados, "
+        f"{len(allowlist)} mensajes permitidos"
+    )
+    return [LocalModerationFilter(blocklist=blocklist, allowlist=allowlist)]
@@ -0,0 +1,180 @@
+"""
+Respuestas progresivas en Teams: un mensaje inicial que se actualiza por bloques
+"""
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+from botbuilder.core import TurnContext, MessageFactory
+
+logger = logging.getLogger(__name__)
+
+# Caracteres ya moderados que se vuelven a enviar junto al texto nuevo, para
+# que una expresión partida entre dos verificaciones se evalúe completa
+MODERATION_OVERLAP_CHARS = 200
+
+
+class StreamingReply:
+    """
+    Envía una respuesta que se va generando: el primer fragmento se envía de
+    inmediato como mensaje nuevo y el resto se agrupa en actualizaciones de
+    ese mismo mensaje, limitadas por tiempo y tamaño para no saturar el
+    conector de Bot Framework.
+    
+    Con `moderate`, el texto nuevo (con una cola del ya verificado) se
+    modera antes de cada envío o actualización, y el texto completo una vez
+    antes del mensaje final: si no es seguro no se muestra, la generación se
+    detiene y `blocked` queda en True. Para no multiplicar las llamadas, el
+    primer envío espera `min_chars` caracteres y las actualizaciones al
+    menos `moderation_chars` nuevos.
+    """
+    
+    def __init__(
+        self,
+        turn_context: TurnContext,
+        min_interval: float,
+        min_chars: int,
+        moderate: Optional[Callable[[str], Awaitable[bool]]] = None,
+        moderation_chars: int = 0
+    ):
+        """
+        Inicializa la respuesta
+        
+        Args:
+            turn_context: Contexto de la conversación
+            min_interval: Segundos mínimos entre actualizaciones del mensaje
+            min_chars: Caracteres nuevos mínimos para enviar una actualización
+            moderate: Verificación del texto antes de mostrarlo (True si es seguro)
+            moderation_chars: Caracteres nuevos mínimos entre actualizaciones moderadas
+        """
+        self.turn_context = turn_context
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.moderate = moderate
+        # Con moderación cada actualización es una llamada al servicio: se espacian
+        self.update_chars = max(min_chars, moderation_chars) if moderate else min_chars
+        # Con moderación el primer envío no es el primer fragmento (un solo token)
+        self.initial_chars = min_chars if moderate else 1
+        
+        self.blocked = False
+        self.activity_id: Optional[str] = None
+        self.updates_sent = 0
+        self.moderation_calls = 0
+        self._moderated_chars = 0
+        self._sent_text = ""
+        self._sent_at = 0.0
+        self._updatable = True
+    
+    async def stream(self, chunks: AsyncIterator[str]) -> str:
+        """
+        Consume los fragmentos y los muestra progresivamente
+        
+        Args:
+            chunks: Iterador asíncrono de fragmentos de texto
+        
+        Returns:
+            Texto completo de la respuesta (hasta donde se generó si se bloqueó)
+        """
+        parts: List[str] = []
+        length = 0
+        
+        async for chunk in chunks:
+            parts.append(chunk)
+            length += len(chunk)
+            
+            if self.activity_id is None and self._updatable:
+                if length < self.initial_chars:
+                    continue
+                text = "".join(parts)
+                if not await self._approve_new(text):
+                    break
+                await self._send_initial(text)
+            elif (
+                self._updatable
+                and length - len(self._sent_text) >= self.update_chars
+                and time.monotonic() - self._sent_at >= self.min_interval
+            ):
+                text = "".join(parts)
+                if not await self._approve_new(text):
+                    break
+                await self._update(text)
+        
+        text = "".join(parts)
+        if self.blocked:
+            # Detener la generación: el resto no se va a mostrar
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            return text
+        
+        # Una única verificación del texto completo antes del mensaje final
+        if text and await self._approve(text) and text != self._sent_text:
+            await self.finish(text)
+        return text
+    
+    async def finish(self, text: str) -> None:
+        """
+        Deja el mensaje con el texto final (o lo reemplaza, p. ej. si el
+        contenido resultó no ser seguro)
+        
+        Args:
+            text: Texto definitivo del mensaje
+        """
+        if text == self._sent_text:
+            return
+        
+        if self.activity_id is not None and self._updatable:
+            await self._update(text)
+        elif self.activity_id is None and not self._sent_text:
+            await self.turn_context.send_activity(MessageFactory.text(text))
+            self._sent_text = text
+        else:
+            # El canal no permite actualizar: se envía lo que faltaba como mensaje nuevo
+            remaining = text[len(self._sent_text):] if text.startswith(self._sent_text) else text
+            await self.turn_context.send_activity(MessageFactory.text(remaining))
+            self._sent_text = text
+    
+    async def _approve_new(self, text: str) -> bool:
+        """Verifica el texto agregado desde la última verificación (con una cola del anterior)"""
+        start = max(0, self._moderated_chars - MODERATION_OVERLAP_CHARS)
+        if not await self._approve(text[start:]):
+            return False
+        self._moderated_chars = len(text)
+        return True
+    
+    async def _approve(self, text: str) -> bool:
+        """Verifica el texto antes de mostrarlo"""
+        if self.moderate is None:
+            return True
+        self.moderation_calls += 1
+        if await self.moderate(text):
+            return True
+        logger.warning("Respuesta en streaming bloqueada por moderación antes de mostrarse")
+        self.blocked = True
+        return False
+    
+    async def _send_initial(self, text: str) -> None:
+        """Envía el primer fragmento como mensaje nuevo"""
+        response = await self.turn_context.send_activity(MessageFactory.text(text))
+        self._sent_text = text
+        self._sent_at = time.monotonic()
+        
+        if response is not None and response.id:
+            self.activity_id = response.id
+        else:
+            logger.info("El canal no devolvió ID de actividad; se desactivan las actualizaciones")
+            self._updatable = False
+    
+    async def _update(self, text: str) -> None:
+        """Reemplaza el texto del mensaje ya enviado"""
+        activity = MessageFactory.text(text)
+        activity.id = self.activity_id
+        try:
+            await self.turn_context.update_activity(activity)
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar el mensaje en streaming: {e}")
+            self._updatable = False
+            return
+        self._sent_text = text
+        self._sent_at = time.monotonic()
+        self.updates_sent += 1
@@ -1,8 +1,10 @@
 """
 Bot de Microsoft Teams con Azure AI Foundry
 """
+import asyncio
 import logging
-from typing import List
+import time
+from typing import AsyncIterator, List
 from botbuilder.core import (
     ActivityHandler,
     TurnContext,
@@ -15,12 +17,27 @@ from botbuilder.schema import (
 )
 
 from app.chat_engine import AIFoundryChatEngine
+from app.config import BotConfig
+from app.metrics import TURN_LATENCY
+from app.tracing import get_tracer
+from app.usage import get_usage_tracker
 from bot.conversation_manager import ConversationManager
 from bot.cards import AdaptiveCards
-from bot.content_safety import ContentSafetyManager
+from bot.content_safety import ContentSafetyManager, ContentBlockedError
+from bot.streaming import StreamingReply
 
 logger = logging.getLogger(__name__)
 
+BLOCKED_INPUT_RESPONSE = (
+    "⚠️ Lo siento, tu mensaje contiene contenido que no puedo procesar. "
+    "Por favor, reformula tu pregunta de manera apropiada."
+)
+
+UNSAFE_RESPONSE = (
+    "Lo siento, no puedo proporcionar esa información. "
+    "¿Puedo ayudarte con algo más?"
+)
+
 
 class TeamsAIFoundryBot(ActivityHandler):
     """
@@ -32,6 +49,10 @@ class TeamsAIFoundryBot(ActivityHandler):
         super().__init__()
         self.conversation_manager = ConversationManager()
         self.content_safety = ContentSafetyManager()
+        self.tracer = get_tracer()
+        
+        # Construir LLM, prompt y cadena compartidos fuera del primer mensaje
+        AIFoundryChatEngine.prepare()
         logger.info("✅ TeamsAIFoundryBot inicializado")
     
     async def on_message_activity(self, turn_context: TurnContext):
@@ -41,6 +62,10 @@ class TeamsAIFoundryBot(ActivityHandler):
         Args:
             turn_context: Contexto de la conversación
         """
+        started = time.perf_counter()
+        # Etiquetas de la latencia del turno: se registra siempre, también si falla
+        kind = "message"
+        outcome = "error"
         try:
             # Obtener información del mensaje
             user_id = turn_context.activity.from_property.id
@@ -48,51 +73,199 @@ class TeamsAIFoundryBot(ActivityHandler):
             user_message = turn_context.activity.text
             user_name = turn_context.activity.from_property.name
             
+            # Formateo diferido: lo hace el hilo de logs, no el bucle de eventos
             logger.info(
-                f"Mensaje de {user_name} ({user_id}) "
-                f"en {conversation_id}: {user_message[:50]}..."
+                "Mensaje de %s (%s) en %s: %.50s...",
+                user_name, user_id, conversation_id, user_message,
+                extra={"conversation_id": conversation_id}
             )
             
-            # Verificar content safety
-            if not self.content_safety.is_content_safe(user_message):
-                await turn_context.send_activity(
-                    "⚠️ Lo siento, tu mensaje contiene contenido que no puedo procesar. "
-                    "Por favor, reformula tu pregunta de manera apropiada."
-                )
-                return
+            # Un turno a la vez por conversación (los comandos no se agrupan)
+            is_command = user_message.lower().startswith("/")
+            if is_command:
+                kind = "command"
+            with self.tracer.trace(
+                "teams.turn",
+                **{
+                    "conversation.id": conversation_id,
+                    "turn.kind": kind,
+                    "message.chars": len(user_message),
+                }
+            ) as span:
+                waiting = self.tracer.start_span("conversation.wait_turn")
+                async with self.conversation_manager.turn(
+                    conversation_id, user_message, coalesce=not is_command
+                ) as batch:
+                    waiting.end()
+                    if batch is None:
+                        outcome = "coalesced"
+                        span.set_attribute("turn.coalesced", True)
+                        logger.info(
+                            "Mensaje agregado al turno en curso de %s", conversation_id,
+                            extra={"conversation_id": conversation_id}
+                        )
+                        return
+                    await self._process_message(turn_context, conversation_id, batch.text)
             
-            # Comandos especiales
-            if user_message.lower().startswith("/"):
-                await self._handle_command(turn_context, user_message.lower())
-                return
+            outcome = "ok"
+            logger.info(
+                "Respuesta enviada a %s", user_name, extra={"conversation_id": conversation_id}
+            )
             
-            # Obtener o crear chat engine
+        except Exception as e:
+            logger.error(f"Error en on_message_activity: {e}", exc_info=True)
+            await turn_context.send_activity(
+                "Lo siento, ocurrió un error al procesar tu mensaje. "
+                "El equipo técnico ha sido notificado. Por favor, intenta de nuevo más tarde."
+            )
+        finally:
+            TURN_LATENCY.observe(time.perf_counter() - started, kind, outcome)
+    
+    async def _process_message(
+        self,
+        turn_context: TurnContext,
+        conversation_id: str,
+        user_message: str
+    ):
+        """
+        Atiende un mensaje (o lote de mensajes agrupados) dentro del turno
+        exclusivo de su conversación
+        
+        Args:
+            turn_context: Contexto de la conversación
+            conversation_id: ID de la conversación
+            user_message: Texto a responder
+        """
+        # Comandos especiales (no llaman al modelo: moderación previa)
+        if user_message.startswith("/"):
+            if not await self._is_safe(user_message, "input"):
+                await turn_context.send_activity(BLOCKED_INPUT_RESPONSE)
+                return
+            with self.tracer.span("command"):
+                await self._handle_command(turn_context, user_message.lower())
+            return
+        
+        # Obtener o crear chat engine
+        with self.tracer.span("engine.get"):
             chat_engine = self.conversation_manager.get_or_create_engine(conversation_id)
-            
-            # Mostrar indicador de escritura
-            await turn_context.send_activity(Activity(type=ActivityTypes.typing))
-            
+        
+        # La moderación de entrada corre en paralelo con la llamada al modelo;
+        # si el mensaje no es seguro la llamada se cancela y nada se muestra
+        moderation = asyncio.ensure_future(self._is_safe(user_message, "input"))
+        
+        if BotConfig.ENABLE_STREAMING:
+            await self._send_streaming_response(
+                turn_context, chat_engine, user_message, moderation
+            )
+        else:
             # Obtener respuesta del modelo
-            response = await chat_engine.send_message_async(user_message)
+            generation = asyncio.ensure_future(
+                chat_engine.send_message_async(
+                    user_message,
+                    commit_gate=moderation,
+                    user_id=turn_context.activity.from_property.id
+                )
+            )
+            try:
+                # Mostrar indicador de escritura
+                with self.tracer.span("activity.typing"):
+                    await turn_context.send_activity(Activity(type=ActivityTypes.typing))
+                
+                if not await moderation:
+                    generation.cancel()
+                    await turn_context.send_activity(BLOCKED_INPUT_RESPONSE)
+                    return
+                response = await generation
+            finally:
+                generation.cancel()
+                moderation.cancel()
             
             # Verificar respuesta con content safety
-            if not self.content_safety.is_content_safe(response):
-                response = (
-                    "Lo siento, no puedo proporcionar esa información. "
-                    "¿Puedo ayudarte con algo más?"
-                )
+            if not await self._is_safe(response, "output"):
+                response = UNSAFE_RESPONSE
             
             # Enviar respuesta
-            await turn_context.send_activity(MessageFactory.text(response))
+            with self.tracer.span("activity.send"):
+                await turn_context.send_activity(MessageFactory.text(response))
+    
+    async def _is_safe(self, text: str, stage: str) -> bool:
+        """Moderación de un texto como etapa de la traza del turno ("input" u "output")"""
+        with self.tracer.span(f"moderation.{stage}", **{"message.chars": len(text)}) as span:
+            is_safe = await self.content_safety.is_content_safe(text)
+            span.set_attribute("moderation.safe", is_safe)
+            return is_safe
+    
+    async def _send_streaming_response(
+        self,
+        turn_context: TurnContext,
+        chat_engine: AIFoundryChatEngine,
+        user_message: str,
+        moderation: "asyncio.Future[bool]"
+    ):
+        """
+        Muestra la respuesta a medida que se genera, actualizando el mismo mensaje
+        
+        Ningún fragmento se muestra antes de que la moderación de entrada
+        apruebe el mensaje; el texto nuevo se verifica con content safety
+        antes de cada envío o actualización y el texto completo antes del
+        mensaje final. Si deja de ser seguro, la generación se detiene y el
+        mensaje se reemplaza por el aviso correspondiente.
+        """
+        reply = StreamingReply(
+            turn_context,
+            min_interval=BotConfig.STREAM_UPDATE_INTERVAL,
+            min_chars=BotConfig.STREAM_MIN_CHUNK_CHARS,
+            moderate=lambda text: self._is_safe(text, "output"),
+            moderation_chars=BotConfig.STREAM_MODERATION_MIN_CHARS
+        )
+        chunks = chat_engine.stream_message_async(
+            user_message,
+            user_id=turn_context.activity.from_property.id
+        )
+        
+        try:
+            with self.tracer.span("activity.typing"):
+                await turn_context.send_activity(Activity(type=ActivityTypes.typing))
+            with self.tracer.span("reply.stream"):
+                await reply.stream(self._release_after_moderation(chunks, moderation))
+        except ContentBlockedError:
+            await turn_context.send_activity(BLOCKED_INPUT_RESPONSE)
+            return
+        finally:
+            moderation.cancel()
+        
+        if reply.blocked:
+            with self.tracer.span("activity.send"):
+                await reply.finish(UNSAFE_RESPONSE)
+    
+    @staticmethod
+    async def _release_after_moderation(
+        chunks: AsyncIterator[str],
+        moderation: "asyncio.Future[bool]"
+    ) -> AsyncIterator[str]:
+        """
+        Arranca la generación en paralelo con la moderación y retiene los
+        fragmentos hasta que esta se resuelva. Si el mensaje se bloquea,
+        la generación se cancela y se lanza ContentBlockedError.
+        """
+        first_chunk = asyncio.ensure_future(chunks.__anext__())
+        try:
+            await asyncio.wait({moderation, first_chunk}, return_when=asyncio.FIRST_COMPLETED)
+            if not await moderation:
+                raise ContentBlockedError("Mensaje de entrada bloqueado")
             
-            logger.info(f"Respuesta enviada a {user_name}")
+            try:
+                yield await first_chunk
+            except StopAsyncIteration:
+                return
             
-        except Exception as e:
-            logger.error(f"Error en on_message_activity: {e}", exc_info=True)
-            await turn_context.send_activity(
-                "Lo siento, ocurrió un error al procesar tu mensaje. "
-                "El equipo técnico ha sido notificado. Por favor, intenta de nuevo más tarde."
-            )
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            if not first_chunk.done():
+                first_chunk.cancel()
+                await asyncio.wait({first_chunk})
+            await chunks.aclose()
     
     async def on_members_added_activity(
         self, 
@@ -130,6 +303,8 @@ class TeamsAIFoundryBot(ActivityHandler):
         elif command == "/stats":
             chat_engine = self.conversation_manager.get_or_create_engine(conversation_id)
             stats = chat_engine.get_statistics()
+            user_id = turn_context.activity.from_property.id
+            stats["user_usage"] = get_usage_tracker().get_user(user_id)
             
             stats_card = AdaptiveCards.create_stats_card(stats)
             await turn_context.send_activity(MessageFactory.attachment(stats_card))
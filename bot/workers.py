@@ -0,0 +1,352 @@
+"""
+Modo multiproceso: supervisor de workers y afinidad de conversaciones
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from typing import Dict, List, Mapping, Optional
+
+import aiohttp
+from aiohttp import web
+
+from app.config import BotConfig
+
+logger = logging.getLogger(__name__)
+
+# Variable de entorno con el índice del worker (solo existe en los procesos hijos)
+WORKER_INDEX_ENV = "BOT_WORKER_INDEX"
+
+# Cabecera de las actividades reenviadas entre workers (evita reenvíos en cadena)
+FORWARDED_HEADER = "X-Bot-Forwarded-By"
+
+# Cabeceras de la actividad original que se conservan al reenviarla
+FORWARDED_REQUEST_HEADERS = ("Authorization", "Content-Type")
+
+
+def resolve_worker_count(workers: int) -> int:
+    """Número de workers efectivo (0 = uno por CPU disponible)"""
+    if workers > 0:
+        return workers
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+
+def worker_socket_dir(port: int) -> str:
+    """Directorio de los sockets internos de los workers"""
+    return BotConfig.WORKER_SOCKET_DIR or os.path.join(tempfile.gettempdir(), f"teams-bot-{port}")
+
+
+def worker_socket_path(directory: str, index: int) -> str:
+    """Socket Unix interno de un worker"""
+    return os.path.join(directory, f"worker-{index}.sock")
+
+
+def conversation_owner(conversation_id: str, workers: int) -> int:
+    """Worker dueño de una conversación (estable entre procesos y reinicios)"""
+    return zlib.crc32(conversation_id.encode("utf-8")) % workers
+
+
+def create_reuseport_socket(host: str, port: int, backlog: int = 128) -> socket.socket:
+    """
+    Socket de escucha compartido con los demás workers (SO_REUSEPORT)
+    
+    El kernel reparte las conexiones entrantes entre todos los procesos
+    que escuchan en el mismo puerto.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+class WorkerInfo:
+    """Identidad del worker actual y métricas de reenvío"""
+    
+    def __init__(self, index: int, count: int):
+        self.index = index
+        self.count = count
+        self.pid = os.getpid()
+        self.started_at = time.time()
+        self.forwarded = 0
+        self.forward_errors = 0
+    
+    @classmethod
+    def from_env(cls) -> Optional["WorkerInfo"]:
+        """Worker actual, o None si el bot corre en un solo proceso"""
+        index = os.getenv(WORKER_INDEX_ENV)
+        if index is None:
+            return None
+        return cls(int(index), resolve_worker_count(BotConfig.WORKERS))
+    
+    def get_statistics(self) -> Dict[str, float]:
+        """Métricas del worker"""
+        return {
+            "index": self.index,
+            "count": self.count,
+            "pid": self.pid,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "forwarded": self.forwarded,
+            "forward_errors": self.forward_errors
+        }
+
+
+class ConversationAffinity:
+    """
+    Envía cada conversación a un mismo worker.
+    
+    El kernel reparte las conexiones sin mirar el contenido, así que un
+    worker que recibe la actividad de una conversación ajena la reenvía al
+    worker dueño por su socket Unix interno. Así los turnos de una
+    conversación se serializan en un solo proceso y su sesión no se
+    duplica. Si no se puede conectar con el dueño (p. ej. se está
+    reiniciando), la actividad se atiende localmente; si falla una vez
+    entregada, se responde con error en lugar de atenderla dos veces.
+    """
+    
+    def __init__(self, worker: WorkerInfo, socket_dir: str, timeout: Optional[float] = None):
+        """
+        Inicializa la afinidad
+        
+        Args:
+            worker: Worker actual
+            socket_dir: Directorio de los sockets internos
+            timeout: Segundos máximos de un reenvío (por defecto BOT_SHUTDOWN_TIMEOUT_SECONDS,
+                el tiempo que se le da a un worker para terminar sus turnos)
+        """
+        self.worker = worker
+        self.socket_dir = socket_dir
+        self.timeout = timeout or BotConfig.SHUTDOWN_TIMEOUT
+        self._sessions: Dict[int, aiohttp.ClientSession] = {}
+    
+    def owner(self, conversation_id: str) -> int:
+        """Índice del worker dueño de la conversación"""
+        return conversation_owner(conversation_id, self.worker.count)
+    
+    def _session(self, index: int) -> aiohttp.ClientSession:
+        session = self._sessions.get(index)
+        if session is None or session.closed:
+            connector = aiohttp.UnixConnector(path=worker_socket_path(self.socket_dir, index))
+            session = self._sessions[index] = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=2),
+            )
+        return session
+    
+    async def forward(
+        self, index: int, body: bytes, headers: Mapping[str, str]
+    ) -> Optional[web.Response]:
+        """
+        Reenvía una actividad al worker indicado
+        
+        Returns:
+            Respuesta del worker dueño (502/504 si falló tras entregarla), o None
+            si no se pudo conectar con él
+        """
+        forwarded_headers = {
+            name: headers[name] for name in FORWARDED_REQUEST_HEADERS if name in headers
+        }
+        forwarded_headers[FORWARDED_HEADER] = str(self.worker.index)
+        try:
+            async with self._session(index).post(
+                "http://worker/api/messages", data=body, headers=forwarded_headers
+            ) as response:
+                payload = await response.read()
+                self.worker.forwarded += 1
+                return web.Response(
+                    body=payload or None,
+                    status=response.status,
+                    content_type=response.content_type if payload else None,
+                )
+        except aiohttp.ClientConnectorError as e:
+            # La actividad no llegó al dueño: se puede atender aquí sin duplicarla
+            self.worker.forward_errors += 1
+            logger.warning(
+                f"Worker {index} no disponible ({e}); se atiende la actividad localmente"
+            )
+            return None
+        except asyncio.TimeoutError:
+            self.worker.forward_errors += 1
+            logger.warning(f"Worker {index} no respondió en {self.timeout:.0f}s")
+            return web.Response(status=504)
+        except aiohttp.ClientError as e:
+            # El dueño pudo haber atendido la actividad: no se atiende otra vez
+            self.worker.forward_errors += 1
+            logger.warning(f"Error reenviando la actividad al worker {index}: {e}")
+            return web.Response(status=502)
+    
+    async def close(self) -> None:
+        """Cierra las conexiones con los demás workers"""
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+
+class WorkerSupervisor:
+    """
+    Proceso supervisor de los workers.
+    
+    Lanza N procesos del bot que escuchan en el mismo puerto (SO_REUSEPORT)
+    y los vuelve a lanzar si terminan inesperadamente. SIGTERM/SIGINT
+    detienen todos los workers dejando que terminen los turnos en curso;
+    SIGHUP los reinicia de a uno (el siguiente solo se reinicia cuando el
+    anterior ya está listo), sin dejar de atender solicitudes.
+    """
+    
+    # Un worker que termina antes de este tiempo se considera un fallo de arranque
+    MIN_UPTIME = 10.0
+    MAX_RESTART_DELAY = 30.0
+    
+    def __init__(
+        self, count: int, command: List[str], socket_dir: str, shutdown_timeout: float = 30
+    ):
+        """
+        Inicializa el supervisor
+        
+        Args:
+            count: Número de workers
+            command: Comando que inicia un worker
+            socket_dir: Directorio de los sockets internos
+            shutdown_timeout: Segundos que se espera a que un worker termine sus turnos
+        """
+        self.count = count
+        self.command = command
+        self.socket_dir = socket_dir
+        self.shutdown_timeout = shutdown_timeout
+        self._workers: Dict[int, subprocess.Popen] = {}
+        self._started: Dict[int, float] = {}
+        self._restart_delay: Dict[int, float] = {}
+        self._respawn_at: Dict[int, float] = {}
+        self._stopping = False
+        self._reload = False
+    
+    def _spawn(self, index: int) -> subprocess.Popen:
+        path = worker_socket_path(self.socket_dir, index)
+        if os.path.exists(path):
+            os.unlink(path)
+        env = dict(os.environ, **{WORKER_INDEX_ENV: str(index), "BOT_WORKERS": str(self.count)})
+        process = subprocess.Popen(self.command, env=env)
+        self._workers[index] = process
+        self._started[index] = time.monotonic()
+        logger.info(f"Worker {index} iniciado (pid {process.pid})")
+        return process
+    
+    def _wait_ready(self, index: int) -> bool:
+        """Espera a que el worker abra su socket interno"""
+        path = worker_socket_path(self.socket_dir, index)
+        deadline = time.monotonic() + self.shutdown_timeout
+        while time.monotonic() < deadline and not self._stopping:
+            if os.path.exists(path):
+                return True
+            if self._workers[index].poll() is not None:
+                return False
+            time.sleep(0.1)
+        return False
+    
+    def _stop_worker(self, index: int) -> None:
+        """Detiene un worker dejando que termine sus turnos (SIGTERM y luego SIGKILL)"""
+        process = self._workers[index]
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(self.shutdown_timeout + 5)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"Worker {index} no terminó a tiempo; se fuerza la salida")
+                process.kill()
+                process.wait()
+    
+    def _rolling_restart(self) -> None:
+        logger.info("Reinicio escalonado de workers")
+        for index in range(self.count):
+            if self._stopping:
+                return
+            self._stop_worker(index)
+            self._spawn(index)
+            if not self._wait_ready(index):
+                logger.error(f"Worker {index} no quedó listo tras el reinicio")
+    
+    def _reap(self) -> None:
+        """
+        Relanza los workers que terminaron inesperadamente (con espera
+        creciente si fallan al arrancar)
+        """
+        now = time.monotonic()
+        for index, process in list(self._workers.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            respawn_at = self._respawn_at.get(index)
+            if respawn_at is None:
+                delay = 0.0
+                if now - self._started[index] < self.MIN_UPTIME:
+                    previous = self._restart_delay.get(index, 0.0)
+                    delay = min(self.MAX_RESTART_DELAY, max(1.0, previous * 2))
+                self._restart_delay[index] = delay
+                respawn_at = self._respawn_at[index] = now + delay
+                logger.warning(
+                    f"Worker {index} terminó con código {code}; se reinicia en {delay:.0f}s"
+                )
+            if now >= respawn_at:
+                del self._respawn_at[index]
+                self._spawn(index)
+    
+    def _handle_stop(self, signum, frame) -> None:
+        self._stopping = True
+    
+    def _handle_reload(self, signum, frame) -> None:
+        self._reload = True
+    
+    def run(self) -> int:
+        """
+        Ejecuta el supervisor hasta recibir SIGTERM/SIGINT
+        
+        Returns:
+            Código de salida del proceso
+        """
+        os.makedirs(self.socket_dir, exist_ok=True)
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        
+        logger.info(f"Supervisor iniciado con {self.count} workers (pid {os.getpid()})")
+        for index in range(self.count):
+            self._spawn(index)
+        
+        while not self._stopping:
+            if self._reload:
+                self._reload = False
+                self._rolling_restart()
+            else:
+                self._reap()
+            time.sleep(0.2)
+        
+        logger.info("Deteniendo workers")
+        for process in self._workers.values():
+            if process.poll() is None:
+                process.terminate()
+        for index in self._workers:
+            self._stop_worker(index)
+        return 0
+
+
+def run_supervisor(command: Optional[List[str]] = None) -> int:
+    """Inicia el supervisor con la configuración del bot"""
+    supervisor = WorkerSupervisor(
+        count=resolve_worker_count(BotConfig.WORKERS),
+        command=command or [sys.executable] + sys.argv,
+        socket_dir=worker_socket_dir(BotConfig.PORT),
+        shutdown_timeout=BotConfig.SHUTDOWN_TIMEOUT,
+    )
+    return supervisor.run()
@@ -0,0 +1,37 @@
+"""
+Tests para la lectura rápida de actividades y JSON
+"""
+from botbuilder.schema import Activity
+
+from app import fastjson
+from benchmarks.activity_parsing import PAYLOADS
+from bot.activity import parse_activity
+
+
+class TestParseActivity:
+    """Tests para parse_activity"""
+    
+    def test_matches_msrest_deserializer(self):
+        """Test que el resultado es idéntico al de Activity().deserialize"""
+        for payload in PAYLOADS.values():
+            body = fastjson.loads(fastjson.dumps(payload))
+            assert parse_activity(body).serialize() == Activity().deserialize(body).serialize()
+    
+    def test_falls_back_for_unsupported_fields(self):
+        """Test que los campos fuera del camino rápido se deserializan con msrest"""
+        body = {
+            **PAYLOADS["personal_message"],
+            "suggestedActions": {"actions": [{"type": "imBack", "title": "Sí", "value": "sí"}]},
+        }
+        activity = parse_activity(body)
+        assert activity.suggested_actions.actions[0].title == "Sí"
+        assert activity.serialize() == Activity().deserialize(body).serialize()
+
+
+class TestFastJson:
+    """Tests para app.fastjson"""
+    
+    def test_round_trip_and_non_string_keys(self):
+        """Test que codifica UTF-8 compacto y admite claves no textuales"""
+        assert fastjson.loads(fastjson.dumps({"texto": "¿qué?"})) == {"texto": "¿qué?"}
+        assert fastjson.loads(fastjson.dumps({1: "uno"})) == {"1": "uno"}
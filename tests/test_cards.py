@@ -0,0 +1,34 @@
+"""
+Tests para las Adaptive Cards
+"""
+from app.config import AzureAIFoundryConfig
+from bot.cards import AdaptiveCards
+
+
+class TestAdaptiveCards:
+    """Tests para AdaptiveCards"""
+    
+    def test_static_cards_are_built_once_and_refreshed(self, monkeypatch):
+        """Test que las tarjetas estáticas se reutilizan hasta reconstruirlas"""
+        AdaptiveCards.refresh()
+        welcome = AdaptiveCards.create_welcome_card()
+        assert AdaptiveCards.create_welcome_card() is welcome
+        
+        monkeypatch.setattr(AzureAIFoundryConfig, "PROJECT_NAME", "proyecto-nuevo")
+        AdaptiveCards.refresh()
+        project = AdaptiveCards.create_project_info_card()
+        assert AdaptiveCards.create_welcome_card() is not welcome
+        assert project.content["body"][1]["facts"][0]["value"] == "proyecto-nuevo"
+        AdaptiveCards.refresh()
+    
+    def test_stats_card_fills_skeleton(self):
+        """Test que la tarjeta de estadísticas solo cambia los valores"""
+        first = AdaptiveCards.create_stats_card({"message_count": 4, "total_tokens_used": 12345})
+        second = AdaptiveCards.create_stats_card({"response_cache_hit_rate": 0.5})
+        
+        facts = {fact["title"]: fact["value"] for fact in first.content["body"][1]["facts"]}
+        assert facts["Mensajes:"] == "4"
+        assert facts["Tokens usados:"] == "12,345"
+        assert facts["Caché de respuestas:"] == "Deshabilitada"
+        assert second.content["body"][1]["facts"][5]["value"] == "50% de aciertos"
+        assert first.content["body"][0] is second.content["body"][0]
@@ -0,0 +1,96 @@
+"""
+Tests para el motor de chat
+"""
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage
+
+from app import chat_engine
+from app.chat_engine import AIFoundryChatEngine, get_shared_resources
+from app.memory import ConversationMemory
+from app.response_cache import ResponseCache
+from app.retrieval import Document
+
+
+class TestSharedChatResources:
+    """Tests para los recursos compartidos del motor de chat"""
+    
+    def test_engines_share_one_set_of_resources(self, monkeypatch):
+        """Test que LLM, prompt y cadena se construyen una sola vez para todos los motores"""
+        created = []
+        
+        class FakeResources:
+            def __init__(self):
+                created.append(self)
+                self.chain = object()
+        
+        monkeypatch.setattr(chat_engine, "SharedChatResources", FakeResources)
+        monkeypatch.setattr(chat_engine, "_shared", None)
+        
+        results = []
+        
+        def build():
+            results.append(get_shared_resources())
+        
+        threads = [threading.Thread(target=build) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        first, second = AIFoundryChatEngine("a"), AIFoundryChatEngine("b")
+        assert len(created) == 1
+        assert all(result is created[0] for result in results)
+        assert first.session is not second.session
+        assert not hasattr(first, "__dict__")
+
+
+class FakeRouter:
+    """Router que cuenta las llamadas"""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    async def ainvoke(self, key, inputs, prompt_tokens):
+        self.calls += 1
+        return AIMessage(content=f"respuesta {self.calls}")
+
+
+class FakeRetriever:
+    """Recuperador que devuelve los documentos configurados"""
+    
+    def __init__(self):
+        self.documents = []
+    
+    async def retrieve(self, query):
+        return list(self.documents)
+
+
+class TestResponseCacheWithRetrieval:
+    """Tests para la caché de respuestas con recuperación de contexto"""
+    
+    def test_cached_answer_requires_same_context(self, monkeypatch):
+        """Test que una respuesta cacheada no se sirve si cambiaron los documentos recuperados"""
+        router = FakeRouter()
+        retriever = FakeRetriever()
+        shared = SimpleNamespace(
+            router=router,
+            memory=ConversationMemory(),
+            response_cache=ResponseCache(max_entries=10, ttl=0),
+            retriever=retriever,
+        )
+        monkeypatch.setattr(chat_engine, "_shared", shared)
+        
+        def ask(conversation_id):
+            engine = AIFoundryChatEngine(conversation_id)
+            return asyncio.run(engine.send_message_async("¿Cuántos días de vacaciones tengo?"))
+        
+        retriever.documents = [Document("politica", "Vacaciones 2025: 22 días")]
+        assert ask("a") == "respuesta 1"
+        assert ask("b") == "respuesta 1"
+        
+        retriever.documents = [Document("politica", "Vacaciones 2026: 25 días")]
+        assert ask("c") == "respuesta 2"
+        assert router.calls == 2
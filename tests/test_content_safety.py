@@ -0,0 +1,73 @@
+"""
+Tests para la integración con Content Safety
+"""
+import asyncio
+from types import SimpleNamespace
+
+from app.config import AzureAIFoundryConfig
+from bot.content_safety import ContentSafetyBatcher, ContentSafetyManager
+
+
+class FakeContentSafetyClient:
+    """Cliente asíncrono que cuenta los análisis y puede fallar"""
+    
+    def __init__(self, severity: int = 0, fail: bool = False):
+        self.severity = severity
+        self.fail = fail
+        self.texts = []
+    
+    async def analyze_text(self, options):
+        self.texts.append(options.text)
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("servicio no disponible")
+        return SimpleNamespace(categories_analysis=[
+            SimpleNamespace(category="Hate", severity=self.severity),
+            SimpleNamespace(category="Violence", severity=0),
+        ])
+
+
+def _manager(monkeypatch, client) -> ContentSafetyManager:
+    monkeypatch.setattr(AzureAIFoundryConfig, "ENABLE_CONTENT_SAFETY", True)
+    monkeypatch.setattr(AzureAIFoundryConfig, "CONTENT_SAFETY_ENDPOINT", "")
+    manager = ContentSafetyManager(prefilters=[])
+    manager.client = client
+    manager.batcher = ContentSafetyBatcher(manager._analyze_remote, window=0.01, max_concurrency=4)
+    return manager
+
+
+class TestContentSafetyManager:
+    """Tests para ContentSafetyManager y ContentSafetyBatcher"""
+    
+    def test_batches_duplicates_and_caches(self, monkeypatch):
+        """Test que los textos idénticos de una ventana comparten una llamada y luego se cachean"""
+        client = FakeContentSafetyClient(severity=4)
+        manager = _manager(monkeypatch, client)
+        
+        async def run():
+            first = await asyncio.gather(
+                manager.is_content_safe("texto a"),
+                manager.is_content_safe("texto a"),
+                manager.is_content_safe("texto b"),
+            )
+            again = await manager.analyze_text("texto a")
+            return first, again
+        
+        first, again = asyncio.run(run())
+        
+        assert first == [False, False, False]
+        assert sorted(client.texts) == ["texto a", "texto b"]
+        assert manager.batcher.batches == 1 and manager.batcher.coalesced == 1
+        assert again["categories"] == {"hate": 4, "violence": 0}
+        assert manager.cache.get_stats()["hits"] == 1
+    
+    def test_fails_open_when_service_raises(self, monkeypatch):
+        """Test que un error del servicio no bloquea el mensaje ni se guarda en caché"""
+        client = FakeContentSafetyClient(fail=True)
+        manager = _manager(monkeypatch, client)
+        
+        result = asyncio.run(manager.analyze_text("hola"))
+        
+        assert result["is_safe"] is True
+        assert "Error" in result["message"]
+        assert len(manager.cache) == 0
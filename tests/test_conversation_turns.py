@@ -0,0 +1,115 @@
+"""
+Tests para la serialización de turnos por conversación
+"""
+import asyncio
+
+from bot.conversation_manager import ConversationTurns
+
+
+async def _handle(turns, conversation_id, message, log, delay=0.01):
+    """Simula un turno: registra inicio y fin del procesamiento"""
+    async with turns.turn(conversation_id, message) as batch:
+        if batch is None:
+            return None
+        log.append(("start", batch.text))
+        await asyncio.sleep(delay)
+        log.append(("end", batch.text))
+        return batch.text
+
+
+class TestConversationTurns:
+    """Tests para ConversationTurns"""
+    
+    def test_same_conversation_is_serialized(self):
+        """Test que los turnos de una conversación no se intercalan"""
+        turns = ConversationTurns()
+        log = []
+        
+        async def main():
+            await asyncio.gather(
+                _handle(turns, "c1", "uno", log),
+                _handle(turns, "c1", "dos", log),
+            )
+        
+        asyncio.run(main())
+        assert log == [("start", "uno"), ("end", "uno"), ("start", "dos"), ("end", "dos")]
+        assert turns.get_statistics()["active_conversations"] == 0
+    
+    def test_different_conversations_run_in_parallel(self):
+        """Test que conversaciones distintas no se esperan entre sí"""
+        turns = ConversationTurns()
+        log = []
+        
+        async def main():
+            await asyncio.gather(
+                _handle(turns, "c1", "a", log),
+                _handle(turns, "c2", "b", log),
+            )
+        
+        asyncio.run(main())
+        assert [event for event, _ in log[:2]] == ["start", "start"]
+        assert turns.waited == 0
+    
+    def test_rapid_messages_are_coalesced(self):
+        """Test que los mensajes recibidos durante un turno se agrupan en el siguiente"""
+        turns = ConversationTurns(coalesce=True, max_batch=5)
+        log = []
+        
+        async def main():
+            return await asyncio.gather(
+                _handle(turns, "c1", "hola", log),
+                _handle(turns, "c1", "tengo una duda", log),
+                _handle(turns, "c1", "sobre vacaciones", log),
+            )
+        
+        results = asyncio.run(main())
+        assert results == ["hola", "tengo una duda\n\nsobre vacaciones", None]
+        assert turns.coalesced == 1
+    
+    def test_failed_turn_hands_off_coalesced_messages(self):
+        """Test que si el turno falla, los mensajes agrupados se atienden en otro turno"""
+        turns = ConversationTurns(coalesce=True, max_batch=5)
+        log = []
+        
+        async def failing(message):
+            async with turns.turn("c1", message) as batch:
+                await asyncio.sleep(0.02)
+                raise RuntimeError(batch.text)
+        
+        async def main():
+            first = asyncio.ensure_future(_handle(turns, "c1", "hola", log, delay=0.05))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(failing("tengo una duda"))
+            await asyncio.sleep(0)
+            rest = [
+                asyncio.ensure_future(_handle(turns, "c1", text, log))
+                for text in ("sobre vacaciones", "y permisos")
+            ]
+            return await asyncio.gather(first, second, *rest, return_exceptions=True)
+        
+        results = asyncio.run(main())
+        assert results[0] == "hola"
+        assert isinstance(results[1], RuntimeError)
+        assert results[2:] == ["sobre vacaciones\n\ny permisos", None]
+        assert turns.handed_off == 1
+        assert turns.get_statistics()["active_conversations"] == 0
+    
+    def test_cancelled_turn_hands_off_coalesced_messages(self):
+        """Test que cancelar el turno en espera no pierde los mensajes agrupados"""
+        turns = ConversationTurns(coalesce=True, max_batch=5)
+        log = []
+        
+        async def main():
+            first = asyncio.ensure_future(_handle(turns, "c1", "hola", log, delay=0.05))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(_handle(turns, "c1", "tengo una duda", log))
+            await asyncio.sleep(0)
+            third = asyncio.ensure_future(_handle(turns, "c1", "sobre vacaciones", log))
+            await asyncio.sleep(0)
+            second.cancel()
+            return await asyncio.gather(first, second, third, return_exceptions=True)
+        
+        results = asyncio.run(main())
+        assert isinstance(results[1], asyncio.CancelledError)
+        assert results[2] == "sobre vacaciones"
+        assert ("start", "sobre vacaciones") in log
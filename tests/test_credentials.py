@@ -0,0 +1,66 @@
+"""
+Tests para el proveedor compartido de credenciales de Azure
+"""
+import asyncio
+from collections import namedtuple
+
+from app.credentials import TokenProvider
+
+AccessToken = namedtuple("AccessToken", ["token", "expires_on"])
+
+
+class FakeCredential:
+    """Credencial que emite tokens de una hora y cuenta las solicitudes"""
+    
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = 0
+    
+    def get_token(self, *scopes, **kwargs):
+        self.calls += 1
+        return AccessToken(f"token-{self.calls}", self.clock() + 3600)
+
+
+class TestTokenProvider:
+    """Tests para TokenProvider"""
+    
+    def make_provider(self):
+        now = [1_000_000.0]
+        clock = lambda: now[0]
+        credentials = []
+        
+        def factory():
+            credentials.append(FakeCredential(clock))
+            return credentials[-1]
+        
+        provider = TokenProvider(credential_factory=factory, refresh_margin=300, clock=clock)
+        return provider, now, credentials
+    
+    def test_token_is_cached_until_margin(self):
+        """Test que una sola credencial sirve los tokens desde caché hasta el margen de expiración"""
+        provider, now, credentials = self.make_provider()
+        scope = "https://cognitiveservices.azure.com/.default"
+        
+        first = provider.get_token(scope)
+        now[0] += 3000
+        assert provider.get_token(scope) is first
+        assert asyncio.run(provider.async_credential().get_token(scope)) is first
+        
+        now[0] += 400
+        assert provider.get_token(scope).token == "token-2"
+        assert len(credentials) == 1
+        assert provider.stats["hits"] == 2
+        assert provider.stats["fetches"] == 2
+    
+    def test_refresh_due_fetches_ahead_of_expiry(self):
+        """Test que la renovación obtiene los scopes registrados y los reemplaza antes de que caduquen"""
+        provider, now, credentials = self.make_provider()
+        provider.register("scope-a")
+        
+        assert provider.refresh_due() == 1
+        assert provider.refresh_due() == 0
+        
+        now[0] += 3000
+        assert provider.refresh_due() == 1
+        assert provider.get_token("scope-a").token == "token-2"
+        assert credentials[0].calls == 2
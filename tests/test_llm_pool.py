@@ -0,0 +1,44 @@
+"""
+Tests para el registro compartido de clientes LLM
+"""
+import asyncio
+
+from app.llm_pool import LLMClientPool
+
+ENDPOINT = "https://example.openai.azure.com/"
+API_VERSION = "2024-06-01"
+
+
+class TestLLMClientPool:
+    """Tests para LLMClientPool"""
+    
+    def test_one_client_per_deployment(self):
+        """Test que el mismo endpoint/deployment/versión retorna un único cliente"""
+        pool = LLMClientPool(max_connections=10)
+        
+        first = pool.get(endpoint=ENDPOINT, deployment="gpt", api_version=API_VERSION, api_key="k")
+        again = pool.get(endpoint=ENDPOINT, deployment="gpt", api_version=API_VERSION, api_key="k")
+        other = pool.get(endpoint=ENDPOINT, deployment="mini", api_version=API_VERSION, api_key="k")
+        
+        assert first is again
+        assert other is not first
+        assert pool.size() == 2
+        assert first.http_async_client is not other.http_async_client
+        
+        asyncio.run(pool.aclose())
+        assert pool.size() == 0
+    
+    def test_router_client_has_no_sdk_retries(self):
+        """Test que solo el cliente del router desactiva los reintentos del SDK"""
+        pool = LLMClientPool()
+        
+        shared = pool.get(endpoint=ENDPOINT, deployment="gpt", api_version=API_VERSION, api_key="k")
+        routed = pool.get(
+            endpoint=ENDPOINT, deployment="gpt", api_version=API_VERSION, api_key="k",
+            managed_retries=True
+        )
+        
+        assert routed is not shared
+        assert shared.max_retries > 0 and routed.max_retries == 0
+        assert routed.http_async_client is shared.http_async_client
+        asyncio.run(pool.aclose())
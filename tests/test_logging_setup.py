@@ -0,0 +1,47 @@
+"""
+Tests para la configuración de logs
+"""
+import json
+import logging
+
+from app.logging_setup import JsonFormatter, SamplingFilter
+
+
+def _record(name: str, msg: str, *args, level: int = logging.INFO, **extra) -> logging.LogRecord:
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestSamplingFilter:
+    """Tests para SamplingFilter"""
+    
+    def test_keeps_one_of_n_per_line(self):
+        """Test que se conserva 1 de cada N apariciones de cada línea y nunca las advertencias"""
+        sampling = SamplingFilter({"app.chat_engine": 0.25})
+        
+        kept = [
+            sampling.filter(_record("app.chat_engine", "[%s] Procesando mensaje", f"c{i}"))
+            for i in range(8)
+        ]
+        assert kept == [True, False, False, False, True, False, False, False]
+        # Otra línea del mismo logger lleva su propio contador
+        assert sampling.filter(_record("app.chat_engine", "Inicializado"))
+        assert all(sampling.filter(_record("app.chat_engine", "Fallo", level=logging.WARNING)) for _ in range(3))
+        assert all(sampling.filter(_record("bot.teams_bot", "Mensaje")) for _ in range(3))
+        assert sampling.dropped == 6
+
+
+class TestJsonFormatter:
+    """Tests para JsonFormatter"""
+    
+    def test_formats_message_and_extra_fields(self):
+        """Test que cada registro es un objeto JSON con el mensaje formateado y los campos extra"""
+        record = _record("bot.teams_bot", "Mensaje de %s: %.5s...", "Ana", "hola mundo", conversation_id="a:1")
+        
+        data = json.loads(JsonFormatter().format(record))
+        assert data["message"] == "Mensaje de Ana: hola ..."
+        assert data["level"] == "INFO"
+        assert data["logger"] == "bot.teams_bot"
+        assert data["conversation_id"] == "a:1"
+        assert data["timestamp"].endswith("+00:00")
@@ -0,0 +1,168 @@
+"""
+Tests para la memoria de conversación con resumen
+"""
+import asyncio
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage
+
+from app.memory import SUMMARY_HEADER, RollingSummaryMemory, SummaryState
+from app.session import ChatSession
+from app.tokens import count_message_tokens
+from app.usage import get_usage_tracker
+
+
+class FakeSummaryChain:
+    """Cadena de resumen que registra cada lote y puede fallar o esperar"""
+    
+    def __init__(self, fail_first: bool = False):
+        self.batches = []
+        self.fail_first = fail_first
+        self.release = None
+    
+    def _summarize(self, inputs):
+        if self.fail_first:
+            self.fail_first = False
+            raise RuntimeError("servicio no disponible")
+        self.batches.append(inputs["new_lines"])
+        return AIMessage(content=f"resumen {len(self.batches)}")
+    
+    def invoke(self, inputs):
+        return self._summarize(inputs)
+    
+    async def ainvoke(self, inputs):
+        if self.release is not None:
+            await self.release.wait()
+        return self._summarize(inputs)
+
+
+class FakeRouter:
+    """Router que delega los resúmenes en la cadena falsa y registra las llamadas"""
+    
+    def __init__(self, chain):
+        self.chain = chain
+        self.calls = []
+        self.primary = SimpleNamespace(
+            deployment="primary", chain_for=lambda prompt, max_tokens: chain
+        )
+    
+    async def ainvoke(self, key, inputs, prompt_tokens, prompt=None, max_tokens=None):
+        self.calls.append((key, prompt_tokens, max_tokens))
+        result = await self.chain.ainvoke(inputs)
+        result.response_metadata["deployment"] = "backend-1"
+        return result
+
+
+def _memory(chain, max_turns: int = 2, token_budget: int = 10000) -> RollingSummaryMemory:
+    return RollingSummaryMemory(
+        FakeRouter(chain), max_turns, token_budget, summary_max_tokens=100
+    )
+
+
+def _add_turns(memory, session, start: int, count: int) -> None:
+    for i in range(start, start + count):
+        session.add_turn(f"pregunta {i}", f"respuesta {i}")
+        memory.after_turn(session)
+
+
+class TestRollingSummaryMemory:
+    """Tests para RollingSummaryMemory"""
+    
+    def test_window_and_summary_within_budget(self):
+        """Test que la ventana respeta turnos y tokens, y el resto pasa al resumen"""
+        chain = FakeSummaryChain()
+        memory = _memory(chain, max_turns=3, token_budget=20)
+        session = ChatSession("c")
+        
+        _add_turns(memory, session, 0, 5)
+        
+        history = memory.build_history(session)
+        assert session.history_tokens <= 20 or len(session.history) == 2
+        assert session.history_tokens == count_message_tokens(session.history)
+        assert history[0] == ("system", f"{SUMMARY_HEADER}\nresumen {len(chain.batches)}")
+        assert history[1:] == session.history
+        # Estimación sin retokenizar: difiere a lo sumo en la unión de encabezado y resumen
+        assert abs(memory.history_tokens(session) - count_message_tokens(history)) <= 2
+        assert "pregunta 0" in chain.batches[0]
+    
+    def test_tokens_saved_counted_only_when_recorded(self):
+        """Test que armar el historial no suma ahorro: solo se suma tras una llamada exitosa"""
+        memory = _memory(FakeSummaryChain(), max_turns=1)
+        session = ChatSession("c")
+        _add_turns(memory, session, 0, 4)
+        
+        memory.build_history(session)
+        memory.build_history(session)
+        assert memory.get_statistics(session)["tokens_saved"] == 0
+        
+        saved = memory.tokens_saved(session)
+        assert saved > 0
+        memory.add_tokens_saved(session, saved)
+        assert memory.get_statistics(session)["tokens_saved"] == saved
+    
+    def test_background_fold_keeps_turns_that_arrive_meanwhile(self):
+        """Test que el resumen solo descarta el lote que resumió y se reintenta tras un fallo"""
+        chain = FakeSummaryChain(fail_first=True)
+        memory = _memory(chain, max_turns=1)
+        session = ChatSession("c")
+        
+        async def run():
+            _add_turns(memory, session, 0, 2)
+            state = session.memory_state
+            await state.task
+            # El fallo deja el turno pendiente y se sigue enviando literal
+            assert state.pending == [("human", "pregunta 0"), ("ai", "respuesta 0")]
+            assert memory.build_history(session)[:2] == state.pending
+            
+            chain.release = asyncio.Event()
+            _add_turns(memory, session, 2, 1)
+            await asyncio.sleep(0)
+            # Llega otro turno mientras el primer lote se está resumiendo
+            _add_turns(memory, session, 3, 1)
+            assert len(state.pending) == 6
+            chain.release.set()
+            await state.task
+            return state
+        
+        state = asyncio.run(run())
+        
+        assert state.pending == []
+        assert len(chain.batches) == 2
+        assert "pregunta 0" in chain.batches[0] and "pregunta 1" in chain.batches[0]
+        assert "pregunta 2" in chain.batches[1] and "pregunta 0" not in chain.batches[1]
+        assert state.summary == "resumen 2"
+    
+    def test_state_survives_serialization(self):
+        """Test que el estado del resumen se restaura desde el almacén de sesiones"""
+        memory = _memory(FakeSummaryChain(), max_turns=1)
+        session = ChatSession("c")
+        _add_turns(memory, session, 0, 3)
+        session.memory_state.pending.append(("human", "pendiente"))
+        
+        restored = ChatSession.from_dict(session.to_dict())
+        state = RollingSummaryMemory._state(restored)
+        
+        assert isinstance(state, SummaryState)
+        assert state.to_dict() == session.memory_state.to_dict()
+        assert memory.build_history(restored) == memory.build_history(session)
+        assert restored.history_tokens == session.history_tokens
+    
+    def test_summary_goes_through_router_and_counts_usage(self):
+        """Test que los resúmenes pasan por el router y su uso se suma a la conversación"""
+        chain = FakeSummaryChain()
+        memory = _memory(chain, max_turns=1)
+        session = ChatSession("resumen-uso")
+        
+        async def run():
+            _add_turns(memory, session, 0, 2)
+            await session.memory_state.task
+        
+        asyncio.run(run())
+        
+        key, prompt_tokens, max_tokens = memory.router.calls[0]
+        assert (key, max_tokens) == ("resumen-uso", 100)
+        assert prompt_tokens > 0
+        assert session.total_calls == 1
+        usage = get_usage_tracker().get_conversation("resumen-uso")
+        assert usage["calls"] == 1
+        assert session.total_tokens_used == usage["prompt_tokens"] + usage["completion_tokens"]
@@ -0,0 +1,59 @@
+"""
+Tests para las métricas en formato de Prometheus
+"""
+import pytest
+
+from app.metrics import MetricsRegistry, _Metric
+
+
+class TestMetricsRegistry:
+    """Tests para MetricsRegistry"""
+    
+    def test_histogram_renders_cumulative_buckets(self):
+        """Test que el histograma expone conteos acumulados, suma y total por etiqueta"""
+        registry = MetricsRegistry()
+        latency = registry.histogram("turn_seconds", "Duración", ("kind",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            latency.observe(value, "message")
+        
+        lines = registry.render().splitlines()
+        assert lines[:2] == ["# HELP turn_seconds Duración", "# TYPE turn_seconds histogram"]
+        assert lines[2:] == [
+            'turn_seconds_bucket{kind="message",le="0.1"} 1',
+            'turn_seconds_bucket{kind="message",le="1"} 3',
+            'turn_seconds_bucket{kind="message",le="+Inf"} 4',
+            'turn_seconds_sum{kind="message"} 4.25',
+            'turn_seconds_count{kind="message"} 4',
+        ]
+    
+    def test_counters_and_collected_values(self):
+        """Test que contadores y métricas calculadas se exponen con sus etiquetas"""
+        registry = MetricsRegistry()
+        errors = registry.counter("errors_total", "Errores", ("backend", "error"))
+        errors.inc("primary", "429")
+        errors.inc("primary", "429", amount=2)
+        assert registry.counter("errors_total", "Errores", ("backend", "error")) is errors
+        
+        sessions = {"active": 3}
+        registry.collect("active_sessions", "Sesiones", lambda: sessions["active"])
+        registry.collect(
+            "cache_total", "Caché", lambda: {("hit",): 5, ("miss",): 1}, ("result",),
+            kind="counter"
+        )
+        registry.collect("broken", "Falla al leer", lambda: 1 / 0)
+        sessions["active"] = 4
+        
+        text = registry.render()
+        assert 'errors_total{backend="primary",error="429"} 3' in text
+        assert "active_sessions 4" in text
+        assert "# TYPE cache_total counter" in text
+        assert 'cache_total{result="miss"} 1' in text
+        assert "broken" not in text
+    
+    def test_metric_without_render_fails_on_creation(self):
+        """Test que una métrica sin render falla al crearse y no al exponer /metrics"""
+        class Incomplete(_Metric):
+            kind = "gauge"
+        
+        with pytest.raises(TypeError):
+            Incomplete("incompleta", "Métrica sin render")
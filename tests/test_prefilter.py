@@ -0,0 +1,39 @@
+"""
+Tests para el pre-filtro local de moderación
+"""
+from bot.prefilter import LocalModerationFilter, normalize_text
+
+
+class TestLocalModerationFilter:
+    """Tests para LocalModerationFilter"""
+    
+    def test_normalize_text(self):
+        """Test normalización de acentos, mayúsculas y puntuación"""
+        assert normalize_text("  ¡Buenos   DÍAS!  ") == "buenos dias"
+    
+    def test_allowlist_is_safe(self):
+        """Test que los mensajes cortos permitidos no se escalan"""
+        prefilter = LocalModerationFilter(allowlist=["hola", "muchas gracias"])
+        assert prefilter.classify("¡Hola!") is True
+        assert prefilter.classify("Muchas gracias.") is True
+        assert prefilter.get_statistics()["calls_avoided"] == 2
+    
+    def test_blocklist_is_unsafe(self):
+        """Test términos y expresiones regulares bloqueadas"""
+        prefilter = LocalModerationFilter(blocklist=["palabra prohibida", r"re:\bclave\d+\b"])
+        assert prefilter.classify("Esto tiene una Palabra Prohibida") is False
+        assert prefilter.classify("mi clave123 es esta") is False
+        assert prefilter.classify("palabras prohibidas sueltas") is None
+    
+    def test_invalid_pattern_is_skipped(self):
+        """Test que una expresión regular inválida se omite sin descartar el resto"""
+        prefilter = LocalModerationFilter(blocklist=["re:clave(", r"re:secreto\d", "prohibido"])
+        assert prefilter.classify("mi secreto1") is False
+        assert prefilter.classify("algo prohibido") is False
+        assert prefilter.classify("mi clave(") is None
+    
+    def test_ambiguous_text_is_escalated(self):
+        """Test que el texto ambiguo se escala al servicio remoto"""
+        prefilter = LocalModerationFilter(blocklist=["prohibido"], allowlist=["hola"])
+        assert prefilter.classify("hola, ¿cómo reinicio mi contraseña?") is None
+        assert prefilter.get_statistics()["escalated"] == 1
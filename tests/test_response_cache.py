@@ -0,0 +1,98 @@
+"""
+Tests para la caché de respuestas
+"""
+import asyncio
+
+from app.config import AzureAIFoundryConfig
+from app.response_cache import ResponseCache, VectorIndex, normalize_prompt
+
+
+class FakeEmbeddings:
+    """Embeddings deterministas: agrupa las preguntas por tema"""
+    
+    async def aembed_query(self, text):
+        return [1.0, 0.1] if "vacaciones" in text else [0.0, 1.0]
+
+
+class TestResponseCache:
+    """Tests para ResponseCache y VectorIndex"""
+    
+    def test_normalize_prompt(self):
+        """Test que la normalización ignora mayúsculas, espacios y signos finales"""
+        assert normalize_prompt("  ¿Qué   hora es?  ") == "qué hora es"
+    
+    def test_exact_hit(self):
+        """Test acierto exacto sin embeddings"""
+        cache = ResponseCache(max_entries=10, ttl=0)
+        lookup = asyncio.run(cache.lookup("¿Qué es Teams?"))
+        assert lookup.response is None
+        cache.store(lookup, "Una aplicación de colaboración")
+        
+        hit = asyncio.run(cache.lookup("qué es teams"))
+        assert hit.response == "Una aplicación de colaboración"
+        assert cache.get_statistics()["exact_hits"] == 1
+    
+    def test_follow_up_depends_on_history(self):
+        """Test que una repregunta no recibe la respuesta dada en otra conversación"""
+        cache = ResponseCache(max_entries=10, ttl=0, scope="all", embeddings=FakeEmbeddings())
+        laptop = [("human", "¿Qué laptop me recomiendas?"), ("ai", "La modelo X")]
+        vacations = [("human", "¿Cuántos días de vacaciones tengo?"), ("ai", "22 días")]
+        cache.store(asyncio.run(cache.lookup("¿Y eso cuánto cuesta?", laptop)), "1200 USD")
+        
+        assert asyncio.run(cache.lookup("¿y eso cuánto cuesta?", laptop)).response == "1200 USD"
+        assert asyncio.run(cache.lookup("¿y eso cuánto cuesta?", vacations)).response is None
+        assert asyncio.run(cache.lookup("¿y eso cuánto cuesta?")).response is None
+    
+    def test_answer_depends_on_retrieved_context(self):
+        """Test que una respuesta basada en documentos no se reutiliza con otro contexto"""
+        cache = ResponseCache(max_entries=10, ttl=0, embeddings=FakeEmbeddings())
+        policy_2025 = [("system", "Política de vacaciones 2025: 22 días")]
+        policy_2026 = [("system", "Política de vacaciones 2026: 25 días")]
+        
+        def lookup(message, context):
+            return asyncio.run(cache.lookup(message, (), context))
+        
+        cache.store(lookup("¿Cuántos días de vacaciones tengo?", policy_2025), "22 días")
+        
+        assert lookup("cuántos días de vacaciones tengo", policy_2025).response == "22 días"
+        assert lookup("cuántos días de vacaciones tengo", policy_2026).response is None
+        # El nivel semántico no se usa con contexto recuperado
+        assert lookup("mis vacaciones", policy_2025).response is None
+    
+    def test_key_depends_on_routed_deployments(self, monkeypatch):
+        """Test que la respuesta de un conjunto de deployments no se sirve para otro"""
+        primary = ResponseCache(max_entries=10, ttl=0)
+        monkeypatch.setattr(
+            AzureAIFoundryConfig, "OPENAI_BACKENDS",
+            '[{"endpoint": "https://otro.openai.azure.com", "deployment": "gpt-4o-mini"}]'
+        )
+        routed = ResponseCache(max_entries=10, ttl=0)
+        
+        assert asyncio.run(primary.lookup("hola")).key != asyncio.run(routed.lookup("hola")).key
+    
+    def test_semantic_hit(self):
+        """Test acierto por similitud y fallo por debajo del umbral"""
+        cache = ResponseCache(
+            max_entries=10, ttl=0, embeddings=FakeEmbeddings(), min_similarity=0.9
+        )
+        cache.store(asyncio.run(cache.lookup("¿Cuántos días de vacaciones tengo?")), "22 días")
+        
+        assert asyncio.run(cache.lookup("mis vacaciones")).response == "22 días"
+        assert asyncio.run(cache.lookup("otra pregunta")).response is None
+        assert cache.semantic_hits == 1
+    
+    def test_vector_index_evicts_least_used(self):
+        """Test que el índice lleno reemplaza la entrada menos usada"""
+        now = [0.0]
+        index = VectorIndex(capacity=2, clock=lambda: now[0])
+        index.add([1.0, 0.0], "a")
+        now[0] = 1
+        index.add([0.0, 1.0], "b")
+        now[0] = 2
+        assert index.search([1.0, 0.0], 0.9) == "a"
+        now[0] = 3
+        index.add([1.0, 1.0], "c")
+        
+        assert index.search([0.0, 1.0], 0.99) is None
+        assert index.search([1.0, 0.0], 0.99) == "a"
+        assert len(index) == 2
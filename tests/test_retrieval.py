@@ -0,0 +1,83 @@
+"""
+Tests para la recuperación de contexto (RAG)
+"""
+import asyncio
+
+from app.retrieval import Document, InMemoryIndex, Retriever, format_context
+
+
+class FakeBackend:
+    """Índice que cuenta las búsquedas y puede fallar"""
+    
+    name = "fake"
+    
+    def __init__(self, documents, fail: bool = False):
+        self.documents = documents
+        self.fail = fail
+        self.calls = 0
+    
+    async def search(self, query, top):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("servicio no disponible")
+        return self.documents[:top]
+    
+    async def close(self):
+        pass
+
+
+class TestInMemoryIndex:
+    """Tests para InMemoryIndex"""
+    
+    def test_ranks_relevant_document_first(self):
+        """Test que el documento relevante queda primero, sin importar acentos ni mayúsculas"""
+        index = InMemoryIndex([
+            Document("1", "El horario de la cafetería es de 8 a 17 horas."),
+            Document("2", "Las vacaciones se solicitan en el portal con dos semanas de anticipación.", "Política de vacaciones"),
+            Document("3", "El estacionamiento está en el subsuelo del edificio."),
+        ])
+        
+        results = asyncio.run(index.search("¿Cómo SOLICITO mis vacaciónes?", top=2))
+        
+        assert [document.id for document in results] == ["2"]
+        assert results[0].score > 0
+
+
+class TestRetriever:
+    """Tests para Retriever"""
+    
+    def test_caches_coalesces_and_trims(self):
+        """Test que las consultas idénticas comparten una búsqueda y el contexto respeta el presupuesto"""
+        backend = FakeBackend([
+            Document("1", "corto " * 20, "Uno", score=3.0),
+            Document("2", "largo " * 400, "Dos", score=2.0),
+            Document("3", "breve " * 20, "Tres", score=1.0),
+        ])
+        retriever = Retriever(backend, top_k=3, token_budget=200)
+        
+        async def run():
+            first = await asyncio.gather(*(retriever.retrieve("Vacaciones  pendientes") for _ in range(5)))
+            second = await retriever.retrieve("vacaciones pendientes")
+            return first, second
+        
+        first, second = asyncio.run(run())
+        
+        assert backend.calls == 1
+        assert retriever.stats["coalesced"] == 4
+        # El documento largo no cabe, pero sí el siguiente
+        assert [document.id for document in second] == ["1", "3"]
+        assert all(result == second for result in first)
+        context = format_context(second)
+        assert context[0][0] == "system" and "[2] Tres" in context[0][1]
+    
+    def test_backend_error_returns_no_context(self):
+        """Test que un error del índice no interrumpe el turno ni se guarda en caché"""
+        backend = FakeBackend([Document("1", "texto")], fail=True)
+        retriever = Retriever(backend)
+        
+        assert asyncio.run(retriever.retrieve("consulta")) == []
+        assert asyncio.run(retriever.retrieve("consulta")) == []
+        assert backend.calls == 2
+        assert retriever.stats["errors"] == 2
+        assert format_context([]) == []
@@ -0,0 +1,88 @@
+"""
+Tests para la política de reintentos de llamadas al modelo
+"""
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+from app.retry import RetryPolicy, parse_remaining_quota, parse_retry_after
+
+
+def _status_error(status: int, headers: dict) -> openai.APIStatusError:
+    """Crea el error que lanza el SDK de OpenAI para una respuesta HTTP"""
+    request = httpx.Request("POST", "https://example.openai.azure.com/")
+    response = httpx.Response(status, headers=headers, request=request)
+    error_class = openai.RateLimitError if status == 429 else openai.InternalServerError
+    return error_class("error", response=response, body=None)
+
+
+class TestRetryPolicy:
+    """Tests para RetryPolicy y el análisis de encabezados"""
+    
+    def test_parse_headers(self):
+        """Test de Retry-After (ms, segundos) y cuota restante"""
+        assert parse_retry_after({"retry-after-ms": "250", "retry-after": "1"}) == 0.25
+        assert parse_retry_after({"retry-after": "3"}) == 3
+        assert parse_retry_after({}) is None
+        assert parse_remaining_quota({
+            "x-ratelimit-remaining-requests": "7",
+            "x-ratelimit-remaining-tokens": "1200"
+        }) == (7, 1200)
+    
+    def test_retries_rate_limit(self):
+        """Test que un 429 se reintenta tras el Retry-After"""
+        policy = RetryPolicy(budget=5, base_delay=0.001)
+        attempts = []
+        
+        async def call():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise _status_error(429, {"retry-after-ms": "10"})
+            return "ok"
+        
+        assert asyncio.run(policy.call(call)) == "ok"
+        assert len(attempts) == 2
+        assert policy.rate_limited == 1 and policy.retries == 1
+    
+    def test_retry_after_beyond_budget_is_not_retried(self):
+        """Test que no se espera más allá del presupuesto de la solicitud"""
+        policy = RetryPolicy(budget=1, base_delay=0.001)
+        
+        async def call():
+            raise _status_error(429, {"retry-after": "30"})
+        
+        with pytest.raises(openai.RateLimitError):
+            asyncio.run(policy.call(call))
+        assert policy.retries == 0 and policy.exhausted == 1
+    
+    def test_non_retryable_error(self):
+        """Test que los errores de cliente no se reintentan"""
+        policy = RetryPolicy(budget=5, base_delay=0.001)
+        attempts = []
+        
+        async def call():
+            attempts.append(1)
+            raise ValueError("entrada inválida")
+        
+        with pytest.raises(ValueError):
+            asyncio.run(policy.call(call))
+        assert len(attempts) == 1
+    
+    def test_attempts_are_bounded_by_budget(self):
+        """Test que un intento colgado se corta, se reintenta y el total no supera el presupuesto"""
+        policy = RetryPolicy(budget=0.3, base_delay=0.001, attempt_timeout=0.1)
+        attempts = []
+        
+        async def call():
+            attempts.append(1)
+            await asyncio.sleep(10)
+        
+        started = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(policy.call(call))
+        
+        assert time.monotonic() - started < 0.5
+        assert len(attempts) >= 2 and policy.retries == len(attempts) - 1
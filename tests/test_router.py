@@ -0,0 +1,111 @@
+"""
+Tests para el router de deployments
+"""
+import asyncio
+
+import httpx
+import openai
+from langchain_core.messages import AIMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+
+from app.retry import RetryPolicy
+from app.router import Backend, BackendRouter
+from app.scheduler import LLMScheduler
+
+
+class FakeChain:
+    """Cadena que responde o falla según una lista de resultados"""
+    
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+    
+    async def ainvoke(self, inputs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, Exception):
+            raise outcome
+        return AIMessage(content=outcome)
+
+
+def _error(status: int, headers: dict = None) -> openai.APIStatusError:
+    """Error del SDK de OpenAI para un código HTTP"""
+    request = httpx.Request("POST", "https://example.openai.azure.com/")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    error_class = openai.RateLimitError if status == 429 else openai.InternalServerError
+    return error_class("error", response=response, body=None)
+
+
+def _router(*chains, weights=None, **kwargs) -> BackendRouter:
+    backends = [
+        Backend(
+            name=f"b{i}", deployment="gpt", weight=(weights or [1] * len(chains))[i],
+            llm=None, chain=chain, scheduler=LLMScheduler(max_concurrency=4)
+        )
+        for i, chain in enumerate(chains)
+    ]
+    return BackendRouter(backends, RetryPolicy(budget=5, base_delay=0.001), **kwargs)
+
+
+class TestBackendRouter:
+    """Tests para BackendRouter"""
+    
+    def test_pick_prefers_weight_and_latency(self):
+        """Test que se elige el backend con menor costo"""
+        router = _router(FakeChain(), FakeChain(), weights=[1, 3])
+        assert router.pick().name == "b1"
+        
+        router.backends[1].latency = 10
+        assert router.pick().name == "b0"
+    
+    def test_failover_on_rate_limit(self):
+        """Test que un 429 pasa la solicitud a otro backend sin esperar"""
+        limited = FakeChain(_error(429, {"retry-after": "20"}))
+        healthy = FakeChain("desde b1")
+        router = _router(limited, healthy, weights=[2, 1])
+        
+        result = asyncio.run(router.ainvoke("conv", {}, 10))
+        
+        assert result.content == "desde b1"
+        assert router.failovers == 1 and router.retry_policy.retries == 0
+        assert router.pick() is router.backends[1]
+        assert router.backends[0].scheduler.pauses == 1
+    
+    def test_circuit_opens_after_repeated_failures(self):
+        """Test que un backend con fallos consecutivos queda fuera"""
+        failing = FakeChain(*[_error(500) for _ in range(3)])
+        router = _router(failing, FakeChain(), weights=[5, 1], failure_threshold=2)
+        
+        for _ in range(2):
+            assert asyncio.run(router.ainvoke("conv", {}, 10)).content == "ok"
+        
+        assert router.get_statistics()["backends"]["b0"]["circuit"] == "open"
+        asyncio.run(router.ainvoke("conv", {}, 10))
+        assert failing.calls == 2
+    
+    def test_other_prompt_runs_on_backend_llm_through_scheduler(self):
+        """Test que otro prompt (p. ej. el de resumen) usa el LLM y la cuota del backend"""
+        bound = []
+        
+        class FakeLLM:
+            def bind(self, **kwargs):
+                bound.append(kwargs)
+                return RunnableLambda(lambda prompt: AIMessage(content=prompt.to_string()))
+        
+        router = _router(FakeChain())
+        router.backends[0].llm = FakeLLM()
+        prompt = ChatPromptTemplate.from_messages([("human", "resume: {texto}")])
+        
+        async def run():
+            first = await router.ainvoke("conv", {"texto": "a"}, 10, prompt=prompt, max_tokens=50)
+            second = await router.ainvoke("conv", {"texto": "b"}, 10, prompt=prompt, max_tokens=50)
+            return first, second
+        
+        first, second = asyncio.run(run())
+        
+        assert first.content.endswith("resume: a") and second.content.endswith("resume: b")
+        assert first.response_metadata["deployment"] == "gpt"
+        assert bound == [{"max_tokens": 50}]
+        assert router.backends[0].chain.calls == 0
+        assert router.backends[0].scheduler.granted == 2
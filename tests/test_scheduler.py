@@ -0,0 +1,67 @@
+"""
+Tests para el planificador de llamadas al modelo
+"""
+import asyncio
+
+import pytest
+
+from app.scheduler import LLMScheduler, SchedulerBusyError, TokenBucket
+
+
+async def _run_jobs(scheduler, keys, order):
+    """Lanza una llamada por clave y registra el orden en que obtienen permiso"""
+    async def job(key):
+        try:
+            async with scheduler.slot(key, 10):
+                order.append(key)
+                await asyncio.sleep(0.001)
+        except SchedulerBusyError:
+            order.append(f"busy:{key}")
+    
+    await asyncio.gather(*(job(key) for key in keys))
+
+
+class TestLLMScheduler:
+    """Tests para LLMScheduler y TokenBucket"""
+    
+    def test_fair_order_between_conversations(self):
+        """Test que una conversación con muchos mensajes no acapara la cola"""
+        order = []
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=10)
+        asyncio.run(_run_jobs(scheduler, ["a", "a", "a", "b", "c"], order))
+        
+        assert order == ["a", "a", "b", "c", "a"]
+        assert scheduler.in_flight == 0 and scheduler.queued == 0
+    
+    def test_full_queue_fails_fast(self):
+        """Test que se rechaza cuando la cola está llena"""
+        order = []
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=1)
+        asyncio.run(_run_jobs(scheduler, ["a", "b", "c"], order))
+        
+        assert order == ["a", "busy:c", "b"]
+        assert scheduler.get_statistics()["rejected"] == 1
+    
+    def test_queue_timeout(self):
+        """Test que la espera en cola expira con SchedulerBusyError"""
+        async def main():
+            scheduler = LLMScheduler(max_concurrency=1, queue_timeout=0.01)
+            ticket = await scheduler.acquire("a")
+            with pytest.raises(SchedulerBusyError):
+                await scheduler.acquire("b")
+            scheduler.release(ticket)
+            return scheduler
+        
+        scheduler = asyncio.run(main())
+        assert scheduler.timed_out == 1 and scheduler.queued == 0
+    
+    def test_token_bucket_wait_time(self):
+        """Test del cálculo de espera y la devolución de tokens"""
+        now = [0.0]
+        bucket = TokenBucket(600, clock=lambda: now[0])
+        bucket.consume(600)
+        assert bucket.wait_time(100) == pytest.approx(10)
+        
+        bucket.consume(-50)
+        now[0] = 5
+        assert bucket.wait_time(100) == 0
@@ -0,0 +1,99 @@
+"""
+Tests para las sesiones y el almacén acotado de conversaciones
+"""
+from app.session import ChatSession, SessionCache, SessionSpillStore
+
+
+class FakeClock:
+    """Reloj controlable para los tests"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self) -> float:
+        return self.now
+
+
+class MemorySpill(SessionSpillStore):
+    """Spill store en memoria para verificar el desalojo"""
+    
+    def __init__(self):
+        self.saved = {}
+    
+    def save(self, session):
+        self.saved[session.session_id] = session
+    
+    def load(self, session_id):
+        return self.saved.pop(session_id, None)
+
+
+class TestChatSession:
+    """Tests para ChatSession"""
+    
+    def test_add_turn_and_clear(self):
+        """Test historial, contadores y tamaño aproximado"""
+        session = ChatSession("c1")
+        empty_size = session.approx_bytes
+        
+        session.add_turn("hola", "¡hola!")
+        assert session.message_count == 2
+        assert session.history[0] == ("human", "hola")
+        assert session.approx_bytes > empty_size
+        
+        session.clear()
+        assert session.message_count == 0
+        assert session.approx_bytes == empty_size
+
+
+class TestSessionCache:
+    """Tests para SessionCache"""
+    
+    def test_lru_eviction(self):
+        """Test desalojo de la sesión menos usada al superar el máximo"""
+        cache = SessionCache(max_sessions=2, idle_ttl=0, max_bytes=0)
+        cache.get_or_create("a")
+        cache.get_or_create("b")
+        cache.get_or_create("a")
+        cache.get_or_create("c")
+        
+        assert "a" in cache and "c" in cache
+        assert "b" not in cache
+        assert cache.get_stats()["evicted_lru"] == 1
+    
+    def test_idle_ttl(self):
+        """Test expiración de sesiones inactivas"""
+        clock = FakeClock()
+        cache = SessionCache(
+            max_sessions=0, idle_ttl=60, max_bytes=0, sweep_interval=0, clock=clock
+        )
+        cache.get_or_create("a")
+        clock.now += 120
+        cache.get_or_create("b")
+        
+        assert "a" not in cache
+        assert cache.get_stats()["evicted_ttl"] == 1
+    
+    def test_memory_budget(self):
+        """Test desalojo por presupuesto de memoria"""
+        cache = SessionCache(max_sessions=0, idle_ttl=0, max_bytes=2000)
+        cache.get_or_create("a").add_turn("x" * 1500, "y")
+        cache.get_or_create("a")
+        cache.get_or_create("b")
+        
+        assert "a" not in cache
+        assert cache.total_bytes <= 2000
+        assert cache.get_stats()["evicted_memory"] == 1
+    
+    def test_spill_and_restore(self):
+        """Test que las sesiones desalojadas se guardan y se restauran"""
+        spill = MemorySpill()
+        cache = SessionCache(max_sessions=1, idle_ttl=0, max_bytes=0, spill_store=spill)
+        cache.get_or_create("a").add_turn("hola", "¡hola!")
+        cache.get_or_create("b")
+        assert "a" in spill.saved
+        
+        restored = cache.get_or_create("a")
+        assert restored.message_count == 2
+        stats = cache.get_stats()
+        assert stats["spilled"] == 2
+        assert stats["restored"] == 1
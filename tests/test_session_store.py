@@ -0,0 +1,171 @@
+"""
+Tests para el almacén compartido de sesiones
+"""
+import asyncio
+
+import pytest
+
+from app.memory import SummaryState
+from app.session import ChatSession
+from app.session_store import (
+    MemorySessionStore,
+    RedisSessionStore,
+    RespConnection,
+    SessionStore,
+    SQLiteSessionStore,
+    WriteBehindWriter,
+)
+
+
+class FakeRedisServer:
+    """Servidor local que habla RESP con los comandos que usa el almacén"""
+    
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+        self.server = None
+    
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+    
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+    
+    async def _read_command(self, reader):
+        header = await reader.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+    
+    async def _serve(self, reader, writer):
+        while True:
+            args = await self._read_command(reader)
+            if args is None:
+                break
+            name = args[0].decode().upper()
+            self.commands.append(name)
+            if name == "GET":
+                value = self.data.get(args[1])
+                if value is None:
+                    writer.write(b"$-1\r\n")
+                else:
+                    writer.write(b"$%d\r\n%s\r\n" % (len(value), value))
+            elif name == "SET":
+                self.data[args[1]] = args[2]
+                writer.write(b"+OK\r\n")
+            elif name == "DEL":
+                removed = sum(self.data.pop(key, None) is not None for key in args[1:])
+                writer.write(b":%d\r\n" % removed)
+            else:
+                writer.write(b"-ERR unknown command\r\n")
+            await writer.drain()
+        writer.close()
+
+
+def _session(session_id="c1"):
+    session = ChatSession(session_id)
+    session.add_turn("hola", "¡Hola! ¿En qué ayudo?")
+    session.total_tokens_used = 42
+    session.total_calls = 1
+    return session
+
+
+class TestSessionSerialization:
+    """Tests para ChatSession.to_dict/from_dict"""
+    
+    def test_round_trip_keeps_history_counters_and_summary(self):
+        """Test que la sesión restaurada conserva historial, contadores y resumen"""
+        session = _session()
+        state = SummaryState()
+        state.summary = "El usuario saludó"
+        state.pending = [("human", "antes")]
+        session.memory_state = state
+        
+        restored = ChatSession.from_dict(session.to_dict())
+        
+        assert restored.history == session.history
+        assert restored.total_tokens_used == 42
+        assert restored.version == session.version == 1
+        assert SummaryState.from_dict(restored.memory_state).pending == [("human", "antes")]
+
+
+class TestSessionStores:
+    """Tests para los backends del almacén"""
+    
+    def test_store_interface_is_abstract(self):
+        """Test que un almacén debe implementar load, save_many y delete_many"""
+        class PartialStore(SessionStore):
+            async def load(self, session_id):
+                return None
+        
+        with pytest.raises(TypeError):
+            SessionStore()
+        with pytest.raises(TypeError):
+            PartialStore()
+    
+    def test_sqlite_store(self, tmp_path):
+        """Test que SQLite guarda, lee, expira y elimina sesiones"""
+        now = [1000.0]
+        store = SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=60, clock=lambda: now[0])
+        
+        async def main():
+            await store.save_many({"c1": _session("c1").to_dict(), "c2": _session("c2").to_dict()})
+            assert (await store.load("c1"))["h"][0] == ["human", "hola"]
+            await store.delete_many(["c2"])
+            assert await store.load("c2") is None
+            now[0] += 61
+            assert await store.load("c1") is None
+            await store.close()
+        
+        asyncio.run(main())
+    
+    def test_redis_store_against_local_server(self):
+        """Test que el backend Redis envía los lotes en pipeline y lee lo escrito"""
+        server = FakeRedisServer()
+        
+        async def main():
+            port = await server.start()
+            store = RedisSessionStore(RespConnection(port=port), ttl=60, prefix="t:")
+            await store.save_many({"c1": _session("c1").to_dict(), "c2": _session("c2").to_dict()})
+            loaded = await store.load("c1")
+            await store.delete_many(["c2"])
+            missing = await store.load("c2")
+            await store.close()
+            await server.stop()
+            return loaded, missing
+        
+        loaded, missing = asyncio.run(main())
+        assert loaded["tokens"] == 42
+        assert missing is None
+        assert server.commands == ["SET", "SET", "GET", "DEL", "GET"]
+
+
+class TestWriteBehindWriter:
+    """Tests para la escritura diferida"""
+    
+    def test_coalesces_turns_into_one_write(self):
+        """Test que varios turnos dentro del intervalo se escriben una sola vez"""
+        store = MemorySessionStore()
+        writer = WriteBehindWriter(store, interval=0.05)
+        session = _session()
+        
+        async def main():
+            writer.mark(session)
+            session.add_turn("otra", "respuesta")
+            writer.mark(session)
+            assert await store.load("c1") is None
+            await asyncio.sleep(0.1)
+            loaded = await store.load("c1")
+            await writer.close()
+            return loaded
+        
+        loaded = asyncio.run(main())
+        assert len(loaded["h"]) == 4
+        assert writer.get_statistics()["writes"] == 1
+        assert writer.coalesced == 1
@@ -0,0 +1,41 @@
+"""
+Tests para el reporte de arranque
+"""
+from app.startup import PROCESS_STARTED, StartupReport
+
+
+class TestStartupReport:
+    """Tests para StartupReport"""
+    
+    def test_report_times_phases_and_imports(self):
+        """Test que el reporte mide fases e importaciones desde su creación"""
+        now = [10.0]
+        report = StartupReport(clock=lambda: now[0])
+        
+        now[0] = 10.05
+        report.mark_serving()
+        with report.phase("bot"):
+            now[0] = 10.25
+        report.import_modules(["json", "modulo_que_no_existe"])
+        report.mark_ready()
+        
+        result = report.get_report()
+        assert result["ready"] is True
+        assert result["serving_after_s"] == 0.05
+        assert result["ready_after_s"] == 0.25
+        assert result["phases_ms"] == {"bot": 200.0}
+        assert list(result["imports_ms"]) == ["json"]
+    
+    def test_failure_is_reported(self):
+        """Test que un error de construcción queda en el reporte"""
+        report = StartupReport()
+        report.mark_failed(RuntimeError("sin credenciales"))
+        
+        result = report.get_report()
+        assert result["ready"] is False
+        assert result["ready_after_s"] is None
+        assert result["error"] == "RuntimeError: sin credenciales"
+    
+    def test_default_start_is_process_start(self):
+        """Test que por defecto los tiempos se miden desde la importación de app.startup"""
+        assert StartupReport().started == PROCESS_STARTED
@@ -0,0 +1,115 @@
+"""
+Tests para las respuestas progresivas en Teams
+"""
+import asyncio
+
+from botbuilder.schema import ResourceResponse
+
+from bot.streaming import StreamingReply
+
+
+class FakeTurnContext:
+    """Contexto que registra los mensajes enviados y actualizados"""
+    
+    def __init__(self, fail_updates: bool = False):
+        self.sent = []
+        self.updates = []
+        self.fail_updates = fail_updates
+    
+    async def send_activity(self, activity):
+        self.sent.append(activity.text)
+        return ResourceResponse(id=f"act-{len(self.sent)}")
+    
+    async def update_activity(self, activity):
+        if self.fail_updates:
+            raise RuntimeError("el canal no permite actualizar")
+        self.updates.append(activity.text)
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def _stream(reply: StreamingReply, *parts) -> str:
+    return asyncio.run(reply.stream(_chunks(*parts)))
+
+
+class TestStreamingReply:
+    """Tests para StreamingReply"""
+    
+    def test_updates_are_coalesced_and_flushed(self):
+        """Test que las actualizaciones se agrupan por tamaño e intervalo y se envía el final"""
+        context = FakeTurnContext()
+        reply = StreamingReply(context, min_interval=0, min_chars=10)
+        
+        text = _stream(reply, *["abcd"] * 7)
+        
+        assert text == "abcd" * 7
+        assert context.sent == ["abcd"]
+        # Actualizaciones al juntar 10 caracteres nuevos, más el texto final
+        assert context.updates == ["abcd" * 4, "abcd" * 7]
+        
+        context = FakeTurnContext()
+        reply = StreamingReply(context, min_interval=60, min_chars=1)
+        _stream(reply, *["abcd"] * 7)
+        assert context.updates == ["abcd" * 7]
+    
+    def test_falls_back_to_new_message_when_updates_fail(self):
+        """Test que si el canal no acepta actualizaciones el resto se envía como mensaje nuevo"""
+        context = FakeTurnContext(fail_updates=True)
+        reply = StreamingReply(context, min_interval=0, min_chars=1)
+        
+        _stream(reply, "Hola", ", ¿cómo", " estás?")
+        
+        assert context.updates == []
+        assert context.sent == ["Hola", ", ¿cómo estás?"]
+    
+    def test_unsafe_text_is_never_shown(self):
+        """Test que el texto acumulado se modera antes de mostrarse y la generación se detiene"""
+        context = FakeTurnContext()
+        checked = []
+        
+        async def moderate(text):
+            checked.append(text)
+            return "prohibido" not in text
+        
+        consumed = []
+        
+        async def chunks():
+            for part in ("Respuesta ", "con contenido ", "prohibido", " y más", " texto"):
+                consumed.append(part)
+                yield part
+        
+        reply = StreamingReply(context, min_interval=0, min_chars=1, moderate=moderate)
+        asyncio.run(reply.stream(chunks()))
+        
+        assert reply.blocked
+        assert checked[0] == "Respuesta "
+        assert all("prohibido" not in text for text in context.sent + context.updates)
+        assert len(consumed) == 3
+        
+        asyncio.run(reply.finish("Aviso"))
+        assert context.updates[-1] == "Aviso"
+    
+    def test_long_stream_bounds_moderation(self):
+        """Test que una respuesta larga se modera por bloques y no por prefijos crecientes"""
+        context = FakeTurnContext()
+        checked = []
+        
+        async def moderate(text):
+            checked.append(text)
+            return True
+        
+        reply = StreamingReply(
+            context, min_interval=0, min_chars=60, moderate=moderate, moderation_chars=400
+        )
+        parts = [f"palabra{i:04d} " for i in range(1000)]
+        text = _stream(reply, *parts)
+        
+        assert len(text) == 12000
+        # Primer envío, una verificación cada 400 caracteres y la del texto completo
+        assert reply.moderation_calls == len(checked) <= 2 + 12000 // 400
+        assert checked[-1] == text
+        assert sum(len(chunk) for chunk in checked[:-1]) < 2 * len(text)
+        assert context.updates[-1] == text
@@ -0,0 +1,124 @@
+"""
+Tests para el bot de Teams
+"""
+import asyncio
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage
+
+from app import chat_engine
+from app.chat_engine import AIFoundryChatEngine
+from app.config import BotConfig
+from app.memory import ConversationMemory
+from app.metrics import TURN_LATENCY
+from app.tracing import get_tracer
+from bot.conversation_manager import ConversationTurns
+from bot.teams_bot import BLOCKED_INPUT_RESPONSE, TeamsAIFoundryBot
+
+
+class FakeRouter:
+    """Router que responde y avisa cuando terminó de generar"""
+    
+    def __init__(self):
+        self.calls = 0
+        self.generated = asyncio.Event()
+    
+    async def ainvoke(self, key, inputs, prompt_tokens):
+        self.calls += 1
+        self.generated.set()
+        return AIMessage(content="respuesta del modelo")
+
+
+class SlowUnsafeModeration:
+    """Moderación que rechaza la entrada recién después de que el modelo respondió"""
+    
+    def __init__(self, router):
+        self.router = router
+        self.checked = []
+    
+    async def is_content_safe(self, text):
+        self.checked.append(text)
+        await self.router.generated.wait()
+        return False
+
+
+class FakeTurnContext:
+    """Contexto que registra las actividades enviadas"""
+    
+    def __init__(self, text=""):
+        self.activity = SimpleNamespace(
+            from_property=SimpleNamespace(id="user-1", name="Usuario"),
+            conversation=SimpleNamespace(id="conv"),
+            text=text,
+        )
+        self.sent = []
+    
+    async def send_activity(self, activity):
+        self.sent.append(activity)
+
+
+class TestConcurrentModeration:
+    """Tests para la moderación de entrada en paralelo con el modelo"""
+    
+    def test_unsafe_input_discards_finished_generation(self, monkeypatch):
+        """Test que si la moderación rechaza después de generar, nada se envía ni se guarda"""
+        router = FakeRouter()
+        shared = SimpleNamespace(
+            router=router, memory=ConversationMemory(), response_cache=None, retriever=None
+        )
+        monkeypatch.setattr(chat_engine, "_shared", shared)
+        monkeypatch.setattr(BotConfig, "ENABLE_STREAMING", False)
+        
+        engine = AIFoundryChatEngine("conv")
+        bot = TeamsAIFoundryBot.__new__(TeamsAIFoundryBot)
+        bot.tracer = get_tracer()
+        bot.content_safety = SlowUnsafeModeration(router)
+        bot.conversation_manager = SimpleNamespace(get_or_create_engine=lambda _: engine)
+        context = FakeTurnContext()
+        
+        asyncio.run(bot._process_message(context, "conv", "mensaje inseguro"))
+        
+        assert router.calls == 1
+        assert bot.content_safety.checked == ["mensaje inseguro"]
+        texts = [getattr(activity, "text", activity) for activity in context.sent]
+        assert texts[-1] == BLOCKED_INPUT_RESPONSE
+        assert "respuesta del modelo" not in texts
+        assert engine.session.history == []
+
+
+class TestTurnLatency:
+    """Tests para la latencia de turnos"""
+    
+    def test_latency_is_recorded_for_failed_and_coalesced_turns(self):
+        """Test que los turnos con error y los agrupados también registran su latencia"""
+        turns = ConversationTurns(coalesce=True)
+        bot = TeamsAIFoundryBot.__new__(TeamsAIFoundryBot)
+        bot.tracer = get_tracer()
+        bot.conversation_manager = SimpleNamespace(turn=turns.turn)
+        
+        async def process(turn_context, conversation_id, text):
+            await asyncio.sleep(0.01)
+            if text == "hola":
+                raise RuntimeError("fallo del modelo")
+        
+        bot._process_message = process
+        before = {
+            outcome: TURN_LATENCY.get_count("message", outcome)
+            for outcome in ("ok", "error", "coalesced")
+        }
+        
+        async def main():
+            first = asyncio.ensure_future(bot.on_message_activity(FakeTurnContext("hola")))
+            await asyncio.sleep(0)
+            await asyncio.gather(
+                first,
+                bot.on_message_activity(FakeTurnContext("duda")),
+                bot.on_message_activity(FakeTurnContext("otra")),
+            )
+        
+        asyncio.run(main())
+        
+        # "hola" falla; "otra" se agrega al turno de "duda", que termina bien
+        assert TURN_LATENCY.get_count("message", "error") - before["error"] == 1
+        assert TURN_LATENCY.get_count("message", "ok") - before["ok"] == 1
+        assert TURN_LATENCY.get_count("message", "coalesced") - before["coalesced"] == 1
@@ -0,0 +1,57 @@
+"""
+Tests para las trazas por etapa
+"""
+import io
+import json
+
+from app.tracing import NOOP_SPAN, JsonLinesExporter, Tracer
+
+
+class TestTracer:
+    """Tests para Tracer"""
+    
+    def test_sampled_turn_exports_nested_spans(self):
+        """Test que un turno muestreado se exporta en OTLP/JSON con sus etapas anidadas"""
+        stream = io.StringIO()
+        tracer = Tracer(JsonLinesExporter(stream), sample_rate=1.0)
+        
+        with tracer.trace("teams.turn", **{"conversation.id": "conv-1"}) as root:
+            with tracer.span("moderation.input") as moderation:
+                moderation.set_attribute("moderation.safe", True)
+            llm = tracer.start_span("llm.stream")
+            llm.set_attribute("llm.tokens", 42)
+            llm.end()
+        tracer.close()
+        
+        request = json.loads(stream.getvalue().splitlines()[0])
+        spans = {span["name"]: span for span in request["resourceSpans"][0]["scopeSpans"][0]["spans"]}
+        assert set(spans) == {"teams.turn", "moderation.input", "llm.stream"}
+        assert "parentSpanId" not in spans["teams.turn"]
+        assert spans["moderation.input"]["parentSpanId"] == root.span_id
+        assert spans["llm.stream"]["parentSpanId"] == root.span_id
+        assert {span["traceId"] for span in spans.values()} == {root.trace.trace_id}
+        assert spans["teams.turn"]["attributes"] == [
+            {"key": "conversation.id", "value": {"stringValue": "conv-1"}}
+        ]
+        assert spans["llm.stream"]["attributes"] == [{"key": "llm.tokens", "value": {"intValue": "42"}}]
+        assert tracer.get_statistics()["exported"] == 1
+    
+    def test_unsampled_turns_are_free_unless_slow(self):
+        """Test que sin muestreo no se exporta nada salvo los turnos que superan el umbral"""
+        stream = io.StringIO()
+        assert Tracer(JsonLinesExporter(stream)).trace("teams.turn") is NOOP_SPAN
+        
+        tracer = Tracer(JsonLinesExporter(stream), slow_threshold=0.05, random_source=lambda: 0.99)
+        with tracer.trace("teams.turn") as fast:
+            with tracer.span("llm.invoke"):
+                pass
+        with tracer.trace("teams.turn") as slow:
+            slow.start -= 100_000_000  # 100 ms
+        tracer.close()
+        
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["traceId"] == slow.trace.trace_id
+        assert fast.trace.spans
+        assert tracer.get_statistics()["slow"] == 1
+        assert tracer.span("fuera.de.turno") is NOOP_SPAN
@@ -0,0 +1,49 @@
+"""
+Tests para la contabilidad de uso de tokens
+"""
+from langchain_core.messages import AIMessage
+
+from app.usage import UsageTracker, read_usage
+
+
+class TestUsageTracker:
+    """Tests para UsageTracker"""
+    
+    def test_read_usage_from_response(self):
+        """Test que el uso se lee de usage_metadata o del token_usage del proveedor"""
+        message = AIMessage(
+            content="hola",
+            usage_metadata={"input_tokens": 12, "output_tokens": 3, "total_tokens": 15}
+        )
+        assert read_usage(message) == (12, 3)
+        
+        message = AIMessage(
+            content="hola",
+            response_metadata={"token_usage": {"prompt_tokens": 7, "completion_tokens": 2}}
+        )
+        assert read_usage(message) == (7, 2)
+        assert read_usage(AIMessage(content="hola")) is None
+    
+    def test_aggregates_by_key_and_window(self):
+        """Test que cada llamada suma a su conversación, usuario, deployment y ventana"""
+        now = [1000.0]
+        tracker = UsageTracker(window=60, windows=3, max_keys=2, clock=lambda: now[0])
+        
+        tracker.record("conv-1", "ana", "gpt-4o", 100, 20)
+        now[0] += 60
+        tracker.record("conv-2", "ana", "gpt-4o-eu", 50, 10, estimated=True)
+        tracker.record("conv-3", "luis", "gpt-4o", 10, 5)
+        
+        assert tracker.get_user("ana") == {
+            "calls": 2, "prompt_tokens": 150, "completion_tokens": 30,
+            "total_tokens": 180, "estimated_calls": 1,
+        }
+        assert tracker.get_conversation("conv-1")["calls"] == 0
+        assert tracker.get_conversation("conv-3")["total_tokens"] == 15
+        
+        stats = tracker.get_statistics()
+        assert stats["total"]["total_tokens"] == 195
+        assert stats["deployments"]["gpt-4o"]["calls"] == 2
+        assert stats["last_window"]["calls"] == 2
+        assert stats["last_span"]["calls"] == 3
+        assert list(stats["top_users"]) == ["ana", "luis"]
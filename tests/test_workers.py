@@ -0,0 +1,76 @@
+"""
+Tests para el modo multiproceso (afinidad de conversaciones)
+"""
+import asyncio
+
+from aiohttp import web
+
+from bot.workers import (
+    FORWARDED_HEADER,
+    ConversationAffinity,
+    WorkerInfo,
+    conversation_owner,
+    worker_socket_path,
+)
+
+
+class TestConversationAffinity:
+    """Tests para ConversationAffinity"""
+    
+    def test_owner_is_stable_and_spread(self):
+        """Test que cada conversación tiene siempre el mismo dueño y se reparten entre workers"""
+        owners = [conversation_owner(f"conv-{i}", 4) for i in range(200)]
+        assert owners == [conversation_owner(f"conv-{i}", 4) for i in range(200)]
+        assert set(owners) == {0, 1, 2, 3}
+    
+    def test_forward_to_owner_and_fallback(self, tmp_path):
+        """Test que la actividad llega al dueño y, si no se puede conectar, se atiende aquí"""
+        received = []
+        
+        async def messages(request):
+            received.append((request.headers.get(FORWARDED_HEADER), await request.json()))
+            return web.json_response({"ok": True}, status=200)
+        
+        async def main():
+            app = web.Application()
+            app.router.add_post("/api/messages", messages)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.UnixSite(runner, worker_socket_path(str(tmp_path), 1)).start()
+            
+            affinity = ConversationAffinity(WorkerInfo(0, 3), str(tmp_path))
+            headers = {"Authorization": "Bearer t", "Content-Type": "application/json"}
+            response = await affinity.forward(1, b'{"type": "message"}', headers)
+            missing = await affinity.forward(2, b"{}", headers)
+            await affinity.close()
+            await runner.cleanup()
+            return response, missing, affinity.worker
+        
+        response, missing, worker = asyncio.run(main())
+        assert response.status == 200
+        assert received == [("0", {"type": "message"})]
+        assert missing is None
+        assert (worker.forwarded, worker.forward_errors) == (1, 1)
+    
+    def test_forward_timeout_is_not_handled_locally(self, tmp_path):
+        """Test que una actividad entregada al dueño que no responde no se atiende otra vez"""
+        async def messages(request):
+            await asyncio.sleep(1)
+            return web.Response(status=200)
+        
+        async def main():
+            app = web.Application()
+            app.router.add_post("/api/messages", messages)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.UnixSite(runner, worker_socket_path(str(tmp_path), 1)).start()
+            
+            affinity = ConversationAffinity(WorkerInfo(0, 2), str(tmp_path), timeout=0.1)
+            response = await affinity.forward(1, b"{}", {})
+            await affinity.close()
+            await runner.cleanup()
+            return response, affinity.worker
+        
+        response, worker = asyncio.run(main())
+        assert response.status == 504
+        assert worker.forward_errors == 1